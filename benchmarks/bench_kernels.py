@@ -0,0 +1,242 @@
+"""Microbenchmarks of the numeric hot paths of kwirevirtsys_fast, run headless on plain python.
+
+The add-in modules are imported against the adsk stand-in in benchmarks/standin (value types for
+Point3D/Vector3D/Line3D, stubs for everything else). Bodies are synthetic triangle meshes whose
+pointContainment and mesh calculator are backed by kwiremath.TriangleMesh.
+
+    python benchmarks/bench_kernels.py                  # run and compare with benchmarks/baseline.json
+    python benchmarks/bench_kernels.py --save           # run and store the results as the new baseline
+    python benchmarks/bench_kernels.py -k trilaterate   # run only the benchmarks whose name contains the string
+"""
+
+import os, sys, types, io, json, time, platform, argparse, importlib, contextlib
+import numpy as np
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(HERE)
+BASELINE_PATH = os.path.join(HERE, 'baseline.json')
+SEED = 20240501
+
+# the stand-in goes after the installed packages, so a real pyperclip is used when available
+sys.path.append(os.path.join(HERE, 'standin'))
+
+
+def _load_addin():
+    "import the add-in as a package without running the commands/__init__.py registration (it needs every command's dependencies)"
+    package = 'kwirevirtsys_addin'
+    for name, path in ((package, ROOT), (f'{package}.commands', os.path.join(ROOT, 'commands'))):
+        module = types.ModuleType(name)
+        module.__path__ = [path]
+        sys.modules[name] = module
+    entry = importlib.import_module(f'{package}.commands.kwirevirtsys_fast.entry')
+    config = importlib.import_module(f'{package}.config')
+    kmath = importlib.import_module(f'{package}.lib.kwiremath')
+    return entry, config, kmath
+
+entry, config, kmath = _load_addin()
+import adsk.core
+
+
+# ---------------------------- SYNTHETIC SCENE ---------------------------- #
+
+def uv_sphere(center, radius: float, rings: int, segments: int) -> tuple[np.ndarray, np.ndarray]:
+    "closed triangle mesh of a sphere (vertices, triangles)"
+    theta = np.linspace(0, np.pi, rings + 1)[1:-1]
+    phi = np.linspace(0, 2*np.pi, segments, endpoint=False)
+    ring = np.stack([
+        np.outer(np.sin(theta), np.cos(phi)),
+        np.outer(np.sin(theta), np.sin(phi)),
+        np.outer(np.cos(theta), np.ones_like(phi))], axis=-1).reshape(-1, 3)
+    vertices = np.vstack([[0, 0, 1], ring, [0, 0, -1]]) * radius + center
+
+    triangles = []
+    south = len(vertices) - 1
+    for s in range(segments):
+        n = (s + 1) % segments
+        triangles.append([0, 1 + s, 1 + n])
+        triangles.append([south, 1 + (rings - 2)*segments + n, 1 + (rings - 2)*segments + s])
+    for r in range(rings - 2):
+        for s in range(segments):
+            n = (s + 1) % segments
+            a, b = 1 + r*segments + s, 1 + r*segments + n
+            c, d = a + segments, b + segments
+            triangles += [[a, c, b], [b, c, d]]
+    return vertices, np.array(triangles)
+
+
+class MeshBody:
+    "BRepBody stand-in backed by a triangle mesh"
+
+    def __init__(self, name: str, vertices: np.ndarray, triangles: np.ndarray):
+        self.name = name
+        self.mesh = kmath.TriangleMesh(vertices, triangles)
+        self.vertices = vertices
+        self.triangles = triangles
+        self.boundingBox = types.SimpleNamespace(
+            minPoint=adsk.core.Point3D.create(*vertices.min(axis=0)),
+            maxPoint=adsk.core.Point3D.create(*vertices.max(axis=0)))
+        self.volume = float(np.abs(np.einsum('ij,ij->i', vertices[triangles[:, 0]], np.cross(vertices[triangles[:, 1]], vertices[triangles[:, 2]]))).sum() / 6)
+        self.meshManager = self
+
+    # meshManager / mesh calculator
+    def createMeshCalculator(self):
+        return self
+
+    def setQuality(self, quality):
+        pass
+
+    def calculate(self):
+        return types.SimpleNamespace(nodeCoordinatesAsDouble=self.vertices.ravel().tolist(), nodeIndices=self.triangles.ravel().tolist())
+
+    def pointContainment(self, p: adsk.core.Point3D) -> int:
+        "0 inside (PointInsidePointContainment), 2 outside (PointOutsidePointContainment)"
+        return 0 if self.mesh.contains(np.array(p.asArray())) else 2
+
+
+def make_scene(rng: np.random.Generator) -> dict:
+    "skin sphere (5 cm) with 3 anatomy spheres inside, 4 markers on the skin and a PA with noisy caliper distances"
+    skin = MeshBody("skin", *uv_sphere(np.zeros(3), 5.0, 64, 128))
+    anatomy = [MeshBody(f"bone:{i}", *uv_sphere(c, 1.0, 32, 64)) for i, c in enumerate(rng.uniform(-2.5, 2.5, (3, 3)))]
+
+    directions = rng.normal(size=(4, 3))
+    markers = 5.0 * directions / np.linalg.norm(directions, axis=1)[:, None]
+    P1 = rng.uniform(-1, 1, 3)
+    P2 = P1 + 4.0 * np.array([0.3, 0.2, 0.93])
+    noise = 0.05 # cm
+    return {
+        "skin": skin,
+        "anatomy": anatomy,
+        "markers": markers,
+        "markers_3D": [adsk.core.Point3D.create(*m) for m in markers],
+        "P1": P1,
+        "P2": P2,
+        "d1": np.linalg.norm(markers - P1, axis=1) + rng.normal(0, noise, 4),
+        "d2": np.linalg.norm(markers - P2, axis=1) + rng.normal(0, noise, 4),
+    }
+
+
+# ------------------------------ BENCHMARKS ------------------------------ #
+
+def trilaterate3D(m1: adsk.core.Point3D, m1P: float, m2: adsk.core.Point3D, m2P: float, m3: adsk.core.Point3D, m3P: float):
+    "the 2 intersection points of 3 spheres through the batch kernel, from and to Point3D (single triple cost of the former entry helper)"
+    ans1, ans2, _ = kmath.trilaterate3D_batch(
+        np.array([m1.asArray()]), np.array([m1P]),
+        np.array([m2.asArray()]), np.array([m2P]),
+        np.array([m3.asArray()]), np.array([m3P]))
+    if np.isnan(ans1).any() or np.isnan(ans2).any():
+        return None
+    return [adsk.core.Point3D.create(*ans1[0]), adsk.core.Point3D.create(*ans2[0])]
+
+
+def benchmarks(scene: dict, rng: np.random.Generator) -> dict:
+    "name -> (setup, function); setup runs untimed before the measurements"
+    A, B, C, D = scene["markers_3D"]
+    d1 = scene["d1"]
+    P1_3D = adsk.core.Point3D.create(*scene["P1"])
+    direction = adsk.core.Vector3D.create(*(scene["P2"] - scene["P1"]))
+    direction.normalize()
+    outside = adsk.core.Point3D.create(0, 0, 8)
+    inward = adsk.core.Vector3D.create(0, 0, -1)
+    P3 = scene["P1"] + 10.8 * np.asarray(direction.asArray())
+
+    N = 1000
+    batch_markers = scene["markers"] + rng.normal(0, 0.01, (N, 4, 3))
+    batch_distances = np.hstack([scene["d1"], scene["d2"]]) + rng.normal(0, 0.05, (N, 8))
+    candidates, *_ = kmath.trilaterate3D_4spheres_batch(scene["markers"], scene["d1"][None])
+    frames = kmath.MarkerFrames(scene["markers"])
+
+    def set_method(method: str):
+        return lambda: setattr(config, 'TRILATERATION_METHOD', method)
+
+    def anatomy_distance():
+        for body in scene["anatomy"]:
+            kmath.capsule_mesh_distance(body.mesh, scene["P1"], P3, entry.kwirer)
+
+    return {
+        "trilaterate3D": (None, lambda: trilaterate3D(A, d1[0], B, d1[1], C, d1[2])),
+        "trilaterate3D_4spheres[cluster]": (set_method('cluster'), lambda: entry.trilaterate3D_4spheres(A, d1[0], B, d1[1], C, d1[2], D, d1[3])),
+        "trilaterate3D_4spheres[cluster, frames]": (set_method('cluster'), lambda: entry.trilaterate3D_4spheres(A, d1[0], B, d1[1], C, d1[2], D, d1[3], frames)),
+        "trilaterate3D_4spheres[lsq]": (set_method('lsq'), lambda: entry.trilaterate3D_4spheres(A, d1[0], B, d1[1], C, d1[2], D, d1[3])),
+        "select_cluster[k=4]": (None, lambda: kmath.select_cluster(candidates, 4)),
+        f"trilaterate_PA_batch[N={N}]": (None, lambda: kmath.trilaterate_PA_batch(batch_markers, batch_distances)),
+        f"MarkerFrames.locate[N={2*N}]": (None, lambda: frames.locate(batch_distances.reshape(2*N, 4))),
+        f"multilaterate_lsq_batch[N={2*N}]": (None, lambda: kmath.multilaterate_lsq_batch(np.repeat(batch_markers, 2, axis=0), batch_distances.reshape(2*N, 4))),
+        "intersect_point[pointContainment]": (None, lambda: entry.intersect_point(scene["skin"], outside, inward, 200, 12)),
+        "intersect_skin[raycast]": (lambda: entry.mesh_cache.get_body_mesh(scene["skin"]), lambda: entry.intersect_skin(scene["skin"], P1_3D, direction)),
+        "anatomy_distance[capsule x3]": (None, anatomy_distance),
+        "gdop_grid[40^3]": (None, lambda: kmath.gdop_grid(scene["markers"], scene["P1"] - 5, scene["P1"] + 5, 40)),
+    }
+
+
+def measure(function, min_time: float, max_runs: int, warmup: int = 3) -> dict:
+    "runs the function until min_time seconds or max_runs runs; returns throughput and latency percentiles"
+    for _ in range(warmup):
+        function()
+    times = []
+    start = time.perf_counter()
+    while len(times) < max_runs and (time.perf_counter() - start) < min_time:
+        t = time.perf_counter_ns()
+        function()
+        times.append(time.perf_counter_ns() - t)
+    times = np.array(times) / 1e3 # us
+    return {
+        "runs": len(times),
+        "ops_per_s": round(1e6 / times.mean(), 2),
+        "p50_us": round(float(np.percentile(times, 50)), 2),
+        "p99_us": round(float(np.percentile(times, 99)), 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('-k', dest='filter', default='', help='run only the benchmarks whose name contains this string')
+    parser.add_argument('--min-time', type=float, default=1.0, help='seconds spent measuring each benchmark')
+    parser.add_argument('--max-runs', type=int, default=10000)
+    parser.add_argument('--baseline', default=BASELINE_PATH)
+    parser.add_argument('--save', action='store_true', help='store the results as the baseline')
+    parser.add_argument('--threshold', type=float, default=0.2, help='p50 slowdown reported as a regression')
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(SEED)
+    scene = make_scene(rng)
+    method = config.TRILATERATION_METHOD
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)["results"]
+
+    results = {}
+    print(f"{'benchmark':<38} {'ops/s':>12} {'p50 us':>12} {'p99 us':>12}  vs baseline p50")
+    for name, (setup, function) in benchmarks(scene, rng).items():
+        if args.filter not in name:
+            continue
+        with contextlib.redirect_stdout(io.StringIO()): # futil.log prints every message
+            if setup:
+                setup()
+            r = measure(function, args.min_time, args.max_runs)
+        config.TRILATERATION_METHOD = method
+        results[name] = r
+
+        compare = ""
+        if name in baseline:
+            ratio = r["p50_us"] / baseline[name]["p50_us"]
+            compare = f"x{ratio:.2f}" + ("  REGRESSION" if ratio > 1 + args.threshold else "")
+        print(f"{name:<38} {r['ops_per_s']:>12.1f} {r['p50_us']:>12.1f} {r['p99_us']:>12.1f}  {compare}")
+
+    if args.save:
+        with open(args.baseline, 'w') as f:
+            json.dump({
+                "meta": {
+                    "date": time.strftime('%Y-%m-%d'),
+                    "python": platform.python_version(),
+                    "numpy": np.__version__,
+                    "machine": f"{platform.system()} {platform.machine()}",
+                    "seed": SEED,
+                },
+                "results": results}, f, indent=2)
+        print(f"baseline saved: {args.baseline}")
+
+
+if __name__ == '__main__':
+    main()
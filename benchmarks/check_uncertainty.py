@@ -0,0 +1,73 @@
+"""Monte Carlo check of the error propagation of kwiremath.uncertainty through the trilateration solvers.
+
+Random marker layouts and kwire points are solved again with noisy distances and marker positions; the RMS
+error of the solutions is compared with the propagated one (PA_confidence). The propagation is linear: draws
+that jump to another branch of the solver (the mirror of the markers plane, another cluster) are left out of
+the RMS, and so are the layouts where PA_covariance falls back from the cluster jacobians to the lsq ones.
+
+    python benchmarks/check_uncertainty.py              # exits with 1 when a solver is off its tolerance
+    python benchmarks/check_uncertainty.py --layouts 50 --draws 1000
+"""
+
+import sys, argparse
+import numpy as np
+
+from bench_kernels import kmath
+
+uncertainty = sys.modules[kmath.__name__ + '.uncertainty']
+
+SEED = 20240501
+SIGMA_DISTANCE = 0.05   # cm, caliper
+SIGMA_MARKER = 0.02     # cm, per coordinate
+BRANCH_SIGMAS = 10      # draws further than this many propagated sigmas are on another branch of the solver
+# propagated / Monte Carlo RMS over the layouts: the median within MEDIAN_TOLERANCE of 1, the 5 and 95 percentiles in TAILS
+MEDIAN_TOLERANCE = 0.05
+TAILS = (0.8, 1.25)
+
+
+def random_PA(rng: np.random.Generator) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    "markers (4, 3) spread around the entry point, P1 and P2 (3,) along a kwire, exact distances (8,)"
+    markers = rng.uniform(-6, 6, (4, 3)) * [1, 1, 0.4]
+    P1 = np.array([0, 0, -8.]) + rng.normal(0, 2, 3)
+    P2 = P1 + np.array([0, 0, 6.]) + rng.normal(0, 1, 3)
+    distances = np.concatenate([np.linalg.norm(P1 - markers, axis=1), np.linalg.norm(P2 - markers, axis=1)])
+    return markers, P1, P2, distances
+
+
+def linear_cluster(markers, distances) -> bool:
+    "whether PA_covariance propagates P1 through the cluster jacobians (no lsq fallback)"
+    _, _, margin = uncertainty.cluster_jacobians(markers, distances[None, :4], 4)
+    return margin[0] > uncertainty.LINEAR_MARGIN * max(SIGMA_DISTANCE, SIGMA_MARKER)
+
+
+def check(method: str, layouts: int, draws: int) -> bool:
+    rng = np.random.default_rng(SEED)
+    ratios = []
+    for _ in range(layouts):
+        markers, P1, P2, distances = random_PA(rng)
+        m = markers + rng.normal(0, SIGMA_MARKER, (draws, 4, 3))
+        d = distances[:4] + rng.normal(0, SIGMA_DISTANCE, (draws, 4))
+        if method == 'cluster' and not linear_cluster(markers, distances):
+            continue
+
+        propagated = kmath.PA_confidence(
+            markers, P1, P2, SIGMA_DISTANCE, SIGMA_MARKER, distances[None], method, 4)[0][0]
+        points, _, _ = kmath.trilaterate_4spheres(m, d, method, 4)
+        errors = np.linalg.norm(points - P1, axis=1)
+        errors = errors[errors < BRANCH_SIGMAS * propagated]
+        ratios.append(propagated / np.sqrt((errors**2).mean()))
+
+    low, median, high = np.percentile(ratios, [5, 50, 95])
+    ok = abs(median - 1) < MEDIAN_TOLERANCE and TAILS[0] < low and high < TAILS[1]
+    print(f'{method:8s} {len(ratios):4d} layouts  propagated / monte carlo RMS: '
+          f'median {median:.3f}  5% {low:.3f}  95% {high:.3f}  {"ok" if ok else "FAIL"}')
+    return ok
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--layouts', type=int, default=200, help='random marker layouts per solver')
+    parser.add_argument('--draws', type=int, default=2000, help='noisy draws per layout')
+    args = parser.parse_args()
+    results = [check(method, args.layouts, args.draws) for method in ('lsq', 'cluster')]
+    sys.exit(0 if all(results) else 1)
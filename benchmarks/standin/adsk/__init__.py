@@ -0,0 +1,2 @@
+# headless stand-in of the fusion 360 api, used by the benchmarks (see benchmarks/bench_kernels.py)
+from . import core, fusion
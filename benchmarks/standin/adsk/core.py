@@ -0,0 +1,112 @@
+# headless stand-in of adsk.core: real value types for the geometry the kernels use,
+# permissive stubs for everything else the add-in touches at import time
+import math
+
+
+class _StubMeta(type):
+    "any attribute, call or iteration of a stub gives back another stub"
+
+    def __getattr__(cls, name):
+        if name.startswith('__'):
+            raise AttributeError(name)
+        return _stub(name)
+
+    def __call__(cls, *args, **kwargs):
+        return _stub(cls.__name__)
+
+    def __iter__(cls):
+        return iter(())
+
+    def __len__(cls):
+        return 0
+
+
+class _Stub(metaclass=_StubMeta):
+    pass
+
+
+def _stub(name: str):
+    return _StubMeta(name, (_Stub,), {})
+
+
+def __getattr__(name):
+    if name.startswith('__'):
+        raise AttributeError(name)
+    return _stub(name)
+
+
+class Vector3D:
+    def __init__(self, x: float, y: float, z: float):
+        self.x, self.y, self.z = x, y, z
+
+    @staticmethod
+    def create(x: float = 0.0, y: float = 0.0, z: float = 0.0) -> 'Vector3D':
+        return Vector3D(x, y, z)
+
+    def copy(self) -> 'Vector3D':
+        return Vector3D(self.x, self.y, self.z)
+
+    def asArray(self) -> list[float]:
+        return [self.x, self.y, self.z]
+
+    @property
+    def length(self) -> float:
+        return math.sqrt(self.x*self.x + self.y*self.y + self.z*self.z)
+
+    def normalize(self) -> bool:
+        l = self.length
+        if l == 0:
+            return False
+        self.x, self.y, self.z = self.x/l, self.y/l, self.z/l
+        return True
+
+    def scaleBy(self, scale: float) -> bool:
+        self.x, self.y, self.z = self.x*scale, self.y*scale, self.z*scale
+        return True
+
+    def add(self, v: 'Vector3D') -> bool:
+        self.x, self.y, self.z = self.x + v.x, self.y + v.y, self.z + v.z
+        return True
+
+    def dotProduct(self, v: 'Vector3D') -> float:
+        return self.x*v.x + self.y*v.y + self.z*v.z
+
+    def crossProduct(self, v: 'Vector3D') -> 'Vector3D':
+        return Vector3D(self.y*v.z - self.z*v.y, self.z*v.x - self.x*v.z, self.x*v.y - self.y*v.x)
+
+    def angleTo(self, v: 'Vector3D') -> float:
+        return math.acos(max(-1.0, min(1.0, self.dotProduct(v) / (self.length * v.length))))
+
+
+class Point3D:
+    def __init__(self, x: float, y: float, z: float):
+        self.x, self.y, self.z = x, y, z
+
+    @staticmethod
+    def create(x: float = 0.0, y: float = 0.0, z: float = 0.0) -> 'Point3D':
+        return Point3D(x, y, z)
+
+    def copy(self) -> 'Point3D':
+        return Point3D(self.x, self.y, self.z)
+
+    def asArray(self) -> list[float]:
+        return [self.x, self.y, self.z]
+
+    def distanceTo(self, p: 'Point3D') -> float:
+        return math.sqrt((self.x - p.x)**2 + (self.y - p.y)**2 + (self.z - p.z)**2)
+
+    def vectorTo(self, p: 'Point3D') -> Vector3D:
+        return Vector3D(p.x - self.x, p.y - self.y, p.z - self.z)
+
+    def translateBy(self, v: Vector3D) -> bool:
+        self.x, self.y, self.z = self.x + v.x, self.y + v.y, self.z + v.z
+        return True
+
+
+class Line3D:
+    def __init__(self, startPoint: Point3D, endPoint: Point3D):
+        self.startPoint, self.endPoint = startPoint, endPoint
+
+    @staticmethod
+    def create(startPoint: Point3D, endPoint: Point3D) -> 'Line3D':
+        return Line3D(startPoint.copy(), endPoint.copy())
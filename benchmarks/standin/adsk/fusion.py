@@ -0,0 +1,8 @@
+# headless stand-in of adsk.fusion: every name is a permissive stub (see core.py)
+from .core import _stub
+
+
+def __getattr__(name):
+    if name.startswith('__'):
+        raise AttributeError(name)
+    return _stub(name)
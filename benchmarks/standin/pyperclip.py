@@ -0,0 +1,6 @@
+# headless stand-in of pyperclip, used when it is not installed
+def copy(text: str):
+    pass
+
+def paste() -> str:
+    return ""
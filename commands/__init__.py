@@ -8,6 +8,8 @@ from .kwiredistsys import entry as kwiredistsys
 from .kwirevirtsys_fast import entry as kwirevirtsys_fast
 from .deleteobjects import entry as deleteobjects
 from .cameraorbit import entry as cameraorbit
+from .markerlayout import entry as markerlayout
+from .paoverlay import entry as paoverlay
 
 # TODO add your imported modules to this list.
 # Fusion will automatically call the start() and stop() functions.
@@ -17,6 +19,8 @@ commands = [
     # kwiredistsys,
     # deleteobjects,
     cameraorbit,
+    markerlayout,
+    paoverlay,
 ]
 
 
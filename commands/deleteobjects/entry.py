@@ -2,7 +2,7 @@ import adsk.core, adsk.fusion
 import os
 import traceback
 from ...lib import fusion360utils as futil
-import itertools, time
+import itertools
 
 _app = adsk.core.Application.get()
 _ui = _app.userInterface
@@ -111,30 +111,51 @@ def command_execute(args: adsk.core.CommandEventArgs):
         cps = []
         counter_ca = 0
         cas = []
-        for occ in _rootComp.allOccurrences:
-            for brb in occ.bRepBodies:
-                if saveflag not in brb.name and deleteflag in brb.name:
-                    # futil.log(f"\t{occ.name}") # debug
-                    brbs.append(brb.name)
-                    brb.deleteMe()
-                    counter_brb += 1
+        index = futil.get_design_index()
+        deleted = set() # entity tokens of the native objects already deleted
+
+        def delete(entity) -> str | None:
+            """delete the native object of the entity once (the occurrence proxies of a component share it);
+            returns its name, None if it was already deleted"""
+            if not entity.isValid: # proxy of a native object deleted through another occurrence
+                return None
+            native = entity.nativeObject or entity
+            token = native.entityToken
+            if token in deleted or not native.isValid:
+                return None
+            deleted.add(token)
+            name = native.name
+            native.deleteMe()
+            return name
+
+        for name, bodies in index.bodies.items():
+            if saveflag not in name and deleteflag in name:
+                for brb in bodies:
+                    # futil.log(f"\t{brb.name}") # debug
+                    deleted_name = delete(brb)
+                    if deleted_name != None:
+                        brbs.append(deleted_name)
+                        counter_brb += 1
                     
-            for cp in occ.component.constructionPoints:
-                if saveflag not in cp.name and deleteflag in cp.name:
-                    # futil.log(f"\t{occ.name}") # debug
-                    cps.append(cp.name)
-                    cp.deleteMe()
-                    counter_cp += 1
-                    
-            for ca in occ.component.constructionAxes:
-                if saveflag not in ca.name and deleteflag in ca.name:
-                    # futil.log(f"{\tocc.name}") # debug
-                    cas.append(ca.name)
-                    ca.deleteMe()
-                    counter_ca += 1
-            
-            time.sleep(0.1)
+        for name, points in index.construction_points.items():
+            if saveflag not in name and deleteflag in name:
+                for _, cp in points:
+                    # futil.log(f"\t{cp.name}") # debug
+                    deleted_name = delete(cp)
+                    if deleted_name != None:
+                        cps.append(deleted_name)
+                        counter_cp += 1
                     
+        for name, axes in index.construction_axes.items():
+            if saveflag not in name and deleteflag in name:
+                for _, ca in axes:
+                    # futil.log(f"\t{ca.name}") # debug
+                    deleted_name = delete(ca)
+                    if deleted_name != None:
+                        cas.append(deleted_name)
+                        counter_ca += 1
+
+        futil.invalidate_design_index()
         
         _ui.messageBox(f"deleted: {counter_brb} bodies, {counter_cp} points, {counter_ca} axis")
         _ui.messageBox(f"bodies: {brbs},\n\npoints{cps},\n\naxis{cas}")
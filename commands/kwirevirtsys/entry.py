@@ -40,6 +40,12 @@ markB_last: adsk.fusion.ConstructionPoint = None
 markC_last: adsk.fusion.ConstructionPoint = None
 markD_last: adsk.fusion.ConstructionPoint = None
 
+PREVIEW_COLOR = (255, 128, 0, 255) # RGBA of the kwire drawn by the dialog preview
+
+# dialog preview: kwire points of the last inputs, reused by the next previews and committed by OK
+_preview: tuple = None # (input values, P1, P2)
+_preview_graphics: adsk.fusion.CustomGraphicsGroup = None
+
 # Executed when add-in is run.
 def start():
     # Create a command Definition.
@@ -159,27 +165,9 @@ def command_execute(args: adsk.core.CommandEventArgs):
     futil.log(f'{CMD_NAME}: Command Execute Event')
 
     try:
-        def getCoord(cp):
-            selcomin = adsk.core.SelectionCommandInput.cast(cp)
-            cpcoord = adsk.fusion.ConstructionPoint.cast(selcomin.selection(0).entity).geometry.asArray()
-            cpcoord = list(cpcoord)
-            return cpcoord
-
         inputs = args.command.commandInputs
-        markAcoord = getCoord(inputs.itemById('marker_a'))
-        markBcoord = getCoord(inputs.itemById('marker_b'))
-        markCcoord = getCoord(inputs.itemById('marker_c'))
-        markDcoord = getCoord(inputs.itemById('marker_d'))
-
-        P1 = trilaterate3D([markAcoord + [adsk.core.ValueCommandInput.cast(inputs.itemById('distP1A')).value],
-                            markBcoord + [adsk.core.ValueCommandInput.cast(inputs.itemById('distP1B')).value],
-                            markCcoord + [adsk.core.ValueCommandInput.cast(inputs.itemById('distP1C')).value],
-                            markDcoord + [adsk.core.ValueCommandInput.cast(inputs.itemById('distP1D')).value]])
-        
-        P2 = trilaterate3D([markAcoord + [adsk.core.ValueCommandInput.cast(inputs.itemById('distP2A')).value],
-                            markBcoord + [adsk.core.ValueCommandInput.cast(inputs.itemById('distP2B')).value],
-                            markCcoord + [adsk.core.ValueCommandInput.cast(inputs.itemById('distP2C')).value],
-                            markDcoord + [adsk.core.ValueCommandInput.cast(inputs.itemById('distP2D')).value]])
+        clear_preview()
+        P1, P2 = get_kwire_points(inputs)
 
         create_cylinder(_rootComp,
                         P1,
@@ -192,6 +180,50 @@ def command_execute(args: adsk.core.CommandEventArgs):
             _ui.messageBox('Failed:\n{}'.format(traceback.format_exc()))
 
 
+def get_kwire_points(inputs: adsk.core.CommandInputs) -> tuple[adsk.core.Point3D, adsk.core.Point3D]:
+    "trilaterated P1 and P2 of the dialog inputs, reused from the last preview if the inputs did not change"
+    def getCoord(cp):
+        selcomin = adsk.core.SelectionCommandInput.cast(cp)
+        cpcoord = adsk.fusion.ConstructionPoint.cast(selcomin.selection(0).entity).geometry.asArray()
+        cpcoord = list(cpcoord)
+        return cpcoord
+
+    def getDistance(id):
+        return adsk.core.ValueCommandInput.cast(inputs.itemById(id)).value
+
+    markers = [getCoord(inputs.itemById(id)) for id in ('marker_a', 'marker_b', 'marker_c', 'marker_d')]
+    distP1 = [getDistance(id) for id in ('distP1A', 'distP1B', 'distP1C', 'distP1D')]
+    distP2 = [getDistance(id) for id in ('distP2A', 'distP2B', 'distP2C', 'distP2D')]
+
+    global _preview
+    key = (tuple(map(tuple, markers)), tuple(distP1), tuple(distP2))
+    if _preview == None or _preview[0] != key:
+        P1 = trilaterate3D([m + [r] for m, r in zip(markers, distP1)])
+        P2 = trilaterate3D([m + [r] for m, r in zip(markers, distP2)])
+        _preview = (key, P1, P2)
+    return _preview[1], _preview[2]
+
+
+def draw_preview(P1: adsk.core.Point3D, P2: adsk.core.Point3D, lenght: float):
+    "draws the kwire (from P1, lenght along P1->P2) and P1, P2 as custom graphics, deleted by the next preview or when the command ends"
+    global _preview_graphics
+    _preview_graphics = _rootComp.customGraphicsGroups.add()
+    p1 = np.array(P1.asArray())
+    p2 = np.array(P2.asArray())
+    tip = p1 + (p2 - p1) / np.linalg.norm(p2 - p1) * lenght
+    color = np.array([PREVIEW_COLOR], dtype=np.uint8)
+    futil.add_segments(_preview_graphics, p1[None], tip[None], color, weight=3.0)
+    futil.add_points(_preview_graphics, np.stack([p1, p2]), np.repeat(color, 2, axis=0))
+
+
+def clear_preview():
+    "delete the preview graphics"
+    global _preview_graphics
+    if _preview_graphics != None and _preview_graphics.isValid:
+        _preview_graphics.deleteMe()
+    _preview_graphics = None
+
+
 # funziona al 99%
 def trilaterate3D(distances) -> adsk.core.Point3D:
     p1=np.array(distances[0][:3])
@@ -223,37 +255,13 @@ def trilaterate3D(distances) -> adsk.core.Point3D:
 
 
 def create_cylinder(rootComp: adsk.fusion.Component, p1, p2, r, lenght):
+    "kwire body (temporary brep cylinder from p1 towards p2) in a new component"
     try:
-        planes = rootComp.constructionPlanes
-        planeInput = adsk.fusion.ConstructionPlaneInput.cast(planes.createInput())
-        planeInput.setByPlane(adsk.core.Plane.create(p1, p1.vectorTo(p2)))   
-        plane1 = rootComp.constructionPlanes.add(planeInput)
-        sketch1 = rootComp.sketches.add(plane1)
-        
-        circles = sketch1.sketchCurves.sketchCircles
-        circle1 = circles.addByCenterRadius(adsk.core.Point3D.create(0, 0, 0), r)
-        profile0 = sketch1.profiles.item(0)
-
-        extrudes = adsk.fusion.ExtrudeFeatures.cast(rootComp.features.extrudeFeatures)
-        dist = adsk.core.ValueInput.createByReal(lenght)
-        extInput = extrudes.createInput(profile0, adsk.fusion.FeatureOperations.NewBodyFeatureOperation)
-        extInput.setOneSideExtent(adsk.fusion.DistanceExtentDefinition.create(dist), adsk.fusion.ExtentDirections.PositiveExtentDirection)
-        extInput.isSolid = True
-        ext = extrudes.add(extInput)
-
-        cilinder = ext.bodies.item(0).createComponent()
-
-        plane1.deleteMe()
-        sketch1.deleteMe()
-        ext.dissolve()
-
-        # axes = rootComp.constructionAxes
-        # axisInput = axes.createInput()  
-        # axisInput.setByLine(adsk.core.InfiniteLine3D.create(p1, p2))
-        # axes.add(axisInput) 
-        
+        cilinder = futil.add_body(futil.cylinder_body(p1, p2, r, lenght)).createComponent()
+
     except:
-        _ui.messageBox("couldn't extrude body")
+        futil.log(f'{CMD_NAME}: create_cylinder failed:\n{traceback.format_exc()}', adsk.core.LogLevels.ErrorLogLevel)
+        _ui.messageBox("couldn't create body:\n{}".format(traceback.format_exc()))
 
 
 # This event handler is called when the command needs to compute a new preview in the graphics window.
@@ -262,6 +270,15 @@ def command_preview(args: adsk.core.CommandEventArgs):
     futil.log(f'{CMD_NAME}: Command Preview Event')
     inputs = args.command.commandInputs
 
+    # args.isValidResult stays False so OK still runs command_execute, which reuses the previewed points
+    clear_preview()
+    try:
+        P1, P2 = get_kwire_points(inputs)
+        draw_preview(P1, P2, adsk.core.ValueCommandInput.cast(inputs.itemById('kwirel')).value)
+
+    except:
+        futil.log(f'{CMD_NAME}: no preview:\n{traceback.format_exc()}')
+
 
 # This event handler is called when the user changes anything in the command dialog
 # allowing you to modify values of other inputs based on that change.
@@ -298,11 +315,10 @@ def command_validate_input(args: adsk.core.ValidateInputsEventArgs):
     inputs = args.inputs
     
     # Verify the validity of the input values. This controls if the OK button is enabled or not.
-    valueInput = inputs.itemById('value_input')
-    if args.areInputsValid or valueInput.value >= 0:
-        args.areInputsValid = True
-    else:
-        args.areInputsValid = False
+    markers = [adsk.core.SelectionCommandInput.cast(inputs.itemById(id)) for id in ('marker_a', 'marker_b', 'marker_c', 'marker_d')]
+    distances = [adsk.core.ValueCommandInput.cast(inputs.itemById(id)) for id in
+                 ('distP1A', 'distP1B', 'distP1C', 'distP1D', 'distP2A', 'distP2B', 'distP2C', 'distP2D', 'kwirer', 'kwirel')]
+    args.areInputsValid = all(m.selectionCount == 1 for m in markers) and all(d.value > 0 for d in distances)
         
 
 # This event handler is called when the command terminates.
@@ -310,5 +326,7 @@ def command_destroy(args: adsk.core.CommandEventArgs):
     # General logging for debug.
     futil.log(f'{CMD_NAME}: Command Destroy Event')
 
-    global local_handlers
+    global local_handlers, _preview
+    clear_preview()
+    _preview = None
     local_handlers = []
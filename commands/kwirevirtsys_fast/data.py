@@ -1,13 +1,49 @@
-from dataclasses import dataclass
+from dataclasses import dataclass, fields, MISSING
+from operator import attrgetter
+from copy import copy
+from typing import get_origin, get_args
 import json
 
-@dataclass
+@dataclass(slots=True)
 class data_elaboration:
+    """base of the data records: the fields of each record class are compiled once into a spec
+    (see compile_spec) used to encode and decode records without walking their attributes"""
+
     def dumps(self) -> str:
             "dump data into json string"
-            return json.dumps(self, default=lambda o: o.__dict__, sort_keys=False)
+            return json.dumps(self.to_dict(), sort_keys=False)
+
+    def to_dict(self) -> dict:
+        spec = self._spec
+        return dict(zip(spec.names, spec.getter(self)))
+
+    @classmethod
+    def from_dict(cls, d: dict, strict: bool = False):
+        """build a record from a decoded json object, coercing each value to its field type.
+        Required fields (see compile_spec) missing from d or null raise; the other missing fields (older
+        companion versions) take their documented default, None when they have none (strict raises instead);
+        fields unknown to the record are ignored"""
+        spec = cls._spec
+        values = []
+        for name, coerce, default, required in spec.fields:
+            v = d.get(name)
+            if v is None:
+                if required or (strict and name not in d and default is MISSING):
+                    raise ValueError(f"{cls.__name__}: missing field {name}")
+                values.append(None if name in d or default is MISSING else copy(default))
+            else:
+                try:
+                    values.append(coerce(v))
+                except (TypeError, ValueError) as e:
+                    raise ValueError(f"{cls.__name__}: field {name}: {e}")
+        return cls(*values)
+
+    @classmethod
+    def loads(cls, s: str, strict: bool = False):
+        "load data from json string"
+        return cls.from_dict(json.loads(s), strict)
 
-@dataclass
+@dataclass(slots=True)
 class PAdata(data_elaboration):
     "positioning attempt data"
 
@@ -64,8 +100,8 @@ class PAdata(data_elaboration):
     P2_mean_max: float
     P2_mean:  float
     
-    confidence_position: float
-    confidence_angle: float
+    confidence_position: float; "RMS position error of P1 (mm) propagated from the caliper and marker uncertainty"
+    confidence_angle: float; "RMS angular error of the PA axis (degrees) propagated from the caliper and marker uncertainty"
     estimate_hit: bool
     target: str; "k-wire target component name on fusion 360"
     markers: dict[str, str]
@@ -91,4 +127,135 @@ class PAdata(data_elaboration):
     distance_P2e_PA_target_Y: float
     distance_P2e_PA_target_Z: float
     
-    delta_id_PA_target: float; "delta insertion depth"
\ No newline at end of file
+    delta_id_PA_target: float; "delta insertion depth"
+
+    P1_coord: list[float] = None; "computed P1 coordinates [x, y, z] in mm (design coordinates)"
+    P2_coord: list[float] = None
+    P2e_coord: list[float] = None
+    P3_coord: list[float] = None
+
+
+# measurement inputs of a PAdata: a record missing any of them can't be analyzed, loading it raises
+PA_REQUIRED_FIELDS = ("P1A", "P1B", "P1C", "P1D", "P2A", "P2B", "P2C", "P2D", "markers", "target", "phase")
+
+# documented values of the PAdata fields missing from a record (the others are None: unknown, not computed)
+PA_MISSING_DEFAULTS = {
+    "entered_articulation": -1, # not analyzed
+    "fusion_computed": False,
+    "anatomy": {},              # no anatomy structure to measure
+}
+
+# fields of a PAdata filled by the kwirevirtsys_fast compute (kept by the result cache, see results_store.py)
+PA_COMPUTED_FIELDS = (
+    "P1A_F", "P1B_F", "P1C_F", "P1D_F", "P2A_F", "P2B_F", "P2C_F", "P2D_F", "P2eA_F", "P2eB_F", "P2eC_F", "P2eD_F",
+    "P1_mean", "P2_mean", "confidence_position", "confidence_angle", "fusion_computed", "anatomy", "hit_count",
+    "angle_PA_target",
+    "distance_P1_PA_target", "distance_P1_PA_target_X", "distance_P1_PA_target_Y", "distance_P1_PA_target_Z",
+    "distance_P2_PA_target", "distance_P2_PA_target_X", "distance_P2_PA_target_Y", "distance_P2_PA_target_Z",
+    "distance_P2e_PA_target", "distance_P2e_PA_target_X", "distance_P2e_PA_target_Y", "distance_P2e_PA_target_Z",
+    "delta_id_PA_target", "P1_coord", "P2_coord", "P2e_coord", "P3_coord",
+)
+
+
+# ------------------------- FIELD SPEC ------------------------- #
+
+class _Coerce:
+    "converts a decoded json value to a field type"
+
+    def __init__(self, t):
+        self.t = t
+        origin = get_origin(t)
+        if origin == dict:
+            key, value = (_Coerce(a) for a in get_args(t))
+            self.convert = lambda v: {key(k): value(x) for k, x in _expect(v, dict).items()}
+        elif origin == list:
+            item, = (_Coerce(a) for a in get_args(t))
+            self.convert = lambda v: [item(x) for x in _expect(v, list)]
+        elif t == bool:
+            self.convert = _to_bool
+        elif t == int:
+            self.convert = _to_int
+        elif t == float:
+            self.convert = _to_float
+        elif t == str:
+            self.convert = lambda v: _expect(v, str)
+        else:
+            self.convert = lambda v: v
+
+    def __call__(self, v):
+        # values already of the field type (the common case) are kept as they are
+        if type(v) == self.t:
+            return v
+        return self.convert(v)
+
+
+def _to_int(v) -> int:
+    "integral values only: 2.0 -> 2, 2.7 and true raise instead of losing data"
+    if isinstance(v, float):
+        if not v.is_integer():
+            raise ValueError(f"not an integer: {v!r}")
+        return int(v)
+    if isinstance(v, str):
+        return int(v)
+    raise ValueError(f"not an integer: {v!r}")
+
+
+def _to_float(v) -> float:
+    "numbers and their strings only: true raises instead of becoming 1.0"
+    if isinstance(v, (int, float, str)) and not isinstance(v, bool):
+        return float(v)
+    raise ValueError(f"not a number: {v!r}")
+
+
+def _expect(v, t):
+    "json containers and strings are taken as they are, of their own type only"
+    if not isinstance(v, t):
+        raise ValueError(f"not a {t.__name__}: {v!r}")
+    return v
+
+
+def _to_bool(v) -> bool:
+    "true/false, 0/1 or their strings only"
+    if isinstance(v, str):
+        if v.lower() in ("true", "1"):
+            return True
+        if v.lower() in ("false", "0", ""):
+            return False
+    elif isinstance(v, (int, float)) and v in (0, 1):
+        return bool(v)
+    raise ValueError(f"not a boolean: {v!r}")
+
+
+class _Spec:
+    """precompiled fields of a record class: names, attribute getter and (name, coerce, default, required)
+    of each field, the default of a missing field being its dataclass default or else its documented one"""
+
+    def __init__(self, cls, required: tuple, defaults: dict):
+        fs = fields(cls)
+        self.names = tuple(f.name for f in fs)
+        self.getter = attrgetter(*self.names)
+        self.fields = tuple(
+            (f.name, _Coerce(f.type), defaults.get(f.name, f.default), f.name in required) for f in fs)
+
+
+def compile_spec(cls, required: tuple = (), defaults: dict = {}):
+    """compile the field spec of a record class (call once after its definition): the required fields
+    and the documented defaults of the fields without a dataclass default"""
+    cls._spec = _Spec(cls, required, defaults)
+    return cls
+
+compile_spec(PAdata, PA_REQUIRED_FIELDS, PA_MISSING_DEFAULTS)
+
+
+# ------------------------- BULK ------------------------- #
+
+def dumps_many(records: list[data_elaboration]) -> str:
+    "dump a list of records into a JSONL string (one record per line)"
+    return "\n".join(json.dumps(r.to_dict(), sort_keys=False) for r in records)
+
+def loads_many(lines, cls=PAdata, strict: bool = False) -> list:
+    "load the records of a JSONL string (or of an iterable of lines), skipping empty lines"
+    if isinstance(lines, str):
+        lines = lines.splitlines()
+    from_dict = cls.from_dict
+    return [from_dict(json.loads(line), strict) for line in lines if line.strip() != ""]
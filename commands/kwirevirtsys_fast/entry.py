@@ -1,15 +1,17 @@
 import adsk.core, adsk.fusion
-import os, string
+import os, string, time, itertools
 import traceback
 from ...lib import fusion360utils as futil
+from ...lib import kwiremath as kmath
 from ... import config
 import json
 import pyperclip
-from itertools import combinations
-import math
 
 import numpy as np
 from . import data
+from . import mesh_cache
+from . import lookups
+from . import results_store
 
 _app = adsk.core.Application.get()
 _ui = _app.userInterface
@@ -40,8 +42,23 @@ ICON_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'resource
 # they are not released and garbage collected.
 local_handlers = []
 
-kwirer: float = 0.08 # kwire radius in cm
-kwirel: float = 10.8 # kwire lenght in cm
+kwirer: float = config.KWIRE_RADIUS # kwire radius in cm
+kwirel: float = config.KWIRE_LENGTH # kwire lenght in cm
+
+# execution modes
+MODE_COMPUTE_GEOMETRY = 'compute and create geometry'
+MODE_COMPUTE = 'compute only (no timeline changes)'
+MODE_GEOMETRY = 'create geometry of computed PAs'
+MODE_SNAPSHOT = 'export design snapshot (for tools/reanalysis.py)'
+
+BATCH_CHUNK = 10 # PAs processed on the UI thread between two returns to the fusion event loop
+BATCH_BLOCK = 500 # PAs read from the input file, and trilaterated, together: the file is streamed in blocks
+
+_batch = None # running batch (see BatchRun)
+
+# dialog preview: the PA computed for the pasted json, reused by the next previews and committed by OK
+_preview: tuple = None # (PA json text, computed PAdata, computed fields taken from the result cache)
+_preview_graphics: adsk.fusion.CustomGraphicsGroup = None
 
 # Executed when add-in is run.
 def start():
@@ -81,6 +98,10 @@ def stop():
     if command_definition:
         command_definition.deleteMe()
 
+    if _batch != None:
+        _batch.cancel()
+    results_store.close_results_store()
+
 
 # Function that is called when a user clicks the corresponding button in the UI.
 # This defines the contents of the command dialog and connects to the command related events.
@@ -92,6 +113,14 @@ def command_created(args: adsk.core.CommandCreatedEventArgs):
     inputs = args.command.commandInputs
 
     _ = inputs.addStringValueInput('PA_data_str', 'import PA json data')
+    _ = inputs.addStringValueInput('PA_batch_path', 'import PA jsonl file (batch)')
+
+    execution_mode = inputs.addDropDownCommandInput('execution_mode', 'execution mode', adsk.core.DropDownStyles.TextListDropDownStyle)
+    execution_mode.listItems.add(MODE_COMPUTE_GEOMETRY, True)
+    execution_mode.listItems.add(MODE_COMPUTE, False)
+    execution_mode.listItems.add(MODE_GEOMETRY, False)
+    execution_mode.listItems.add(MODE_SNAPSHOT, False)
+    _ = inputs.addStringValueInput('PA_geometry_ids', 'PA ids to create (comma separated, empty for all)')
 
     futil.add_handler(args.command.execute, command_execute, local_handlers=local_handlers)
     futil.add_handler(args.command.inputChanged, command_input_changed, local_handlers=local_handlers)
@@ -111,6 +140,26 @@ def command_preview(args: adsk.core.CommandEventArgs):
     futil.log(f'{CMD_NAME}: Command Preview Event')
     inputs = args.command.commandInputs
 
+    # the PA is computed once per pasted json (the preview fires again on every input change) and drawn as
+    # custom graphics; nothing is persisted: args.isValidResult stays False so OK still runs command_execute,
+    # which commits it (result cache, results store), cancelling the dialog leaves no trace
+    global _preview
+    clear_preview()
+    try:
+        mode = adsk.core.DropDownCommandInput.cast(inputs.itemById('execution_mode')).selectedItem.name
+        batch_path = adsk.core.StringValueCommandInput.cast(inputs.itemById('PA_batch_path')).value.strip()
+        PA_data_str = adsk.core.StringValueCommandInput.cast(inputs.itemById('PA_data_str')).value
+        if mode not in (MODE_COMPUTE_GEOMETRY, MODE_COMPUTE) or batch_path != "" or PA_data_str.strip() == "":
+            return
+        if _preview == None or _preview[0] != PA_data_str:
+            with futil.span('preview PA'):
+                PA_data, cached = compute_PA_cached(data.PAdata.loads(PA_data_str), lookups.DesignLookups(), persist=False)
+            _preview = (PA_data_str, PA_data, cached)
+        draw_preview(_preview[1])
+
+    except:
+        futil.log(f'{CMD_NAME}: no preview:\n{traceback.format_exc()}')
+
 
 # This event handler is called when the user changes anything in the command dialog
 # allowing you to modify values of other inputs based on that change.
@@ -127,11 +176,9 @@ def command_validate_input(args: adsk.core.ValidateInputsEventArgs):
     inputs = args.inputs
     
     # Verify the validity of the input values. This controls if the OK button is enabled or not.
-    valueInput = inputs.itemById('value_input')
-    if args.areInputsValid or valueInput.value >= 0:
-        args.areInputsValid = True
-    else:
-        args.areInputsValid = False
+    PA_data_str = adsk.core.StringValueCommandInput.cast(inputs.itemById('PA_data_str')).value
+    batch_path = adsk.core.StringValueCommandInput.cast(inputs.itemById('PA_batch_path')).value
+    args.areInputsValid = PA_data_str.strip() != "" or batch_path.strip() != ""
         
 
 # This event handler is called when the command terminates.
@@ -139,6 +186,10 @@ def command_destroy(args: adsk.core.CommandEventArgs):
     # General logging for debug.
     futil.log(f'{CMD_NAME}: Command Destroy Event')
 
+    global _preview
+    clear_preview()
+    _preview = None
+
 
 # This event handler is called when the user clicks the OK button in the command dialog or 
 # is immediately called after the created event not command inputs were created for the dialog.
@@ -146,194 +197,253 @@ def command_execute(args: adsk.core.CommandEventArgs):
     # General logging for debug.
     futil.log(f'{CMD_NAME}: Command Execute Event')
 
-    def get_markers(PA_data: data.PAdata) -> dict[str, adsk.core.Point3D] | None:
-        found = {}
+    try:
+        inputs = args.command.commandInputs
 
-        for marker_letter, marker_name in PA_data.markers.items():
-            # marker_letter = "A"
-            # name          = "M:3"
-            occ = _rootComp.allOccurrences.itemByName(marker_name)
-            if occ == None:
-                futil.log(f"getMarkers: {marker_name} not found")
-                return None
+        mode = adsk.core.DropDownCommandInput.cast(inputs.itemById('execution_mode')).selectedItem.name
+        ids = adsk.core.StringValueCommandInput.cast(inputs.itemById('PA_geometry_ids')).value
+        ids = set(id.strip() for id in ids.split(",") if id.strip() != "")
+        emitter = futil.GeometryEmitter(f'{CMD_NAME} PAs') # the PA geometry is created in one timeline group
+        process = get_processor(mode, ids, emitter)
+
+        # -------------------------- BATCH JSONL ------------------------- #
+        batch_path = adsk.core.StringValueCommandInput.cast(inputs.itemById('PA_batch_path')).value.strip().strip('"')
+        if mode == MODE_SNAPSHOT:
+            if batch_path != "":
+                records = [PA_data for _, PA_data in read_PA_jsonl(batch_path) if not isinstance(PA_data, Exception)]
+                snapshot_path = f"{os.path.splitext(batch_path)[0]}.snapshot.npz"
+            else:
+                records = [data.PAdata.loads(adsk.core.StringValueCommandInput.cast(inputs.itemById('PA_data_str')).value)]
+                snapshot_path = os.path.join(os.path.dirname(config.RESULTS_DB_PATH), f"snapshot-{time.strftime('%Y%m%d-%H%M%S')}.npz")
+            export_snapshot(records, lookups.DesignLookups(), snapshot_path)
+            _ui.messageBox(f'design snapshot of {len(records)} PAs exported to:\n{snapshot_path}')
+            return
+
+        if batch_path != "":
+            run_batch(batch_path, process, emitter=emitter)
+            return
 
-            cp = occ.component.originConstructionPoint.geometry            
-            cp.transformBy(occ.transform2) # must be transformed from the occurrence coordinate axis
-            found[marker_letter] = cp
-        
-        return found
-
-    def get_anatomy_structs(PA_data: data.PAdata) -> dict[str, adsk.fusion.BRepBody] | None:
-        found = {}
-        found_count = 0
-        found_expected_count = len(PA_data.anatomy)
-
-        for k, v in PA_data.anatomy.items():
-            for occ in _rootComp.allOccurrences:
-                for brb in occ.bRepBodies:
-                    if brb.name == k:
-                        # futil.log(f"\tfound anatomy struct {k} in {occ.name}") # debug
-                        found[k] = brb
-                        found_count += 1
-        
-        if found_count == found_expected_count:
-            return found
+        # -------------------------- DATA JSON ------------------------- #
+        clear_preview()
+        PA_data_str = adsk.core.StringValueCommandInput.cast(inputs.itemById('PA_data_str')).value
+        if _preview != None and _preview[0] == PA_data_str and mode in (MODE_COMPUTE_GEOMETRY, MODE_COMPUTE):
+            _, PA_data, cached = _preview # already computed by the dialog preview
+            futil.log(f'{PA_data.id}: committing the previewed PA')
+            lookup = lookups.DesignLookups()
+            if not cached:
+                cache_PA(PA_data, lookup)
+            if mode == MODE_COMPUTE_GEOMETRY and not (cached and PA_geometry_exists(PA_data, lookup)):
+                emit_PA_geometry(PA_data, lookup, emitter)
         else:
-            futil.log(f"\tfound unexpected number of anatomy structs")
-            return None
-    
-    def get_skin() -> adsk.fusion.BRepBody | None:
-        for occ in _rootComp.allOccurrences:
-            for brb in occ.bRepBodies:
-                if brb.name == "skin":
-                    return brb
-        
-    def get_kwire_target(PA_data: data.PAdata) -> tuple[adsk.fusion.Occurrence, adsk.fusion.Component, adsk.fusion.BRepBody, adsk.core.Point3D, adsk.fusion.ConstructionAxis, adsk.core.Vector3D]:
-        "returns normalized vector"
-        
-        for occ in _rootComp.allOccurrences:
-            # futil.log(f'occurrence name: {occ.name}') # debug
-            if occ.name == PA_data.target: # ECP:1
-                target_occ = occ
-                target_comp = target_occ.component
-
-                target_brb = target_comp.bRepBodies.itemByName("target")
-
-                p1 = target_comp.constructionPoints.itemByName("target P1").geometry
-                p1.transformBy(target_occ.transform2) # must be transformed from the occurrence coordinate axis
-                
-                for occ in _rootComp.allOccurrences:
-                    if occ.name == "kwires:1":
-                        kwire_comp = occ.component
-                        p2 = kwire_comp.constructionPoints.itemByName(f"{PA_data.target} target P2").geometry # ECP:1 target P2
-                        p2.transformBy(occ.transform2) # must be transformed from the occurrence coordinate axis
-
-                _, _, vector = target_comp.zConstructionAxis.geometry.getData()
-                vector.transformBy(target_occ.transform2) # must be transformed from the occurrence coordinate axis
-                vector.normalize()
-                
-                return target_occ, target_comp, target_brb, p1, p2, vector
-    
-    def get_kwire_PA(PA_data: data.PAdata) -> tuple[adsk.fusion.Occurrence, adsk.fusion.Component]:
-        "returns normalized vector"
-        
-        for occ in _rootComp.allOccurrences:
-            # futil.log(f'occurrence name: {occ.name}') # debug
-            if occ.name == f"phase:{PA_data.phase} - {PA_data.target} PA:1": # "phase:0 - ECP:1 PA:1"
-                PA_occ = occ
-                PA_comp = PA_occ.component
-                
-                return PA_occ, PA_comp
-
-    def intersect_point(brb: adsk.fusion.BRepBody, P: adsk.core.Point3D, dir: adsk.core.Vector3D, maxtests: int, precision: int, precisionStart: int = None) -> adsk.core.Point3D | None:
-        "estimate point of intersection of a vector starting from P through a body; dir should be normalized"
+            with futil.span('parse json'):
+                PA_data = data.PAdata.loads(PA_data_str)
+            PA_data = process(PA_data, lookups.DesignLookups())
+        if PA_data == None:
+            return
+        with futil.span('emit geometry', entities=len(emitter)):
+            emitter.flush()
+        with futil.span('store result'):
+            store = results_store.get_results_store()
+            store.add(PA_data)
+            store.flush()
+
+        with futil.span('serialize'):
+            PA_data_str = PA_data.dumps()
+        futil.log(f'import this into companion (already copied in clipboard): \n{PA_data_str}')
+        pyperclip.copy(PA_data_str)
         
-        # copy as the variable seems to be referenced by a sort of pointer
-        # brb = brb.copy() # not this as it will fail (the original one must be used)
-        P   = P.copy()
-        dir = dir.copy()
+    except:
+        _ui.messageBox('Failed:\n{}'.format(traceback.format_exc()))
 
-        if precisionStart == None:
-            precisionStart = precision
-        
-        pOut = P.copy()
-        while True:
-            maxtests -= 1
-            P.translateBy(dir)
-            # createPoint_by_point3D(P) # debug
-            # futil.log(f"precision: {precision} - maxtests: {maxtests} - containment: {brb.pointContainment(P)}") # debug
-            if maxtests < 0 and precision == precisionStart:
-                # point was not found
-                return None
-            if maxtests < 0 and precision != precisionStart:
-                return P
-            if brb.pointContainment(P) == 0: # entered the body
-                if precision == 0:
-                    return P
-                else:
-                    dir.scaleBy(0.1)
-                    return intersect_point(brb, pOut, dir, maxtests, precision-1)
-            pOut = P.copy()
-            
-    try:
-        inputs = args.command.commandInputs
+    finally:
+        if futil.tracing_enabled():
+            trace_path = os.path.join(config.TRACE_DIR, f"{CMD_ID}-{time.strftime('%Y%m%d-%H%M%S')}.json")
+            futil.log(f'trace: {futil.write_trace(trace_path)} spans written to {trace_path}')
 
 
-        # -------------------------- DATA JSON ------------------------- #
-        PA_data = data.PAdata(**json.loads(adsk.core.StringValueCommandInput.cast(inputs.itemById('PA_data_str')).value))
-        markers           = get_markers(PA_data)
-        bodies            = get_anatomy_structs(PA_data)
-        skin_brb          = get_skin()
+# ------------------------------- PREVIEW -------------------------------- #
 
+def draw_preview(PA_data: data.PAdata):
+    """draws the computed kwire of the PA (P1-P3 segment, coloured by its angle to the target as in the PA overlay)
+    and its points as custom graphics, deleted by the next preview or when the command ends"""
+    global _preview_graphics
+    _preview_graphics = _rootComp.customGraphicsGroups.add()
+    points = np.array([PA_data.P1_coord, PA_data.P2_coord, PA_data.P2e_coord, PA_data.P3_coord]) / 10
+    color = futil.colormap(np.array([PA_data.angle_PA_target], dtype=float), 0, config.OVERLAY_ANGLE_MAX)
+    futil.add_segments(_preview_graphics, points[[0]], points[[3]], color, weight=3.0)
+    futil.add_points(_preview_graphics, points, np.repeat(color, len(points), axis=0))
 
-        # ------------------------ KWIRE TARGET ------------------------ #
-        kwire_target_occ, kwire_target_comp, kwire_target_brb, kwire_target_P1, kwire_target_P2, kwire_target_vector = get_kwire_target(PA_data)
-        kwire_target_P2_estimated = intersect_point(skin_brb, kwire_target_P1, kwire_target_vector, 200, 12)
 
-        kwire_target_TIP = kwire_target_comp.originConstructionPoint.geometry
-        kwire_target_TIP.transformBy(kwire_target_occ.transform2)
+def clear_preview():
+    "delete the preview graphics"
+    global _preview_graphics
+    if _preview_graphics != None and _preview_graphics.isValid:
+        _preview_graphics.deleteMe()
+    _preview_graphics = None
 
-        kwire_target_P1P2_estimated = adsk.core.Line3D.create(kwire_target_P1, kwire_target_P2_estimated)
-        kwire_target_P1TIP = adsk.core.Line3D.create(kwire_target_P1, kwire_target_TIP)
 
-        # _ = createPoint_by_point3D(kwire_target_occ, kwire_target_comp, kwire_target_P1, f"debug target P1") # debug
-        # _ = createPoint_by_point3D(kwire_target_occ, kwire_target_comp, kwire_target_P2_estimated, f"debug target P2_estimated") # debug
-        # _ = createPoint_by_point3D(kwire_target_occ, kwire_target_comp, kwire_target_TIP, f"debug target TIP") # debug
-        # _ = createAxis_by_Line3D(kwire_target_occ, kwire_target_comp, kwire_target_P1P2_estimated, f"debug target P1P2_estimated") # debug
-        # _ = createAxis_by_Line3D(kwire_target_occ, kwire_target_comp, kwire_target_P1TIP, f"debug target P1TIP") # debug
+def get_processor(mode: str, ids: set[str] = None, emitter: futil.GeometryEmitter = None):
+    """returns the function applied to each PA in the selected execution mode; it returns None for the PAs it skips.
+    The PA geometry is queued in the emitter (the caller flushes it), or created right away without one"""
 
-        # -------------------------- KWIRE PA -------------------------- #
+    @futil.span('compute and create PA')
+    def compute_and_create(PA_data: data.PAdata, lookup: lookups.DesignLookups, trilateration: tuple = None) -> data.PAdata:
+        PA_data, cached = compute_PA_cached(PA_data, lookup, trilateration)
+        if cached and PA_geometry_exists(PA_data, lookup):
+            futil.log(f'{PA_data.id}: cached result, its geometry is already in the design')
+        else:
+            emit_PA_geometry(PA_data, lookup, emitter)
+        return PA_data
 
-        kwire_PA_occ, kwire_PA_comp = get_kwire_PA(PA_data)
+    def compute(PA_data: data.PAdata, lookup: lookups.DesignLookups, trilateration: tuple = None) -> data.PAdata:
+        PA_data, _ = compute_PA_cached(PA_data, lookup, trilateration)
+        return PA_data
 
-        kwire_PA_P1, kwire_PA_P1_mean = trilaterate3D_4spheres(
+    def create(PA_data: data.PAdata, lookup: lookups.DesignLookups, trilateration: tuple = None) -> data.PAdata | None:
+        if ids and PA_data.id not in ids:
+            return None
+        emit_PA_geometry(PA_data, lookup, emitter)
+        return PA_data
+
+    if mode == MODE_COMPUTE:
+        return compute
+    if mode == MODE_GEOMETRY:
+        return create
+    return compute_and_create
+
+
+def compute_PA_cached(PA_data: data.PAdata, lookup: lookups.DesignLookups, trilateration: tuple = None, persist: bool = True) -> tuple[data.PAdata, bool]:
+    """compute_PA through the result cache of the results store (config.RESULT_CACHE): returns the PA and
+    whether its computed fields came from the cache. Entries are keyed by the PA inputs and are only used on the
+    same design geometry they were computed on, so moving a marker or editing a body invalidates them.
+    persist=False only reads the cache (see command_preview): cache_PA writes the result once it is committed"""
+    if not config.RESULT_CACHE:
+        return compute_PA(PA_data, lookup, trilateration), False
+
+    with futil.span('result cache'):
+        store = results_store.get_results_store()
+        key = results_store.input_hash(PA_data)
+        geometry = lookup.get_geometry_fingerprint(PA_data)
+        cached = None if geometry == None else store.get_cached(key, geometry)
+    if cached != None:
+        for name in data.PA_COMPUTED_FIELDS:
+            setattr(PA_data, name, getattr(cached, name))
+        return PA_data, True
+
+    PA_data = compute_PA(PA_data, lookup, trilateration)
+    if persist and geometry != None:
+        store.put_cached(key, geometry, PA_data)
+    return PA_data, False
+
+
+def cache_PA(PA_data: data.PAdata, lookup: lookups.DesignLookups):
+    "write a computed PA in the result cache (what compute_PA_cached does unless persist=False)"
+    if not config.RESULT_CACHE:
+        return
+    geometry = lookup.get_geometry_fingerprint(PA_data)
+    if geometry != None:
+        results_store.get_results_store().put_cached(results_store.input_hash(PA_data), geometry, PA_data)
+
+
+@futil.span('compute PA')
+def compute_PA(PA_data: data.PAdata, lookup: lookups.DesignLookups, trilateration: tuple = None) -> data.PAdata:
+    """run the numeric pipeline on a positioning attempt: fills the computed fields of PA_data
+    (including the coordinates needed to create its geometry later) without touching the timeline;
+    trilateration: P1 and P2 already trilaterated, with their propagated confidence (see trilaterate_rows),
+    ((P1, P1_mean, P1_outliers), (P2, P2_mean, P2_outliers), (confidence_position, confidence_angle))"""
+
+    with futil.span('lookup markers'):
+        markers       = lookup.get_markers(PA_data)
+    with futil.span('lookup anatomy'):
+        bodies        = lookup.get_anatomy_structs(PA_data)
+    with futil.span('lookup skin'):
+        skin_brb      = lookup.get_skin()
+    if markers == None or bodies == None or skin_brb == None:
+        raise Exception(f"{PA_data.id}: markers, anatomy structs or skin not found in the design")
+
+    # ------------------------ KWIRE TARGET ------------------------ #
+    with futil.span('lookup target'):
+        kwire_target = lookup.get_kwire_target(PA_data)
+    if kwire_target == None:
+        raise Exception(f"{PA_data.id}: target {PA_data.target} not found in the design")
+    kwire_target_occ, kwire_target_comp, kwire_target_brb, kwire_target_P1, kwire_target_P2, kwire_target_vector = kwire_target
+    if PA_data.target not in lookup.targets_P2_estimated: # the skin intersection of a target is shared by all its PAs
+        lookup.targets_P2_estimated[PA_data.target] = intersect_skin(skin_brb, kwire_target_P1, kwire_target_vector)
+    kwire_target_P2_estimated = lookup.targets_P2_estimated[PA_data.target]
+
+    kwire_target_TIP = kwire_target_comp.originConstructionPoint.geometry
+    kwire_target_TIP.transformBy(kwire_target_occ.transform2)
+
+    kwire_target_P1P2_estimated = adsk.core.Line3D.create(kwire_target_P1, kwire_target_P2_estimated)
+    kwire_target_P1TIP = adsk.core.Line3D.create(kwire_target_P1, kwire_target_TIP)
+
+    # _ = createPoint_by_point3D(kwire_target_occ, kwire_target_comp, kwire_target_P1, f"debug target P1") # debug
+    # _ = createPoint_by_point3D(kwire_target_occ, kwire_target_comp, kwire_target_P2_estimated, f"debug target P2_estimated") # debug
+    # _ = createPoint_by_point3D(kwire_target_occ, kwire_target_comp, kwire_target_TIP, f"debug target TIP") # debug
+    # _ = createAxis_by_Line3D(kwire_target_occ, kwire_target_comp, kwire_target_P1P2_estimated, f"debug target P1P2_estimated") # debug
+    # _ = createAxis_by_Line3D(kwire_target_occ, kwire_target_comp, kwire_target_P1TIP, f"debug target P1TIP") # debug
+
+    # -------------------------- KWIRE PA -------------------------- #
+
+    if trilateration != None:
+        (kwire_PA_P1, kwire_PA_P1_mean, kwire_PA_P1_outliers), (kwire_PA_P2, kwire_PA_P2_mean, kwire_PA_P2_outliers), confidence = trilateration
+    else:
+        frames = lookup.get_marker_frames(PA_data)
+        confidence = None
+        kwire_PA_P1, kwire_PA_P1_mean, kwire_PA_P1_outliers = trilaterate3D_4spheres(
                         markers["A"], PA_data.P1A/10,
                         markers["B"], PA_data.P1B/10,
                         markers["C"], PA_data.P1C/10,
-                        markers["D"], PA_data.P1D/10)
+                        markers["D"], PA_data.P1D/10,
+                        frames)
         
-        kwire_PA_P2, kwire_PA_P2_mean = trilaterate3D_4spheres(
+        kwire_PA_P2, kwire_PA_P2_mean, kwire_PA_P2_outliers = trilaterate3D_4spheres(
                         markers["A"], PA_data.P2A/10,
                         markers["B"], PA_data.P2B/10,
                         markers["C"], PA_data.P2C/10,
-                        markers["D"], PA_data.P2D/10)
-    
-        # futil.log(f'kwire_PA_P1 - {kwire_PA_P1.asArray()}\n kwire_PA_P2 {kwire_PA_P2.asArray()}') # debug
+                        markers["D"], PA_data.P2D/10,
+                        frames)
 
-        kwire_PA_P1P2 = adsk.core.Line3D.create(kwire_PA_P1, kwire_PA_P2)
-        
-        kwire_PA_vector = kwire_PA_P1.vectorTo(kwire_PA_P2)#  vector representing the direction of kwire (normalized)
-        kwire_PA_vector.normalize()
-        kwire_PA_P2_estimated = intersect_point(skin_brb, kwire_PA_P1, kwire_PA_vector, 200, 12)
-        
-        kwire_PA_vector_lenght = kwire_PA_vector.copy() # vector representing the full lenght of kwire
-        kwire_PA_vector_lenght.scaleBy(kwirel)
-        kwire_PA_P3 = kwire_PA_P1.copy()
-        kwire_PA_P3.translateBy(kwire_PA_vector_lenght)
-
-        # futil.log(f'kwire_PA_P2_estimated: {kwire_PA_P2_estimated.asArray()}')
-
-        _ = createPoint_by_point3D(kwire_PA_occ, kwire_PA_comp, kwire_PA_P1, f"{PA_data.id} P1")
-        _ = createPoint_by_point3D(kwire_PA_occ, kwire_PA_comp, kwire_PA_P2, f"{PA_data.id} P2")
-        _ = createPoint_by_point3D(kwire_PA_occ, kwire_PA_comp, kwire_PA_P2_estimated, f"{PA_data.id} P2 estimated")
-        _ = createPoint_by_point3D(kwire_PA_occ, kwire_PA_comp, kwire_PA_P3, f"{PA_data.id} P3")
-        _ = createAxis_by_Line3D(kwire_PA_occ, kwire_PA_comp, kwire_PA_P1P2, f"{PA_data.id} axis")
-        
-        kwire_PA_brb = create_cylinder(
-                        kwire_PA_occ, kwire_PA_comp,
-                        PA_data.id,
-                        kwire_PA_P1,
-                        kwire_PA_P2,
-                        kwirer,
-                        kwirel)
-
-        # ---------------- KWIRE PA VIRTUAL CALCULATIONS --------------- #
-
-        # ++++ register errors of measurement
-        PA_data.P1_mean = kwire_PA_P1_mean
-        PA_data.P2_mean = kwire_PA_P2_mean
-        
-        # ++++ measure distance from anatomical structures
+    # futil.log(f'kwire_PA_P1 - {kwire_PA_P1.asArray()}\n kwire_PA_P2 {kwire_PA_P2.asArray()}') # debug
+    futil.log(f'outlier intersection points - P1: {kwire_PA_P1_outliers} - P2: {kwire_PA_P2_outliers}')
+
+    kwire_PA_P1P2 = adsk.core.Line3D.create(kwire_PA_P1, kwire_PA_P2)
+    
+    kwire_PA_vector = kwire_PA_P1.vectorTo(kwire_PA_P2)#  vector representing the direction of kwire (normalized)
+    kwire_PA_vector.normalize()
+    kwire_PA_P2_estimated = intersect_skin(skin_brb, kwire_PA_P1, kwire_PA_vector)
+    
+    kwire_PA_vector_lenght = kwire_PA_vector.copy() # vector representing the full lenght of kwire
+    kwire_PA_vector_lenght.scaleBy(kwirel)
+    kwire_PA_P3 = kwire_PA_P1.copy()
+    kwire_PA_P3.translateBy(kwire_PA_vector_lenght)
+
+    # futil.log(f'kwire_PA_P2_estimated: {kwire_PA_P2_estimated.asArray()}')
+
+    # ---------------- KWIRE PA VIRTUAL CALCULATIONS --------------- #
+
+    # ++++ register the computed points (mm), used to create the PA geometry
+    PA_data.P1_coord = [c*10 for c in kwire_PA_P1.asArray()]
+    PA_data.P2_coord = [c*10 for c in kwire_PA_P2.asArray()]
+    PA_data.P2e_coord = [c*10 for c in kwire_PA_P2_estimated.asArray()]
+    PA_data.P3_coord = [c*10 for c in kwire_PA_P3.asArray()]
+
+    # ++++ register errors of measurement
+    PA_data.P1_mean = kwire_PA_P1_mean
+    PA_data.P2_mean = kwire_PA_P2_mean
+
+    # ++++ propagate the measurement uncertainty to the PA position and angle (the batch does it on its workers)
+    if confidence == None:
+        confidence, = propagate_confidence(
+            lookup.get_marker_array(PA_data),
+            np.array([kwire_PA_P1.asArray()]),
+            np.array([kwire_PA_P2.asArray()]),
+            [[PA_data.P1A, PA_data.P1B, PA_data.P1C, PA_data.P1D, PA_data.P2A, PA_data.P2B, PA_data.P2C, PA_data.P2D]])
+    PA_data.confidence_position, PA_data.confidence_angle = confidence
+    
+    # ++++ measure distance from anatomical structures
+    kwire_PA_brb = None
+    with futil.span('anatomy distances', method=config.ANATOMY_DISTANCE_METHOD, structures=len(bodies)):
         for name, anatomy_brb in bodies.items():
             # NOTWORKING!!!
             # distance_target_anatomybody_result = _app.measureManager.measureMinimumDistance(kwire_target_brb, anatomy_brb)
@@ -343,69 +453,399 @@ def command_execute(args: adsk.core.CommandEventArgs):
             # _ = createPoint_by_point3D(None, None, distance_target_anatomybody_result.positionOne, f"position one") # debug
             # _ = createPoint_by_point3D(None, None, distance_target_anatomybody_result.positionTwo, f"position two") # debug
 
-            distance_PA_anatomybody_result = _app.measureManager.measureMinimumDistance(kwire_PA_brb, anatomy_brb)
-            distance_PA_anatomybody = distance_PA_anatomybody_result.value * 10
+            if config.ANATOMY_DISTANCE_METHOD == 'capsule':
+                distance_PA_anatomybody = kmath.capsule_mesh_distance(
+                    mesh_cache.get_body_mesh(anatomy_brb),
+                    np.array(kwire_PA_P1.asArray()),
+                    np.array(kwire_PA_P3.asArray()),
+                    kwirer) * 10
+            else:
+                if kwire_PA_brb == None: # transient body, it is not added to the design
+                    kwire_PA_brb = futil.cylinder_body(kwire_PA_P1, kwire_PA_P3, kwirer)
+                distance_PA_anatomybody_result = _app.measureManager.measureMinimumDistance(kwire_PA_brb, anatomy_brb)
+                distance_PA_anatomybody = distance_PA_anatomybody_result.value * 10
             PA_data.anatomy[anatomy_brb.name] = round(distance_PA_anatomybody, 3)
             # futil.log(f'distance PA     - {anatomy_brb.name}: {PA_data.anatomy[anatomy_brb.name]:.3f} mm') # debug
             # _ = createPoint_by_point3D(None, None, distance_PA_anatomybody_result.positionOne, f"position one") # debug
             # _ = createPoint_by_point3D(None, None, distance_PA_anatomybody_result.positionTwo, f"position two") # debug
-        
-        PA_data.hit_count = sum(1 for value in PA_data.anatomy.values() if value == 0.0)
-        
-        # ++++ measure delta angle between PA axis and target axis
-        K_radang = 57.2958 # to convert from radians to degrees
-        
+    
+    PA_data.hit_count = sum(1 for value in PA_data.anatomy.values() if value == 0.0)
+    
+    # ++++ measure delta angle between PA axis and target axis
+    K_radang = 57.2958 # to convert from radians to degrees
+    
+    with futil.span('measure angle'):
         PA_data.angle_PA_target = abs(round(_app.measureManager.measureAngle(kwire_PA_P1P2, kwire_target_P1P2_estimated).value * K_radang, 3))
-        if PA_data.angle_PA_target > 90:
-            PA_data.angle_PA_target = 180 - PA_data.angle_PA_target
-        # futil.log(f'angle value is {PA_data.angle_PA_target}') # debug
-
-        # ++++ measure distance between P1, P2, P2e and 4 markers
-
-        PA_data.P1A_F = round(kwire_PA_P1.distanceTo(markers["A"])*10, 3)
-        PA_data.P1B_F = round(kwire_PA_P1.distanceTo(markers["B"])*10, 3)
-        PA_data.P1C_F = round(kwire_PA_P1.distanceTo(markers["C"])*10, 3)
-        PA_data.P1D_F = round(kwire_PA_P1.distanceTo(markers["D"])*10, 3)
-        PA_data.P2A_F = round(kwire_PA_P2.distanceTo(markers["A"])*10, 3)
-        PA_data.P2B_F = round(kwire_PA_P2.distanceTo(markers["B"])*10, 3)
-        PA_data.P2C_F = round(kwire_PA_P2.distanceTo(markers["C"])*10, 3)
-        PA_data.P2D_F = round(kwire_PA_P2.distanceTo(markers["D"])*10, 3)
-
-        PA_data.P2eA_F = round(kwire_PA_P2_estimated.distanceTo(markers["A"])*10, 3)
-        PA_data.P2eB_F = round(kwire_PA_P2_estimated.distanceTo(markers["B"])*10, 3)
-        PA_data.P2eC_F = round(kwire_PA_P2_estimated.distanceTo(markers["C"])*10, 3)
-        PA_data.P2eD_F = round(kwire_PA_P2_estimated.distanceTo(markers["D"])*10, 3)
-
-        # ++++ measure delta distance between kwire and target insertion point
-        PA_data.distance_P1_PA_target = round(kwire_target_P1.distanceTo(kwire_PA_P1)*10, 3)
-        PA_data.distance_P1_PA_target_X = round((kwire_target_P1.x - kwire_PA_P1.x)*10, 3)
-        PA_data.distance_P1_PA_target_Y = round((kwire_target_P1.y - kwire_PA_P1.y)*10, 3)
-        PA_data.distance_P1_PA_target_Z = round((kwire_target_P1.z - kwire_PA_P1.z)*10, 3)
-
-        PA_data.distance_P2_PA_target = round(kwire_target_P2.distanceTo(kwire_PA_P2)*10, 3)
-        PA_data.distance_P2_PA_target_X = round((kwire_target_P2.x - kwire_PA_P2.x)*10, 3)
-        PA_data.distance_P2_PA_target_Y = round((kwire_target_P2.y - kwire_PA_P2.y)*10, 3)
-        PA_data.distance_P2_PA_target_Z = round((kwire_target_P2.z - kwire_PA_P2.z)*10, 3)
-
-        PA_data.distance_P2e_PA_target = round(kwire_target_P2_estimated.distanceTo(kwire_PA_P2_estimated)*10, 3)
-        PA_data.distance_P2e_PA_target_X = round((kwire_target_P2_estimated.x - kwire_PA_P2_estimated.x)*10, 3)
-        PA_data.distance_P2e_PA_target_Y = round((kwire_target_P2_estimated.y - kwire_PA_P2_estimated.y)*10, 3)
-        PA_data.distance_P2e_PA_target_Z = round((kwire_target_P2_estimated.z - kwire_PA_P2_estimated.z)*10, 3)
-        
-        # ++++ measure delta depth of insertion (depth difference between PA and target)
-        kwire_target_insertion_depth_mm = kwirel - (kwire_target_P2_estimated.distanceTo(kwire_target_P1)*10)
-        kwire_PA_insertion_depth_mm = kwirel - (kwire_PA_P1.distanceTo(kwire_PA_P2_estimated)*10)
-        
-        PA_data.delta_id_PA_target = round(kwire_PA_insertion_depth_mm - kwire_target_insertion_depth_mm, 3)
-        # futil.log(f'delta insertion (+ means more out of the skin ): {PA_data.delta_id_PA_target} mm') # debug
-        
-        PA_data.fusion_computed = True
-        PA_data_str = PA_data.dumps()
-        futil.log(f'import this into companion (already copied in clipboard): \n{PA_data_str}')
-        pyperclip.copy(PA_data_str)
-        
-    except:
-        _ui.messageBox('Failed:\n{}'.format(traceback.format_exc()))
+    if PA_data.angle_PA_target > 90:
+        PA_data.angle_PA_target = 180 - PA_data.angle_PA_target
+    # futil.log(f'angle value is {PA_data.angle_PA_target}') # debug
+
+    # ++++ measure distance between P1, P2, P2e and 4 markers
+
+    PA_data.P1A_F = round(kwire_PA_P1.distanceTo(markers["A"])*10, 3)
+    PA_data.P1B_F = round(kwire_PA_P1.distanceTo(markers["B"])*10, 3)
+    PA_data.P1C_F = round(kwire_PA_P1.distanceTo(markers["C"])*10, 3)
+    PA_data.P1D_F = round(kwire_PA_P1.distanceTo(markers["D"])*10, 3)
+    PA_data.P2A_F = round(kwire_PA_P2.distanceTo(markers["A"])*10, 3)
+    PA_data.P2B_F = round(kwire_PA_P2.distanceTo(markers["B"])*10, 3)
+    PA_data.P2C_F = round(kwire_PA_P2.distanceTo(markers["C"])*10, 3)
+    PA_data.P2D_F = round(kwire_PA_P2.distanceTo(markers["D"])*10, 3)
+
+    PA_data.P2eA_F = round(kwire_PA_P2_estimated.distanceTo(markers["A"])*10, 3)
+    PA_data.P2eB_F = round(kwire_PA_P2_estimated.distanceTo(markers["B"])*10, 3)
+    PA_data.P2eC_F = round(kwire_PA_P2_estimated.distanceTo(markers["C"])*10, 3)
+    PA_data.P2eD_F = round(kwire_PA_P2_estimated.distanceTo(markers["D"])*10, 3)
+
+    # ++++ measure delta distance between kwire and target insertion point
+    PA_data.distance_P1_PA_target = round(kwire_target_P1.distanceTo(kwire_PA_P1)*10, 3)
+    PA_data.distance_P1_PA_target_X = round((kwire_target_P1.x - kwire_PA_P1.x)*10, 3)
+    PA_data.distance_P1_PA_target_Y = round((kwire_target_P1.y - kwire_PA_P1.y)*10, 3)
+    PA_data.distance_P1_PA_target_Z = round((kwire_target_P1.z - kwire_PA_P1.z)*10, 3)
+
+    PA_data.distance_P2_PA_target = round(kwire_target_P2.distanceTo(kwire_PA_P2)*10, 3)
+    PA_data.distance_P2_PA_target_X = round((kwire_target_P2.x - kwire_PA_P2.x)*10, 3)
+    PA_data.distance_P2_PA_target_Y = round((kwire_target_P2.y - kwire_PA_P2.y)*10, 3)
+    PA_data.distance_P2_PA_target_Z = round((kwire_target_P2.z - kwire_PA_P2.z)*10, 3)
+
+    PA_data.distance_P2e_PA_target = round(kwire_target_P2_estimated.distanceTo(kwire_PA_P2_estimated)*10, 3)
+    PA_data.distance_P2e_PA_target_X = round((kwire_target_P2_estimated.x - kwire_PA_P2_estimated.x)*10, 3)
+    PA_data.distance_P2e_PA_target_Y = round((kwire_target_P2_estimated.y - kwire_PA_P2_estimated.y)*10, 3)
+    PA_data.distance_P2e_PA_target_Z = round((kwire_target_P2_estimated.z - kwire_PA_P2_estimated.z)*10, 3)
+    
+    # ++++ measure delta depth of insertion (depth difference between PA and target)
+    kwire_target_insertion_depth_mm = kwirel - (kwire_target_P2_estimated.distanceTo(kwire_target_P1)*10)
+    kwire_PA_insertion_depth_mm = kwirel - (kwire_PA_P1.distanceTo(kwire_PA_P2_estimated)*10)
+    
+    PA_data.delta_id_PA_target = round(kwire_PA_insertion_depth_mm - kwire_target_insertion_depth_mm, 3)
+    # futil.log(f'delta insertion (+ means more out of the skin ): {PA_data.delta_id_PA_target} mm') # debug
+    
+    PA_data.fusion_computed = True
+    return PA_data
+
+
+@futil.span('create geometry')
+def emit_PA_geometry(PA_data: data.PAdata, lookup: lookups.DesignLookups, emitter: futil.GeometryEmitter = None):
+    """queue the construction points, the axis and the kwire body (either method) of a computed positioning attempt in the emitter;
+    without an emitter they are created right away (in their own timeline group)"""
+    if PA_data.P1_coord == None:
+        raise Exception(f"{PA_data.id}: PA not computed, no coordinates to create its geometry")
+
+    kwire_PA = lookup.get_kwire_PA(PA_data)
+    if kwire_PA == None:
+        raise Exception(f"{PA_data.id}: occurrence phase:{PA_data.phase} - {PA_data.target} PA:1 not found in the design")
+    kwire_PA_occ, kwire_PA_comp = kwire_PA
+
+    kwire_PA_P1 = adsk.core.Point3D.create(*[c/10 for c in PA_data.P1_coord])
+    kwire_PA_P2 = adsk.core.Point3D.create(*[c/10 for c in PA_data.P2_coord])
+    kwire_PA_P2_estimated = adsk.core.Point3D.create(*[c/10 for c in PA_data.P2e_coord])
+    kwire_PA_P3 = adsk.core.Point3D.create(*[c/10 for c in PA_data.P3_coord])
+    kwire_PA_P1P2 = adsk.core.Line3D.create(kwire_PA_P1, kwire_PA_P2)
+
+    flush = emitter == None
+    if flush:
+        emitter = futil.GeometryEmitter(PA_data.id)
+
+    emitter.add_point(kwire_PA_occ, kwire_PA_P1, f"{PA_data.id} P1")
+    emitter.add_point(kwire_PA_occ, kwire_PA_P2, f"{PA_data.id} P2")
+    emitter.add_point(kwire_PA_occ, kwire_PA_P2_estimated, f"{PA_data.id} P2 estimated")
+    emitter.add_point(kwire_PA_occ, kwire_PA_P3, f"{PA_data.id} P3")
+    emitter.add_axis(kwire_PA_occ, kwire_PA_P1P2, f"{PA_data.id} axis")
+
+    if config.KWIRE_BODY_METHOD == 'extrude': # feature based: the flush builds it after the base features
+        def build_cylinder():
+            with futil.span('create cylinder', method='extrude'):
+                create_cylinder_extrude(kwire_PA_occ, kwire_PA_comp, PA_data.id, kwire_PA_P1, kwire_PA_P2, kwirer, kwirel)
+        emitter.add_feature(build_cylinder, PA_data.id)
+    else:
+        with futil.span('create cylinder', method='brep'): # the temporary brep is built here, the flush adds it to the base feature
+            emitter.add_body(kwire_PA_occ, futil.cylinder_body(kwire_PA_P1, kwire_PA_P2, kwirer, kwirel), PA_data.id)
+
+    if flush:
+        emitter.flush()
+
+
+def PA_geometry_exists(PA_data: data.PAdata, lookup: lookups.DesignLookups) -> bool:
+    "the construction points of the PA are already in the design"
+    occ, _ = lookup.index.construction_point(f"{PA_data.id} P1")
+    return occ != None
+
+
+def read_PA_jsonl(path: str):
+    "yields (line number, PAdata) for each record of a JSONL file; records that can't be parsed are yielded as (line number, exception)"
+    with open(path, 'r', encoding='utf-8') as f:
+        for line_number, line in enumerate(f, start=1):
+            if line.strip() == "":
+                continue
+            try:
+                yield line_number, data.PAdata.loads(line)
+            except Exception as e:
+                yield line_number, e
+
+
+def count_PA_jsonl(path: str) -> int:
+    "number of records (non empty lines) of a JSONL file, read line by line"
+    with open(path, 'r', encoding='utf-8') as f:
+        return sum(1 for line in f if line.strip() != "")
+
+
+def export_snapshot(records: list[data.PAdata], lookup: lookups.DesignLookups, path: str):
+    """export the design data needed to reanalyse the PAs outside of fusion (tools/reanalysis.py) to a npz file:
+    marker|<name> -> marker coordinates
+    target|<name>|P1, target|<name>|P2, target|<name>|vector -> target insertion point, P2 and normalized axis
+    mesh|<body name>|vertices, mesh|<body name>|triangles -> triangulated skin and anatomy structures
+    coordinates in cm"""
+    arrays = {}
+
+    def add_mesh(brb: adsk.fusion.BRepBody):
+        mesh = mesh_cache.get_body_mesh(brb)
+        arrays[f"mesh|{brb.name}|vertices"] = mesh.vertices
+        arrays[f"mesh|{brb.name}|triangles"] = mesh.triangles
+
+    skin_brb = lookup.get_skin()
+    if skin_brb == None:
+        raise Exception("skin not found in the design")
+    add_mesh(skin_brb)
+
+    for PA_data in records:
+        markers = lookup.get_marker_array(PA_data)
+        if markers is None:
+            raise Exception(f"{PA_data.id}: markers not found in the design")
+        for letter, coordinates in zip(("A", "B", "C", "D"), markers):
+            arrays[f"marker|{PA_data.markers[letter]}"] = coordinates
+
+        kwire_target = lookup.get_kwire_target(PA_data)
+        if kwire_target == None:
+            raise Exception(f"{PA_data.id}: target {PA_data.target} not found in the design")
+        _, _, _, P1, P2, vector = kwire_target
+        arrays[f"target|{PA_data.target}|P1"] = np.array(P1.asArray())
+        arrays[f"target|{PA_data.target}|P2"] = np.array(P2.asArray())
+        arrays[f"target|{PA_data.target}|vector"] = np.array(vector.asArray())
+
+        bodies = lookup.get_anatomy_structs(PA_data)
+        if bodies == None:
+            raise Exception(f"{PA_data.id}: anatomy structs not found in the design")
+        for brb in bodies.values():
+            if f"mesh|{brb.name}|vertices" not in arrays:
+                add_mesh(brb)
+
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    np.savez_compressed(path, **arrays)
+    futil.log(f'design snapshot: {len(records)} PAs, {len(arrays)} arrays written to {path}')
+
+
+def run_batch(input_path: str, process, output_path: str = None, emitter: futil.GeometryEmitter = None):
+    """start a batch (see BatchRun) of the PAs of a JSONL file, it runs in the background while fusion stays responsive;
+    the geometry queued by process in the emitter is created when the batch ends"""
+    global _batch
+    if _batch != None and not _batch.finished:
+        _ui.messageBox('a batch is already running')
+        return
+    _batch = BatchRun(input_path, process, output_path, emitter)
+    _batch.start()
+
+
+class BatchRun:
+    """Streams a JSONL file of PAdata records through process (see get_processor) writing each result (or error record)
+    to the output JSONL and to the results store.
+    The file is read in blocks of BATCH_BLOCK records, so only one block is in memory. Parsing, trilateration,
+    confidence propagation, serialization and disk writes run on worker threads; the design work (including the
+    anatomy distances, whose meshes come from the design) runs on the UI thread in chunks of
+    BATCH_CHUNK PAs, between chunks fusion handles its events. A progress dialog reports the progress
+    and its cancel button stops the batch after the current chunk, the chunks already computed are still written.
+    The PA geometry queued in the emitter is created once, in a single timeline group, when the batch ends."""
+
+    def __init__(self, input_path: str, process, output_path: str = None, emitter: futil.GeometryEmitter = None):
+        self.input_path = input_path
+        self.output_path = output_path if output_path != None else f"{os.path.splitext(input_path)[0]}.fusion.jsonl"
+        self.process = process
+        self.emitter = emitter
+        self.lookup = lookups.DesignLookups() # shared by the whole batch
+        self.store = results_store.get_results_store()
+        self.workers = futil.WorkerExecutor(f'{CMD_ID} batch')
+        self.writer = futil.WorkerExecutor(f'{CMD_ID} batch writer', max_workers=1) # one thread, writes stay in order
+        self.out = None
+        self.reader = read_PA_jsonl(self.input_path) # consumed by one worker job at a time
+        self.records = [] # current block
+        self.trilaterations = {}
+        self.next = 0
+        self.read = 0 # records read before the current block
+        self.done = 0
+        self.failed = 0
+        self.skipped = 0
+        self.finished = False
+        self.progress = _ui.createProgressDialog()
+        self.progress.isCancelButtonShown = True
+
+    def start(self):
+        self.time_start = time.perf_counter()
+        self.workers.submit(count_PA_jsonl, self.input_path, on_done=self._counted, on_error=self._abort)
+
+    def cancel(self):
+        "stop the compute; the results already computed are still written (see _finish)"
+        self.workers.cancel()
+        self._finish(cancelled=True)
+
+    def _counted(self, total: int):
+        self.progress.show('kwire virtualization system - batch', 'PA %v of %m', 0, total, 0)
+        self._read_block()
+
+    def _read_block(self):
+        self.workers.submit(lambda: list(itertools.islice(self.reader, BATCH_BLOCK)), on_done=self._parsed, on_error=self._abort)
+
+    def _parsed(self, records: list):
+        self.read += len(self.records)
+        self.records = records
+        self.trilaterations = {}
+        self.next = 0
+        if len(records) == 0: # end of the file
+            self._finish()
+            return
+
+        # marker coordinates are read on the UI thread, the trilateration of the whole block runs on a worker
+        rows = []
+        for i, (_, PA_data) in enumerate(records):
+            if isinstance(PA_data, Exception):
+                continue
+            frames = self.lookup.get_marker_frames(PA_data)
+            if frames != None:
+                rows.append((i, frames, [
+                    PA_data.P1A, PA_data.P1B, PA_data.P1C, PA_data.P1D,
+                    PA_data.P2A, PA_data.P2B, PA_data.P2C, PA_data.P2D]))
+        self.workers.submit(trilaterate_rows, rows, config.TRILATERATION_METHOD, config.CLUSTER_SIZE,
+                            on_done=self._trilaterated, on_error=self._abort)
+
+    def _trilaterated(self, trilaterations: dict):
+        self.trilaterations = trilaterations
+        self._chunk()
+
+    def _chunk(self):
+        "process the next BATCH_CHUNK PAs on the UI thread, then hand their writing to the writer thread"
+        if self.finished:
+            return
+        if self.progress.wasCancelled:
+            self.cancel()
+            return
+
+        results = []
+        for i in range(self.next, min(self.next + BATCH_CHUNK, len(self.records))):
+            line_number, PA_data = self.records[i]
+            try:
+                if isinstance(PA_data, Exception):
+                    raise PA_data
+                trilateration = None
+                if i in self.trilaterations:
+                    *points, confidence = self.trilaterations[i]
+                    trilateration = tuple((adsk.core.Point3D.create(*p), mean, outliers) for p, mean, outliers in points) + (confidence,)
+                with futil.span('batch PA', line=line_number):
+                    PA_data = self.process(PA_data, self.lookup, trilateration)
+                if PA_data == None:
+                    self.skipped += 1
+                    continue
+                results.append(PA_data)
+                self.done += 1
+            except Exception as e:
+                self.failed += 1
+                futil.log(f'batch line {line_number} failed: {e}')
+                results.append({
+                    "datatype": "error",
+                    "line": line_number,
+                    "id": getattr(PA_data, 'id', None),
+                    "error": f"{type(e).__name__}: {e}"})
+        self.next = min(self.next + BATCH_CHUNK, len(self.records))
+        self.progress.progressValue = self.read + self.next
+
+        self.writer.submit(self._write, results, on_error=self._abort)
+        if self.next < len(self.records):
+            self.workers.submit(lambda: None, on_done=lambda _: self._chunk()) # back to the event loop before the next chunk
+        else:
+            self._read_block()
+
+    def _write(self, results: list):
+        "writer thread: serialize and write a chunk of results"
+        if self.out == None:
+            self.out = open(self.output_path, 'w', encoding='utf-8')
+        for r in results:
+            if isinstance(r, data.PAdata):
+                self.out.write(r.dumps() + '\n')
+                self.store.add(r)
+            else:
+                self.out.write(json.dumps(r) + '\n')
+        self.out.flush()
+
+    def _abort(self, e: Exception):
+        futil.log(f'batch failed: {e}')
+        self.cancel()
+
+    def _finish(self, cancelled: bool = False):
+        if self.finished:
+            return
+        self.finished = True
+        self.progress.hide()
+        self.workers.shutdown(wait=True) # a block read running, if any, ends before the input file is closed
+        self.writer.shutdown(wait=True, cancel=False) # the queued writes of the computed chunks run before the output file is closed
+        try:
+            self.store.flush()
+        except Exception as e:
+            futil.log(f'batch results store failed: {e}')
+        self.reader.close()
+        if self.out != None:
+            self.out.close()
+
+        emitted = 0
+        if self.emitter != None:
+            try:
+                with futil.span('emit geometry', entities=len(self.emitter)):
+                    emitted = self.emitter.flush()
+            except Exception as e:
+                futil.log(f'batch geometry failed: {e}')
+
+        elapsed = time.perf_counter() - self.time_start
+        total = self.done + self.failed
+        summary = (f'batch{" cancelled" if cancelled else ""}: {self.done}/{total} PAs processed ({self.failed} failed, {self.skipped} skipped) '
+                   f'in {elapsed:.1f} s - {total/elapsed if elapsed > 0 else 0:.2f} PA/s, {emitted} geometry entities created\nresults: {self.output_path}')
+        futil.log(summary)
+        if futil.tracing_enabled():
+            trace_path = os.path.join(config.TRACE_DIR, f"{CMD_ID}-batch-{time.strftime('%Y%m%d-%H%M%S')}.json")
+            futil.log(f'trace: {futil.write_trace(trace_path)} spans written to {trace_path}')
+        _ui.messageBox(summary)
+
+
+def propagate_confidence(markers: np.ndarray, P1: np.ndarray, P2: np.ndarray, distances) -> list[tuple[float, float]]:
+    """no fusion api: (confidence_position mm, confidence_angle degrees) of PAs located at P1, P2 (N, 3) (cm) from
+    the markers (4, 3) or (N, 4, 3) and their 8 distances (N, 8) (mm), through config.TRILATERATION_METHOD"""
+    confidence_position, confidence_angle = kmath.PA_confidence(
+        markers, P1, P2,
+        config.CALIPER_SIGMA_MM/10,
+        config.MARKER_SIGMA_MM/10,
+        np.asarray(distances, dtype=float)/10,
+        config.TRILATERATION_METHOD,
+        config.CLUSTER_SIZE)
+    return [(round(float(p)*10, 3), round(float(a), 3)) for p, a in zip(confidence_position, confidence_angle)]
+
+
+def trilaterate_rows(rows: list, method: str, cluster_size: int) -> dict:
+    """worker thread (no fusion api): trilaterate P1 and P2 of the batch rows (index, marker frames, 8 distances (mm)),
+    one vectorized call per marker frames (phase), and propagate their confidence; returns
+    index -> ((P1, P1_mean mm, P1_outliers), (P2, P2_mean mm, P2_outliers), (confidence_position, confidence_angle))
+    for the rows that could be solved"""
+    groups = {}
+    for i, frames, distances in rows:
+        group = groups.setdefault(id(frames), (frames, [], []))
+        group[1].append(i)
+        group[2].append(distances)
+
+    solved = {}
+    for frames, index, distances in groups.values():
+        distances = np.array(distances) # (N, 8) P1, P2 of each row
+        points, errors, outliers = frames.locate(distances.reshape(-1, 4) / 10, method, cluster_size)
+        with np.errstate(invalid='ignore', divide='ignore'): # rows that failed are skipped below
+            confidence = propagate_confidence(frames.markers, np.nan_to_num(points[::2]), np.nan_to_num(points[1::2]), distances)
+        for n, i in enumerate(index):
+            P1, P2 = 2*n, 2*n + 1
+            if np.isnan(points[[P1, P2]]).any():
+                continue # trilaterate3D_4spheres reports the error when the PA is processed
+            solved[i] = tuple((points[k].tolist(), round(float(errors[k])*10, 3), outliers[k].tolist()) for k in (P1, P2)) + (confidence[n],)
+    return solved
 
 
 ######################## TOOLS ########################
@@ -452,6 +892,58 @@ def createPoint_by_point3D(occ: adsk.fusion.Occurrence, comp: adsk.fusion.Compon
         pc.name = name
     return pc
 
+def intersect_point(brb: adsk.fusion.BRepBody, P: adsk.core.Point3D, dir: adsk.core.Vector3D, maxtests: int, precision: int, precisionStart: int = None) -> adsk.core.Point3D | None:
+    "estimate point of intersection of a vector starting from P through a body; dir should be normalized"
+    
+    # copy as the variable seems to be referenced by a sort of pointer
+    # brb = brb.copy() # not this as it will fail (the original one must be used)
+    P   = P.copy()
+    dir = dir.copy()
+
+    if precisionStart == None:
+        precisionStart = precision
+    
+    pOut = P.copy()
+    while True:
+        maxtests -= 1
+        P.translateBy(dir)
+        # createPoint_by_point3D(P) # debug
+        # futil.log(f"precision: {precision} - maxtests: {maxtests} - containment: {brb.pointContainment(P)}") # debug
+        if maxtests < 0 and precision == precisionStart:
+            # point was not found
+            return None
+        if maxtests < 0 and precision != precisionStart:
+            return P
+        if brb.pointContainment(P) == 0: # entered the body
+            if precision == 0:
+                return P
+            else:
+                dir.scaleBy(0.1)
+                return intersect_point(brb, pOut, dir, maxtests, precision-1)
+        pOut = P.copy()
+
+@futil.span('intersect skin')
+def intersect_skin(brb: adsk.fusion.BRepBody, P: adsk.core.Point3D, dir: adsk.core.Vector3D) -> adsk.core.Point3D | None:
+    "estimate point of intersection of a vector starting from P through the skin body; dir should be normalized"
+    
+    # ray cast against the cached triangulated body, the point containment marcher is the fallback
+    t = mesh_cache.get_body_mesh(brb).raycast(np.array(P.asArray()), np.array(dir.asArray()), max_distance=200)
+    if t is None:
+        futil.log(f"intersect_skin: ray missed {brb.name} mesh, falling back to point containment")
+        return intersect_point(brb, P, dir, 200, 12)
+
+    P_mesh = P.copy()
+    v = dir.copy()
+    v.scaleBy(t)
+    P_mesh.translateBy(v)
+
+    if config.SKIN_RAYCAST_CROSSCHECK:
+        P_march = intersect_point(brb, P, dir, 200, 12)
+        futil.log(f"intersect_skin: mesh vs containment marcher: {P_mesh.distanceTo(P_march)*10:.4f} mm" if P_march != None else "intersect_skin: containment marcher found no point")
+
+    return P_mesh
+
+@futil.span('trilaterate3D_4spheres')
 def trilaterate3D_4spheres(
         A:  adsk.core.Point3D,
         PA: float,
@@ -460,140 +952,57 @@ def trilaterate3D_4spheres(
         C:  adsk.core.Point3D,
         PC: float,
         D:  adsk.core.Point3D,
-        PD: float
-        ) -> tuple[adsk.core.Point3D, float]:
-    "returns the trilateration midpoint and error statistics of all the possible combinations of 3 starting from 4 spheres"
+        PD: float,
+        frames: kmath.MarkerFrames = None
+        ) -> tuple[adsk.core.Point3D, float, list[bool]]:
+    """returns the trilateration point, its mean error in mm and the outlier flags:
+    - 'cluster' method: midpoint and mean distance of the tightest cluster among all the possible combinations of 3 starting from 4 spheres,
+      the outlier flags tell which of the 8 intersection points were left out of the cluster
+    - 'lsq' method: least squares point and root mean square of the distance residuals, no outlier flags
+    raises if the spheres can't be solved
+    frames: the precomputed frames of the markers A, B, C, D (see lookups.get_marker_frames), built here if not given"""
     
-    points: list[adsk.core.Point3D] = []
-    try:
-        # we have 4 markers and 4 distances, trilaterate each combination of them to get 4x2=8 sphere intersection points.
-        # (3 intersecting spheres have 2 points in common, except for edgecases)
-        points.extend(trilaterate3D(A, PA, B, PB, C, PC))
-        points.extend(trilaterate3D(A, PA, B, PB, D, PD))
-        points.extend(trilaterate3D(A, PA, C, PC, D, PD))
-        points.extend(trilaterate3D(B, PB, C, PC, D, PD))
-
-        # _ = [futil.log(f'point: {p.asArray()}') for p in points]    # debug
-        # +_ = [createPoint_by_point3D(None, None, p) for p in points] # debug
-
-        # make all possible combination groups of 4 out of 8 intersection points
-        # (the objective is to find the group (cluster) of which points are the closest to eachother)
-        groups = list(combinations(points, 4))
-
-        def calc_group_dist(
-                group: tuple[adsk.core.Point3D, adsk.core.Point3D, adsk.core.Point3D, adsk.core.Point3D]
-                ) -> float:
-            return  group[0].distanceTo(group[1])*10 + \
-                    group[0].distanceTo(group[2])*10 + \
-                    group[0].distanceTo(group[3])*10 + \
-                    group[1].distanceTo(group[2])*10 + \
-                    group[1].distanceTo(group[3])*10 + \
-                    group[2].distanceTo(group[3])*10
-
-        # run through all combination groups to find the one with the most grouped points
-        cluster = groups[0]
-        for group in groups:
-            if calc_group_dist(group) < calc_group_dist(cluster):
-                cluster = group
-                
-        # _ = [createPoint_by_point3D(None, None, p) for p in cluster] # debug
-        
-        # compute the cluster center point
-        cluster_center = adsk.core.Point3D.create(
-            (cluster[0].x + cluster[1].x + cluster[2].x + cluster[3].x)/4,
-            (cluster[0].y + cluster[1].y + cluster[2].y + cluster[3].y)/4,
-            (cluster[0].z + cluster[1].z + cluster[2].z + cluster[3].z)/4
-        )
-        # _ = createPoint_by_point3D(None, None, cluster_center, "cluster_center") # debug
-
-        # compute measurement error statistics
-        cluster_center_dists = [cluster_center.distanceTo(cluster[0])*10, cluster_center.distanceTo(cluster[1])*10, cluster_center.distanceTo(cluster[2])*10, cluster_center.distanceTo(cluster[3])*10]
-        mean = sum(cluster_center_dists) / len(cluster_center_dists)
-        squared_diff = [(x - mean) ** 2 for x in cluster_center_dists]
-        variance = sum(squared_diff) / (len(cluster_center_dists) - 1)
-        std_deviation = math.sqrt(variance)
-        std_error = std_deviation / math.sqrt(len(cluster_center_dists))
-
-        mean = round(mean, 3)
+    markers = frames.markers if frames != None else np.array([A.asArray(), B.asArray(), C.asArray(), D.asArray()])
+    distances = np.array([[PA, PB, PC, PD]])
+
+    if config.TRILATERATION_METHOD == 'lsq':
+        points, residuals, covariance = kmath.multilaterate_lsq_batch(markers, distances)
+
+        if np.isnan(points[0]).any():
+            raise Exception("spheres can't be multilaterated")
+
+        mean = round(float(np.sqrt((residuals[0]**2).mean()))*10, 3)
 
         # debug
-        futil.log(f"Mean: {mean} mm")
+        futil.log(f"RMS residual: {mean} mm - residuals: {np.round(residuals[0]*10, 3)} mm - position std: {np.round(np.sqrt(np.diag(covariance[0]))*10, 3)} mm")
 
-        return cluster_center, mean
-        
+        return adsk.core.Point3D.create(*points[0]), mean, []
 
-    except Exception as e:
-        _ui.messageBox(f"trilaterate3D_4spheres: {e.__traceback__.tb_lineno}\n\nerror: {e}")
-
-    return None, None, None, None
-
-def trilaterate3D(
-        m1:  adsk.core.Point3D, # marker point
-        m1P: float,             # marker point distance to trilateration point
-        m2:  adsk.core.Point3D,
-        m2P: float,
-        m3:  adsk.core.Point3D,
-        m3P: float
-) -> list[adsk.core.Point3D]:
-    "returns the 2 intersection points of the 3 spheres"
-    
-    # futil.log(f"before: {m1P, m2P, m3P}") # debug
-    # futil.log(f"before: {m1P+m2P, m2P+m3P, m3P+m1P}") # debug
-
-    # check if the spheres intersect, if they don't, increase the radius
-    watchdog = 0
-    while m1P + m2P <= m1.distanceTo(m2) or m2P + m3P <= m2.distanceTo(m3) or m3P + m1P <= m3.distanceTo(m1):
-        watchdog += 1
-        if m1P + m2P <= m1.distanceTo(m2):
-            m1P += 0.01
-            m2P += 0.01
-        if m2P + m3P <= m2.distanceTo(m3):
-            m2P += 0.01
-            m3P += 0.01
-        if m3P + m1P <= m3.distanceTo(m1):
-            m3P += 0.01
-            m1P += 0.01
-        if watchdog > 100:
-            return None
-    
-    # futil.log(f"after:  {m1P, m2P, m3P}") # debug
-    # futil.log(f"after:  {m1P+m2P, m2P+m3P, m3P+m1P}") # debug
-    # futil.log(f"m1-m2..:{m1.distanceTo(m2), m2.distanceTo(m3), m3.distanceTo(m1)}") # debug
-    # futil.log(f"-----------------------------------------") # debug
-
-    # edge case in which each couple of the 3 spheres intersects, but the 3 spheres don't intersect in the same area
-    # look at: 3 spheres intersection edge case.png
-    ans1 = np.full(3, np.nan)
-    ans2 = np.full(3, np.nan)
-    while np.isnan(ans1).any() or np.isnan(ans2).any():
-        try:
-            m1np=np.array(m1.asArray())
-            m2np=np.array(m2.asArray())
-            m3np=np.array(m3.asArray())
-            e_x=(m2np-m1np)/np.linalg.norm(m2np-m1np)
-            i=np.dot(e_x,(m3np-m1np))
-            e_y=(m3np-m1np-(i*e_x))/(np.linalg.norm(m3np-m1np-(i*e_x)))
-            e_z=np.cross(e_x,e_y)
-            d=np.linalg.norm(m2np-m1np)
-            j=np.dot(e_y,(m3np-m1np))
-            x=((m1P**2)-(m2P**2)+(d**2))/(2*d)
-            y=(((m1P**2)-(m3P**2)+(i**2)+(j**2))/(2*j))-((i/j)*(x))
-            z1=np.sqrt(m1P**2-x**2-y**2)
-            z2=np.sqrt(m1P**2-x**2-y**2)*(-1)
-            ans1=m1np+(x*e_x)+(y*e_y)+(z1*e_z)
-            ans2=m1np+(x*e_x)+(y*e_y)+(z2*e_z)
-
-            m1P += 0.01
-            m2P += 0.01
-            m3P += 0.01
-        except Exception as e:
-            _ui.messageBox(f"trilaterate3D: {e.__traceback__.tb_lineno}\n\nerror: {e}")
+    # the marker triple bases are precomputed in the frames, only the distances are solved here
+    if frames == None:
+        frames = kmath.MarkerFrames(markers)
+    candidates, inflations = frames.candidates(distances)
+    centers, means, outliers = kmath.select_cluster(candidates, config.CLUSTER_SIZE)
+
+    if np.isnan(centers[0]).any():
+        raise Exception("spheres can't be trilaterated")
+
+    cluster_center = adsk.core.Point3D.create(*centers[0])
+    # _ = createPoint_by_point3D(None, None, cluster_center, "cluster_center") # debug
+
+    mean = round(float(means[0])*10, 3)
+
+    if inflations[0].any():
+        futil.log(f"spheres radii inflated by: {np.round(inflations[0]*10, 3)} mm")
+
+    # debug
+    futil.log(f"Mean: {mean} mm")
+
+    return cluster_center, mean, outliers[0].tolist()
 
-    return [adsk.core.Point3D.create(ans1[0], ans1[1], ans1[2]), adsk.core.Point3D.create(ans2[0], ans2[1], ans2[2])]
 
-def create_cylinder(occ: adsk.fusion.Occurrence, comp: adsk.fusion.Component, id: str, P1: adsk.core.Point3D, P2: adsk.core.Point3D, r: float, lenght: float) -> adsk.fusion.BRepBody:
-    # idea:
-    # c = adsk.core.Cylinder.create(p1, kwire_PA_vector, kwirer)
+def create_cylinder_extrude(occ: adsk.fusion.Occurrence, comp: adsk.fusion.Component, id: str, P1: adsk.core.Point3D, P2: adsk.core.Point3D, r: float, lenght: float) -> adsk.fusion.BRepBody:
+    "plane + sketch + extrude + dissolve kwire body (the method used before the temporary brep cylinder, kept for timing comparisons)"
 
     P1 = P1.copy()
     P2 = P2.copy()
@@ -0,0 +1,146 @@
+import adsk.core, adsk.fusion
+import hashlib
+import numpy as np
+from ...lib import fusion360utils as futil
+from . import data
+from . import mesh_cache
+from . import marker_cache
+
+# design lookups needed by the PA pipeline (markers, anatomy bodies, skin, target and PA occurrences)
+# each lookup is cached by its key, so a batch of PAs resolves every design entity only once
+
+
+class DesignLookups:
+    "design entities resolved for the PA pipeline, cached for the lifetime of the object (one command execution or one batch)"
+
+    def __init__(self):
+        self.index = futil.get_design_index()
+        marker_cache.cache.check_revision(adsk.fusion.Design.cast(adsk.core.Application.get().activeProduct))
+        self._markers = {}
+        self._marker_arrays = {}
+        self._anatomy = {}
+        self._targets = {}
+        self._PA_occurrences = {}
+        self._skin = None
+        self._fingerprints = {}
+        self.targets_P2_estimated: dict[str, adsk.core.Point3D] = {} # filled by the pipeline, target name -> skin intersection
+
+    def get_markers(self, PA_data: data.PAdata) -> dict[str, adsk.core.Point3D] | None:
+        key = tuple(PA_data.markers.items())
+        if key not in self._markers:
+            coordinates = self.get_marker_array(PA_data)
+            self._markers[key] = None if coordinates is None else {
+                k: adsk.core.Point3D.create(*c) for k, c in zip(("A", "B", "C", "D"), coordinates.tolist())}
+        return self._markers[key]
+
+    def get_marker_array(self, PA_data: data.PAdata) -> np.ndarray | None:
+        "world coordinates (4, 3) of the markers A, B, C, D"
+        key = tuple(PA_data.markers.items())
+        if key not in self._marker_arrays:
+            self._marker_arrays[key] = self._find_markers(PA_data)
+        return self._marker_arrays[key]
+
+    def get_marker_frames(self, PA_data: data.PAdata):
+        "trilateration frames (kmath.MarkerFrames) of the markers, shared by the PAs of the same phase and layout"
+        coordinates = self.get_marker_array(PA_data)
+        if coordinates is None:
+            return None
+        return marker_cache.cache.get_frames(PA_data.phase, tuple(PA_data.markers.items()), coordinates)
+
+    def _find_markers(self, PA_data: data.PAdata) -> np.ndarray | None:
+        found = []
+
+        for marker_letter in ("A", "B", "C", "D"):
+            # marker_letter = "A"
+            # name          = "M:3"
+            marker_name = PA_data.markers.get(marker_letter)
+            occ = self.index.occurrences.get(marker_name)
+            if occ == None:
+                futil.log(f"getMarkers: {marker_name} not found")
+                return None
+            found.append(marker_cache.get_marker_position(occ))
+
+        return np.array(found)
+
+    def get_anatomy_structs(self, PA_data: data.PAdata) -> dict[str, adsk.fusion.BRepBody] | None:
+        key = tuple(PA_data.anatomy.keys())
+        if key not in self._anatomy:
+            self._anatomy[key] = self._find_anatomy_structs(PA_data)
+        return self._anatomy[key]
+
+    def _find_anatomy_structs(self, PA_data: data.PAdata) -> dict[str, adsk.fusion.BRepBody] | None:
+        found = {}
+        found_count = 0
+        found_expected_count = len(PA_data.anatomy)
+
+        for k in PA_data.anatomy.keys():
+            for brb in self.index.bodies.get(k, []):
+                # futil.log(f"\tfound anatomy struct {k}") # debug
+                found[k] = brb
+                found_count += 1
+
+        if found_count == found_expected_count:
+            return found
+        else:
+            futil.log(f"\tfound unexpected number of anatomy structs")
+            return None
+
+    def get_skin(self) -> adsk.fusion.BRepBody | None:
+        if self._skin == None:
+            self._skin = self.index.body("skin")
+        return self._skin
+
+    def get_kwire_target(self, PA_data: data.PAdata) -> tuple[adsk.fusion.Occurrence, adsk.fusion.Component, adsk.fusion.BRepBody, adsk.core.Point3D, adsk.core.Point3D, adsk.core.Vector3D]:
+        "returns normalized vector"
+        if PA_data.target not in self._targets:
+            self._targets[PA_data.target] = self._find_kwire_target(PA_data)
+        return self._targets[PA_data.target]
+
+    def _find_kwire_target(self, PA_data: data.PAdata) -> tuple[adsk.fusion.Occurrence, adsk.fusion.Component, adsk.fusion.BRepBody, adsk.core.Point3D, adsk.core.Point3D, adsk.core.Vector3D]:
+        target_occ = self.index.occurrences.get(PA_data.target) # ECP:1
+        if target_occ == None:
+            return None
+        target_comp = target_occ.component
+
+        target_brb = target_comp.bRepBodies.itemByName("target")
+
+        p1 = target_comp.constructionPoints.itemByName("target P1").geometry
+        p1.transformBy(target_occ.transform2) # must be transformed from the occurrence coordinate axis
+
+        kwires_occ, p2_cp = self.index.construction_point(f"{PA_data.target} target P2") # ECP:1 target P2 (in kwires:1)
+        p2 = p2_cp.geometry
+        p2.transformBy(kwires_occ.transform2) # must be transformed from the occurrence coordinate axis
+
+        _, _, vector = target_comp.zConstructionAxis.geometry.getData()
+        vector.transformBy(target_occ.transform2) # must be transformed from the occurrence coordinate axis
+        vector.normalize()
+
+        return target_occ, target_comp, target_brb, p1, p2, vector
+
+    def get_kwire_PA(self, PA_data: data.PAdata) -> tuple[adsk.fusion.Occurrence, adsk.fusion.Component]:
+        key = f"phase:{PA_data.phase} - {PA_data.target} PA:1" # "phase:0 - ECP:1 PA:1"
+        if key not in self._PA_occurrences:
+            PA_occ = self.index.occurrences.get(key)
+            self._PA_occurrences[key] = None if PA_occ == None else (PA_occ, PA_occ.component)
+        return self._PA_occurrences[key]
+
+    def get_geometry_fingerprint(self, PA_data: data.PAdata) -> str | None:
+        """hash of the design geometry the PA compute depends on: marker positions, target points and axis,
+        skin and anatomy structures (body fingerprints); None if some of them are missing"""
+        key = (tuple(PA_data.markers.items()), PA_data.target, tuple(PA_data.anatomy.keys()))
+        if key not in self._fingerprints:
+            self._fingerprints[key] = self._geometry_fingerprint(PA_data)
+        return self._fingerprints[key]
+
+    def _geometry_fingerprint(self, PA_data: data.PAdata) -> str | None:
+        markers = self.get_marker_array(PA_data)
+        bodies = self.get_anatomy_structs(PA_data)
+        skin = self.get_skin()
+        target = self.get_kwire_target(PA_data)
+        if markers is None or bodies == None or skin == None or target == None:
+            return None
+
+        values = markers.ravel().tolist()
+        values += [c for v in target[3:] for c in v.asArray()]
+        values += [c for brb in (skin, *bodies.values()) for c in mesh_cache.body_fingerprint(brb)]
+        return hashlib.sha1((np.round(np.array(values, dtype=float), 6) + 0.0).tobytes()).hexdigest()
@@ -0,0 +1,70 @@
+import adsk.core, adsk.fusion
+from ...lib import fusion360utils as futil
+from ...lib import kwiremath as kmath
+
+import numpy as np
+
+# world coordinates of the marker occurrences, shared by every PA lookup of the session
+# markers almost never move: an entry is recomputed only when its occurrence transform changes,
+# and the whole cache is dropped when the design revision (document, timeline) changes
+# it also keeps the trilateration frames of the marker layout of each phase (see kmath.MarkerFrames)
+
+
+class MarkerCache:
+    "world coordinates (cm, read-only (3,) arrays) of the marker occurrence origins keyed by occurrence name"
+
+    def __init__(self):
+        self._entries: dict[str, tuple[tuple, np.ndarray]] = {} # name -> (transform2, coordinates)
+        self._frames: dict[tuple, kmath.MarkerFrames] = {} # (phase, marker layout) -> frames
+        self._revision = None
+
+    def check_revision(self, design: adsk.fusion.Design):
+        "drop every entry if the design revision changed since the last check"
+        revision = futil.design_revision(design)
+        if revision != self._revision:
+            if self._entries:
+                futil.log(f"marker cache: design changed, {len(self._entries)} markers dropped")
+            self._entries.clear()
+            self._frames.clear()
+            self._revision = revision
+
+    def get(self, occ: adsk.fusion.Occurrence) -> np.ndarray:
+        "returns the world coordinates of the occurrence origin, recomputing them only if its transform changed"
+        transform = occ.transform2
+        key = tuple(transform.asArray())
+
+        entry = self._entries.get(occ.name)
+        if entry != None and entry[0] == key:
+            return entry[1]
+
+        cp = occ.component.originConstructionPoint.geometry
+        cp.transformBy(transform) # must be transformed from the occurrence coordinate axis
+        coordinates = np.array(cp.asArray())
+        coordinates.flags.writeable = False
+        self._entries[occ.name] = (key, coordinates)
+        return coordinates
+
+    def get_frames(self, phase: int, layout: tuple, coordinates: np.ndarray) -> kmath.MarkerFrames:
+        """returns the trilateration frames of the marker layout ((letter, name) pairs) of a phase,
+        rebuilding them only if the coordinates (4, 3) of its markers changed"""
+        key = (phase, layout)
+        frames = self._frames.get(key)
+        if frames == None or not np.array_equal(frames.markers, coordinates):
+            frames = kmath.MarkerFrames(coordinates)
+            self._frames[key] = frames
+        return frames
+
+    def invalidate(self, name: str = None):
+        "drop the coordinates of a marker (all the markers if no name is given) and the frames"
+        if name == None:
+            self._entries.clear()
+        else:
+            self._entries.pop(name, None)
+        self._frames.clear()
+
+
+cache = MarkerCache()
+
+def get_marker_position(occ: adsk.fusion.Occurrence) -> np.ndarray:
+    "returns the session world coordinates of the marker occurrence"
+    return cache.get(occ)
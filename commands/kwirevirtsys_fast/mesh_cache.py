@@ -0,0 +1,75 @@
+import adsk.core, adsk.fusion
+from collections import OrderedDict
+from ...lib import fusion360utils as futil
+from ...lib import kwiremath as kmath
+from ... import config
+
+import numpy as np
+
+# triangulated copies of the design bodies, shared by every fast geometry query (ray casts, distances, containment)
+# each body is triangulated once per session and re-triangulated only when its revision fingerprint changes
+
+MESH_QUALITY = adsk.fusion.TriangleMeshQualityOptions.VeryHighQualityTriangleMesh
+
+
+class MeshCache:
+    "least recently used cache of body meshes keyed by body name, capped by memory"
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._entries: OrderedDict[str, tuple[tuple, kmath.TriangleMesh]] = OrderedDict() # name -> (fingerprint, mesh)
+
+    @property
+    def nbytes(self) -> int:
+        return sum(mesh.nbytes for _, mesh in self._entries.values())
+
+    def get(self, brb: adsk.fusion.BRepBody) -> kmath.TriangleMesh:
+        "returns the mesh of the body, triangulating it if it is not cached or if the body changed"
+        fingerprint = body_fingerprint(brb)
+
+        entry = self._entries.get(brb.name)
+        if entry != None and entry[0] == fingerprint:
+            self._entries.move_to_end(brb.name)
+            return entry[1]
+
+        mesh = triangulate(brb)
+        self._entries[brb.name] = (fingerprint, mesh)
+        self._entries.move_to_end(brb.name)
+        futil.log(f"mesh cache: triangulated {brb.name} ({len(mesh.triangles)} triangles, {mesh.nbytes/2**20:.1f} MB)")
+
+        # evict the least recently used meshes (the one just added is always kept)
+        while self.nbytes > self.max_bytes and len(self._entries) > 1:
+            name, _ = self._entries.popitem(last=False)
+            futil.log(f"mesh cache: evicted {name}")
+
+        return mesh
+
+    def invalidate(self, name: str = None):
+        "drop the mesh of a body (all the meshes if no name is given)"
+        if name == None:
+            self._entries.clear()
+        else:
+            self._entries.pop(name, None)
+
+
+def body_fingerprint(brb: adsk.fusion.BRepBody) -> tuple:
+    "revision fingerprint of a body: bounding box and volume"
+    bb = brb.boundingBox
+    return tuple(np.round([*bb.minPoint.asArray(), *bb.maxPoint.asArray(), brb.volume], 6))
+
+
+def triangulate(brb: adsk.fusion.BRepBody) -> kmath.TriangleMesh:
+    "triangulate the body through its mesh calculator"
+    calc = brb.meshManager.createMeshCalculator()
+    calc.setQuality(MESH_QUALITY)
+    mesh = calc.calculate()
+    return kmath.TriangleMesh(
+        np.array(mesh.nodeCoordinatesAsDouble).reshape(-1, 3),
+        np.array(mesh.nodeIndices, dtype=np.int32).reshape(-1, 3))
+
+
+cache = MeshCache(config.MESH_CACHE_MAX_MB * 2**20)
+
+def get_body_mesh(brb: adsk.fusion.BRepBody) -> kmath.TriangleMesh:
+    "returns the session mesh of the body"
+    return cache.get(brb)
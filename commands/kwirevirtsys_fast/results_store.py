@@ -0,0 +1,165 @@
+import os
+import json
+import time
+import hashlib
+import sqlite3
+import threading
+from ... import config
+from . import data
+
+# embedded store of the computed positioning attempts
+# every PA is kept as its full json record, plus a few indexed columns used by the analysis queries
+# the same database holds the result cache: computed PAs keyed by the hash of their inputs (input_hash), valid
+# as long as the fingerprint of the design geometry they were computed on is unchanged
+
+# config values the compute depends on, part of the input hash
+CACHE_CONFIG = ("KWIRE_RADIUS", "KWIRE_LENGTH", "TRILATERATION_METHOD", "CLUSTER_SIZE", "ANATOMY_DISTANCE_METHOD",
+                "CALIPER_SIGMA_MM", "MARKER_SIGMA_MM")
+
+# version of the PA computation (compute_PA and the kwiremath kernels it calls), part of the cache key:
+# bump it with every change of the computed values, the entries computed by the previous versions are then ignored
+COMPUTE_VERSION = 1
+
+
+class ResultsStore:
+    """sqlite store of the computed PAs (WAL journal, inserts grouped in transactions of batch_size records);
+    it can be used from any thread, one at a time (the batch writes it from a worker thread)"""
+
+    COLUMNS = ("PHASE_id", "ECP_id", "target", "phase", "success") # indexed columns that can be queried
+
+    def __init__(self, path: str, batch_size: int = 100):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.path = path
+        self.batch_size = batch_size
+        self._pending = []
+        self._pending_cache = []
+        self._lock = threading.RLock()
+
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        with self.conn:
+            self.conn.execute("""
+                CREATE TABLE IF NOT EXISTS PA_results (
+                    id          TEXT PRIMARY KEY,
+                    PHASE_id    TEXT,
+                    ECP_id      TEXT,
+                    target      TEXT,
+                    phase       INTEGER,
+                    success     INTEGER,
+                    computed_at REAL,
+                    record      TEXT NOT NULL
+                )""")
+            for column in self.COLUMNS:
+                self.conn.execute(f"CREATE INDEX IF NOT EXISTS PA_results_{column} ON PA_results ({column})")
+            self.conn.execute("CREATE INDEX IF NOT EXISTS PA_results_ECP_id_phase ON PA_results (ECP_id, phase)")
+            self.conn.execute("""
+                CREATE TABLE IF NOT EXISTS PA_cache (
+                    input_hash  TEXT PRIMARY KEY,
+                    geometry    TEXT NOT NULL,
+                    computed_at REAL,
+                    record      TEXT NOT NULL
+                )""")
+
+    def add(self, PA_data: data.PAdata):
+        "queue a PA, the queue is written when it reaches batch_size records (a PA already stored is replaced)"
+        with self._lock:
+            self._pending.append((
+                PA_data.id, PA_data.PHASE_id, PA_data.ECP_id, PA_data.target, PA_data.phase, PA_data.success,
+                time.time(), PA_data.dumps()))
+            if len(self._pending) >= self.batch_size:
+                self.flush()
+
+    def flush(self):
+        "write the queued PAs and cache entries in a single transaction"
+        with self._lock:
+            if not self._pending and not self._pending_cache:
+                return
+            with self.conn:
+                self.conn.executemany("INSERT OR REPLACE INTO PA_results VALUES (?, ?, ?, ?, ?, ?, ?, ?)", self._pending)
+                self.conn.executemany("INSERT OR REPLACE INTO PA_cache VALUES (?, ?, ?, ?)", self._pending_cache)
+            self._pending.clear()
+            self._pending_cache.clear()
+
+    def get_cached(self, input_hash: str, geometry: str) -> data.PAdata | None:
+        "computed PA of the inputs, None if it is not cached or if it was computed on a different geometry"
+        with self._lock:
+            self.flush()
+            row = self.conn.execute("SELECT geometry, record FROM PA_cache WHERE input_hash = ?", (input_hash,)).fetchone()
+        if row == None or row[0] != geometry:
+            return None
+        return data.PAdata.loads(row[1])
+
+    def put_cached(self, input_hash: str, geometry: str, PA_data: data.PAdata):
+        "queue a computed PA in the cache (an entry of the same inputs computed on another geometry is replaced)"
+        with self._lock:
+            self._pending_cache.append((input_hash, geometry, time.time(), PA_data.dumps()))
+            if len(self._pending_cache) >= self.batch_size:
+                self.flush()
+
+    def query(self, **where) -> list[data.PAdata]:
+        """PAs matching all the given column values, e.g. query(ECP_id="ECP:3", phase=2)"""
+        unknown = set(where) - set(self.COLUMNS)
+        if unknown:
+            raise ValueError(f"ResultsStore.query: unknown columns {unknown}, use {self.COLUMNS}")
+        sql = "SELECT record FROM PA_results"
+        if where:
+            sql += " WHERE " + " AND ".join(f"{column} = ?" for column in where)
+        with self._lock:
+            self.flush()
+            rows = self.conn.execute(sql, tuple(where.values())).fetchall()
+        return [data.PAdata.from_dict(json.loads(record)) for record, in rows]
+
+    def count(self) -> int:
+        with self._lock:
+            self.flush()
+            return self.conn.execute("SELECT COUNT(*) FROM PA_results").fetchone()[0]
+
+    def revision(self) -> tuple:
+        """changes whenever PAs are added, replaced (a rerun keeps the row count) or removed, also by other processes:
+        (row count, last computed_at)"""
+        with self._lock:
+            self.flush()
+            return self.conn.execute("SELECT COUNT(*), MAX(computed_at) FROM PA_results").fetchone()
+
+    def close(self):
+        with self._lock:
+            self.flush()
+            self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def input_hash(PA_data: data.PAdata) -> str:
+    "hash of the PA fields, of the config values the compute depends on and of the compute version"
+    inputs = {
+        "version": COMPUTE_VERSION,
+        "distances": [PA_data.P1A, PA_data.P1B, PA_data.P1C, PA_data.P1D, PA_data.P2A, PA_data.P2B, PA_data.P2C, PA_data.P2D],
+        "markers": PA_data.markers,
+        "target": PA_data.target,
+        "anatomy": list(PA_data.anatomy.keys()),
+        "config": {name: getattr(config, name) for name in CACHE_CONFIG},
+    }
+    return hashlib.sha1(json.dumps(inputs, sort_keys=True).encode()).hexdigest()
+
+
+_store: ResultsStore = None
+
+
+def get_results_store() -> ResultsStore:
+    "results store of the add-in (opened on first use, see config.RESULTS_DB_PATH)"
+    global _store
+    if _store is None:
+        _store = ResultsStore(config.RESULTS_DB_PATH, config.RESULTS_DB_BATCH_SIZE)
+    return _store
+
+
+def close_results_store():
+    global _store
+    if _store is not None:
+        _store.close()
+        _store = None
@@ -0,0 +1,174 @@
+import adsk.core, adsk.fusion
+import os, copy, json, time
+import traceback
+from ...lib import fusion360utils as futil
+from ...lib import kwiremath as kmath
+from ... import config
+
+import numpy as np
+from ..kwirevirtsys_fast import data
+from ..kwirevirtsys_fast import lookups
+
+_app = adsk.core.Application.get()
+_ui = _app.userInterface
+_product = _app.activeProduct
+_design = adsk.fusion.Design.cast(_product)
+_rootComp = _design.rootComponent
+
+# *** Specify the command identity information. ***
+CMD_ID = f'markerlayout'
+CMD_NAME = 'marker layout precision'
+CMD_Description = 'GDOP of the 4 markers layout over the anatomy bounding box, ranking of candidate layouts'
+
+# Specify that the command will be promoted to the panel.
+IS_PROMOTED = True
+
+# *** Define the location where the command button will be created. ***
+# This is done by specifying the workspace, the tab, and the panel, and the
+# command it will be inserted beside. Not providing the command to position it
+# will insert it at the end.
+WORKSPACE_ID = 'FusionSolidEnvironment'
+PANEL_ID = 'SolidScriptsAddinsPanel'
+COMMAND_BESIDE_ID = 'ScriptsManagerCommand'
+
+# Resource location for command icons, here we assume a sub folder in this directory named "resources".
+ICON_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'resources', '')
+
+# Local list of event handlers used to maintain a reference so
+# they are not released and garbage collected.
+local_handlers = []
+
+
+# Executed when add-in is run.
+def start():
+    # Create a command Definition.
+    cmd_def = _ui.commandDefinitions.addButtonDefinition(CMD_ID, CMD_NAME, CMD_Description, ICON_FOLDER)
+
+    # Define an event handler for the command created event. It will be called when the button is clicked.
+    futil.add_handler(cmd_def.commandCreated, command_created)
+
+    # ******** Add a button into the UI so the user can run the command. ********
+    # Get the target workspace the button will be created in.
+    workspace = _ui.workspaces.itemById(WORKSPACE_ID)
+
+    # Get the panel the button will be created in.
+    panel = workspace.toolbarPanels.itemById(PANEL_ID)
+
+    # Create the button command control in the UI after the specified existing command.
+    control = panel.controls.addCommand(cmd_def, COMMAND_BESIDE_ID, False)
+
+    # Specify if the command is promoted to the main toolbar.
+    control.isPromoted = IS_PROMOTED
+
+
+# Executed when add-in is stopped.
+def stop():
+    # Get the various UI elements for this command
+    workspace = _ui.workspaces.itemById(WORKSPACE_ID)
+    panel = workspace.toolbarPanels.itemById(PANEL_ID)
+    command_control = panel.controls.itemById(CMD_ID)
+    command_definition = _ui.commandDefinitions.itemById(CMD_ID)
+
+    # Delete the button command control
+    if command_control:
+        command_control.deleteMe()
+
+    # Delete the command definition
+    if command_definition:
+        command_definition.deleteMe()
+
+
+# Function that is called when a user clicks the corresponding button in the UI.
+# This defines the contents of the command dialog and connects to the command related events.
+def command_created(args: adsk.core.CommandCreatedEventArgs):
+    # General logging for debug.
+    futil.log(f'{CMD_NAME}: Command Created Event')
+
+    # https://help.autodesk.com/view/fusion360/ENU/?contextId=CommandInputs
+    inputs = args.command.commandInputs
+
+    _ = inputs.addStringValueInput('PA_data_str', 'import PA json data (markers and anatomy)')
+    _ = inputs.addStringValueInput('candidate_layouts', 'candidate layouts json ([{"A": "M:1", ...}, ...], empty for none)')
+    _ = inputs.addIntegerSpinnerCommandInput('resolution', 'grid resolution (voxels per side)', 10, 400, 10, config.GDOP_RESOLUTION)
+
+    futil.add_handler(args.command.execute, command_execute, local_handlers=local_handlers)
+    futil.add_handler(args.command.destroy, command_destroy, local_handlers=local_handlers)
+
+
+# This event handler is called when the command terminates.
+def command_destroy(args: adsk.core.CommandEventArgs):
+    # General logging for debug.
+    futil.log(f'{CMD_NAME}: Command Destroy Event')
+
+    global local_handlers
+    local_handlers = []
+
+
+# This event handler is called when the user clicks the OK button in the command dialog or
+# is immediately called after the created event not command inputs were created for the dialog.
+def command_execute(args: adsk.core.CommandEventArgs):
+    # General logging for debug.
+    futil.log(f'{CMD_NAME}: Command Execute Event')
+
+    try:
+        inputs = args.command.commandInputs
+        PA_data = data.PAdata.loads(adsk.core.StringValueCommandInput.cast(inputs.itemById('PA_data_str')).value)
+        candidates = adsk.core.StringValueCommandInput.cast(inputs.itemById('candidate_layouts')).value.strip()
+        candidates = json.loads(candidates) if candidates != "" else []
+        resolution = adsk.core.IntegerSpinnerCommandInput.cast(inputs.itemById('resolution')).value
+
+        lookup = lookups.DesignLookups()
+        lo, hi = get_anatomy_box(PA_data, lookup)
+        markers = get_layout(PA_data, lookup)
+        sigma = config.CALIPER_SIGMA_MM
+
+        # ---------------------------- GDOP GRID --------------------------- #
+        time_start = time.perf_counter()
+        grid, cached = kmath.cached_gdop_grid(config.GDOP_CACHE_DIR, markers, lo, hi, resolution)
+        percentile, median, maximum, degenerate = kmath.gdop_stats(grid, config.GDOP_PERCENTILE)
+        message = (
+            f"layout {PA_data.markers}\n"
+            f"box {np.round(lo*10, 1).tolist()} - {np.round(hi*10, 1).tolist()} mm, {resolution}^3 voxels "
+            f"({'cached' if cached else f'{time.perf_counter() - time_start:.1f} s'}), {degenerate} degenerate\n"
+            f"GDOP median {median:.2f}, p{config.GDOP_PERCENTILE} {percentile:.2f}, max {maximum:.2f}\n"
+            f"position error p{config.GDOP_PERCENTILE} at caliper sigma {sigma} mm: {percentile*sigma:.2f} mm")
+        futil.log(f'{CMD_NAME}: {message}')
+
+        # ------------------------ CANDIDATE LAYOUTS ----------------------- #
+        if candidates:
+            layouts = [PA_data.markers] + candidates
+            time_start = time.perf_counter()
+            order, scores, medians, degenerate = kmath.rank_layouts(
+                np.array([get_layout(PA_data, lookup, layout) for layout in layouts]), lo, hi, resolution, config.GDOP_PERCENTILE)
+            message += f"\n\n{len(layouts)} layouts ranked in {time.perf_counter() - time_start:.1f} s (p{config.GDOP_PERCENTILE} / median, degenerate voxels):"
+            for rank, n in enumerate(order, start=1):
+                line = f"{rank}. {layouts[n]}{' (current)' if n == 0 else ''}: {scores[n]:.2f} / {medians[n]:.2f}, {degenerate[n]}"
+                futil.log(f'{CMD_NAME}: {line}')
+                message += f"\n{line}"
+
+        _ui.messageBox(message)
+
+    except:
+        _ui.messageBox('Failed:\n{}'.format(traceback.format_exc()))
+
+
+# ------------------------------- LAYOUTS -------------------------------- #
+
+def get_layout(PA_data: data.PAdata, lookup: lookups.DesignLookups, layout: dict[str, str] = None) -> np.ndarray:
+    "coordinates (4, 3) of the markers A, B, C, D of the PA (or of the given layout, marker letter -> occurrence name)"
+    if layout != None:
+        PA_data = copy.copy(PA_data)
+        PA_data.markers = layout
+    markers = lookup.get_marker_array(PA_data)
+    if markers is None:
+        raise Exception(f"markers of layout {PA_data.markers} not found")
+    return markers
+
+
+def get_anatomy_box(PA_data: data.PAdata, lookup: lookups.DesignLookups) -> tuple[np.ndarray, np.ndarray]:
+    "bounding box (lo, hi) of the anatomy structures of the PA"
+    anatomy = lookup.get_anatomy_structs(PA_data)
+    if not anatomy:
+        raise Exception(f"anatomy structures {list(PA_data.anatomy.keys())} not found")
+    boxes = np.array([(brb.boundingBox.minPoint.asArray(), brb.boundingBox.maxPoint.asArray()) for brb in anatomy.values()])
+    return boxes[:, 0].min(axis=0), boxes[:, 1].max(axis=0)
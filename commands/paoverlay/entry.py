@@ -0,0 +1,206 @@
+import adsk.core, adsk.fusion
+import os, math
+import traceback
+from ...lib import fusion360utils as futil
+from ... import config
+
+import numpy as np
+from ..kwirevirtsys_fast import data
+from ..kwirevirtsys_fast import results_store
+
+_app = adsk.core.Application.get()
+_ui = _app.userInterface
+_product = _app.activeProduct
+_design = adsk.fusion.Design.cast(_product)
+_rootComp = _design.rootComponent
+
+# *** Specify the command identity information. ***
+CMD_ID = f'paoverlay'
+CMD_NAME = 'PA overlay'
+CMD_Description = 'Show the computed PAs as lightweight custom graphics (no timeline entities)'
+
+# Specify that the command will be promoted to the panel.
+IS_PROMOTED = True
+
+# *** Define the location where the command button will be created. ***
+# This is done by specifying the workspace, the tab, and the panel, and the
+# command it will be inserted beside. Not providing the command to position it
+# will insert it at the end.
+WORKSPACE_ID = 'FusionSolidEnvironment'
+PANEL_ID = 'SolidScriptsAddinsPanel'
+COMMAND_BESIDE_ID = 'ScriptsManagerCommand'
+
+# Resource location for command icons, here we assume a sub folder in this directory named "resources".
+ICON_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'resources', '')
+
+# Local list of event handlers used to maintain a reference so
+# they are not released and garbage collected.
+local_handlers = []
+
+# colour scales: PAdata field -> value drawn green, value drawn red
+COLOR_BY = {
+    'hit_count': (0, 2),
+    'angle_PA_target': (0, config.OVERLAY_ANGLE_MAX),
+}
+
+_overlay: adsk.fusion.CustomGraphicsGroup = None        # root group of the overlay
+_phase_groups: dict[int, adsk.fusion.CustomGraphicsGroup] = {}
+_overlay_key: tuple = None                              # (source, source revision, colour field, PAs per phase) of the drawn overlay
+
+
+# Executed when add-in is run.
+def start():
+    # Create a command Definition.
+    cmd_def = _ui.commandDefinitions.addButtonDefinition(CMD_ID, CMD_NAME, CMD_Description, ICON_FOLDER)
+
+    # Define an event handler for the command created event. It will be called when the button is clicked.
+    futil.add_handler(cmd_def.commandCreated, command_created)
+
+    # ******** Add a button into the UI so the user can run the command. ********
+    # Get the target workspace the button will be created in.
+    workspace = _ui.workspaces.itemById(WORKSPACE_ID)
+
+    # Get the panel the button will be created in.
+    panel = workspace.toolbarPanels.itemById(PANEL_ID)
+
+    # Create the button command control in the UI after the specified existing command.
+    control = panel.controls.addCommand(cmd_def, COMMAND_BESIDE_ID, False)
+
+    # Specify if the command is promoted to the main toolbar.
+    control.isPromoted = IS_PROMOTED
+
+
+# Executed when add-in is stopped.
+def stop():
+    # Get the various UI elements for this command
+    workspace = _ui.workspaces.itemById(WORKSPACE_ID)
+    panel = workspace.toolbarPanels.itemById(PANEL_ID)
+    command_control = panel.controls.itemById(CMD_ID)
+    command_definition = _ui.commandDefinitions.itemById(CMD_ID)
+
+    # Delete the button command control
+    if command_control:
+        command_control.deleteMe()
+
+    # Delete the command definition
+    if command_definition:
+        command_definition.deleteMe()
+
+    clear_overlay()
+
+
+# Function that is called when a user clicks the corresponding button in the UI.
+# This defines the contents of the command dialog and connects to the command related events.
+def command_created(args: adsk.core.CommandCreatedEventArgs):
+    # General logging for debug.
+    futil.log(f'{CMD_NAME}: Command Created Event')
+
+    # https://help.autodesk.com/view/fusion360/ENU/?contextId=CommandInputs
+    inputs = args.command.commandInputs
+
+    _ = inputs.addStringValueInput('source', 'PA jsonl file (empty for the results store)')
+    color_by = inputs.addDropDownCommandInput('color_by', 'colour by', adsk.core.DropDownStyles.TextListDropDownStyle)
+    for n, name in enumerate(COLOR_BY):
+        color_by.listItems.add(name, n == 0)
+    _ = inputs.addIntegerSpinnerCommandInput('max_PAs', 'max PAs drawn per phase', 1, 100000, 100, config.OVERLAY_MAX_PAS_PER_PHASE)
+    _ = inputs.addStringValueInput('phases', 'phases shown (comma separated, empty for all)')
+    _ = inputs.addBoolValueInput('clear', 'clear overlay', True, '', False)
+
+    futil.add_handler(args.command.execute, command_execute, local_handlers=local_handlers)
+    futil.add_handler(args.command.destroy, command_destroy, local_handlers=local_handlers)
+
+
+# This event handler is called when the command terminates.
+def command_destroy(args: adsk.core.CommandEventArgs):
+    # General logging for debug.
+    futil.log(f'{CMD_NAME}: Command Destroy Event')
+
+    global local_handlers
+    local_handlers = []
+
+
+# This event handler is called when the user clicks the OK button in the command dialog or
+# is immediately called after the created event not command inputs were created for the dialog.
+def command_execute(args: adsk.core.CommandEventArgs):
+    # General logging for debug.
+    futil.log(f'{CMD_NAME}: Command Execute Event')
+
+    try:
+        inputs = args.command.commandInputs
+        if adsk.core.BoolValueCommandInput.cast(inputs.itemById('clear')).value:
+            clear_overlay()
+            _app.activeViewport.refresh()
+            return
+
+        source = adsk.core.StringValueCommandInput.cast(inputs.itemById('source')).value.strip().strip('"')
+        color_by = adsk.core.DropDownCommandInput.cast(inputs.itemById('color_by')).selectedItem.name
+        max_PAs = adsk.core.IntegerSpinnerCommandInput.cast(inputs.itemById('max_PAs')).value
+        phases = adsk.core.StringValueCommandInput.cast(inputs.itemById('phases')).value
+        phases = set(int(p) for p in phases.split(",") if p.strip() != "")
+
+        # the overlay is only redrawn when its data or its look change, showing other phases just toggles groups
+        global _overlay_key
+        revision = results_store.get_results_store().revision() if source == "" else os.path.getmtime(source)
+        key = (source, revision, color_by, max_PAs)
+        if key != _overlay_key or _overlay == None or not _overlay.isValid:
+            with futil.span('draw overlay'):
+                draw_overlay(load_PAs(source), color_by, max_PAs)
+            _overlay_key = key
+        for phase, group in _phase_groups.items():
+            group.isVisible = not phases or phase in phases
+        _app.activeViewport.refresh()
+
+    except:
+        _ui.messageBox('Failed:\n{}'.format(traceback.format_exc()))
+
+
+# ------------------------------- OVERLAY -------------------------------- #
+
+def load_PAs(source: str) -> list[data.PAdata]:
+    "computed PAs (with coordinates) of a JSONL file, or of the results store when source is empty"
+    if source == "":
+        PAs = results_store.get_results_store().query()
+    else:
+        with open(source, 'r', encoding='utf-8') as f:
+            PAs = data.loads_many(f)
+    return [PA for PA in PAs if PA.P1_coord != None and PA.P3_coord != None]
+
+
+def draw_overlay(PAs: list[data.PAdata], color_by: str, max_PAs: int):
+    """draws the PAs in a custom graphics group per phase: one lines entity with the P1-P3 segments and one point set
+    with their end points, coloured by the color_by field; at most max_PAs PAs per phase (every n-th one beyond)"""
+    global _overlay
+    clear_overlay()
+    _overlay = _rootComp.customGraphicsGroups.add()
+
+    by_phase = {}
+    for PA in PAs:
+        by_phase.setdefault(PA.phase, []).append(PA)
+
+    drawn = 0
+    vmin, vmax = COLOR_BY[color_by]
+    for phase, phase_PAs in sorted(by_phase.items()):
+        stride = math.ceil(len(phase_PAs) / max_PAs)
+        phase_PAs = phase_PAs[::stride]
+        P1 = np.array([PA.P1_coord for PA in phase_PAs]) / 10
+        P3 = np.array([PA.P3_coord for PA in phase_PAs]) / 10
+        colors = futil.colormap(np.array([getattr(PA, color_by) for PA in phase_PAs], dtype=float), vmin, vmax)
+
+        group = _overlay.addGroup()
+        futil.add_segments(group, P1, P3, colors)
+        futil.add_points(group, np.concatenate([P1, P3]), np.concatenate([colors, colors]))
+        _phase_groups[phase] = group
+        drawn += len(phase_PAs)
+        futil.log(f'{CMD_NAME}: phase {phase}: {len(phase_PAs)} PAs drawn (1 every {stride})')
+
+    futil.log(f'{CMD_NAME}: {drawn} of {len(PAs)} PAs drawn in {len(by_phase)} phases, coloured by {color_by}')
+
+
+def clear_overlay():
+    "delete the overlay graphics"
+    global _overlay, _overlay_key
+    if _overlay != None and _overlay.isValid:
+        _overlay.deleteMe()
+    _overlay = None
+    _overlay_key = None
+    _phase_groups.clear()
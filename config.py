@@ -18,4 +18,71 @@ ADDIN_NAME = "kwire virtualization system"
 COMPANY_NAME = 'riberi'
 
 # Palettes
-sample_palette_id = f'{COMPANY_NAME}_{ADDIN_NAME}_palette_id'
\ No newline at end of file
+sample_palette_id = f'{COMPANY_NAME}_{ADDIN_NAME}_palette_id'
+
+# Trilateration method used by kwirevirtsys_fast to locate P1 and P2 from the 4 markers:
+# 'cluster' -> center of the tightest cluster of the 8 three-sphere intersection points
+# 'lsq'     -> least squares fit of the 4 spheres at once, refined with gauss-newton steps
+TRILATERATION_METHOD = 'cluster'
+
+# Number of the 8 three-sphere intersection points kept in the cluster by the 'cluster' trilateration method (3, 4 or 5);
+# the points left out are reported as outliers
+CLUSTER_SIZE = 4
+
+# P2 estimated (skin entry point) is found by a ray cast against the triangulated skin; when True the old
+# point containment marcher is run too and the distance between the two points is logged
+SKIN_RAYCAST_CROSSCHECK = False
+
+# Memory cap of the session cache of triangulated bodies (least recently used meshes are evicted first)
+MESH_CACHE_MAX_MB = 512
+
+# Distance of the k-wire from the anatomy structures used by kwirevirtsys_fast:
+# 'capsule' -> exact distance of the k-wire capsule (P1-P3 segment, k-wire radius) from the triangulated structures
+# 'brep'    -> fusion measure manager minimum distance between the extruded k-wire body and the structures
+ANATOMY_DISTANCE_METHOD = 'capsule'
+
+# Results store (sqlite) where kwirevirtsys_fast saves every computed PA; the inserts are grouped
+# in transactions of RESULTS_DB_BATCH_SIZE records
+RESULTS_DB_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results', 'results.sqlite3')
+RESULTS_DB_BATCH_SIZE = 100
+
+# Result cache of kwirevirtsys_fast (PA_cache table of the results store): a PA whose inputs (distances, markers,
+# target, anatomy list, k-wire and compute settings) were already computed on the same design geometry (markers,
+# target, skin and anatomy bodies) is returned from the cache, and its geometry is not created again if it exists
+RESULT_CACHE = True
+
+# Stage timing spans (lib/fusion360utils/trace_utils.py): when True every command execution writes a
+# chrome trace-event json (chrome://tracing, ui.perfetto.dev) with wall time, cpu time and fusion api calls per stage
+# (api_calls counts the api method calls only, property reads and writes are not counted)
+TRACE = False
+TRACE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results', 'traces')
+
+# K-wire model used by kwirevirtsys_fast and tools/reanalysis.py (fusion internal units, cm)
+KWIRE_RADIUS = 0.08
+KWIRE_LENGTH = 10.8
+
+# How kwirevirtsys_fast creates the k-wire body of a PA:
+# 'brep'    -> cylinder built by the temporary brep manager and added in a single base feature
+# 'extrude' -> construction plane + sketch + extrude + dissolve (the old method, kept for timing comparisons:
+#              run the same PAs with TRACE = True and each method, then compare the 'create cylinder' spans
+#              plus, for 'brep', the 'emit geometry' span of the flush that adds the bodies)
+KWIRE_BODY_METHOD = 'brep'
+
+# Measurement uncertainty propagated (through TRILATERATION_METHOD) to PAdata confidence_position and confidence_angle (standard deviations, mm):
+# caliper distance readings and marker positions (per coordinate, 0 when the design markers are taken as exact)
+CALIPER_SIGMA_MM = 0.5
+MARKER_SIGMA_MM = 0.0
+
+# Marker layout precision map (commands/markerlayout): GDOP of the 4 markers on a GDOP_RESOLUTION^3 voxel grid
+# covering the anatomy bounding box, cached in GDOP_CACHE_DIR; candidate layouts are ranked by the GDOP_PERCENTILE
+# percentile over the grid (lower is better), one layout at a time: a grid takes GDOP_RESOLUTION^3 float32
+# (4 MB at 100) and about 0.3 s per layout
+GDOP_RESOLUTION = 100
+GDOP_PERCENTILE = 95
+GDOP_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results', 'gdop')
+
+# PA overlay (commands/paoverlay): stored PAs drawn as custom graphics, one segment (P1-P3) and its end points per PA,
+# coloured green -> red by hit_count (0 -> 2+) or by angle_PA_target (0 -> OVERLAY_ANGLE_MAX degrees);
+# level of detail: at most OVERLAY_MAX_PAS_PER_PHASE PAs are drawn per phase (every n-th PA beyond that)
+OVERLAY_ANGLE_MAX = 10
+OVERLAY_MAX_PAS_PER_PHASE = 2000
@@ -1,2 +1,8 @@
 from .general_utils import *
 from .event_utils import *
+from .design_index import *
+from .trace_utils import *
+from .worker_utils import *
+from .brep_utils import *
+from .emit_utils import *
+from .graphics_utils import *
@@ -0,0 +1,54 @@
+import adsk.core, adsk.fusion
+
+app = adsk.core.Application.get()
+
+
+def cylinder_body(P1: adsk.core.Point3D, P2: adsk.core.Point3D, radius: float, length: float = None) -> adsk.fusion.BRepBody:
+    """Transient cylinder of the given radius on the axis P1-P2 (from P1 to P1 + length along P1->P2 when
+    length is given), built by the temporary BRep manager: it is not in the design until add_body is called,
+    so it can be used as it is for measurements."""
+    if length != None:
+        vector = P1.vectorTo(P2)
+        vector.normalize()
+        vector.scaleBy(length)
+        P2 = P1.copy()
+        P2.translateBy(vector)
+    return adsk.fusion.TemporaryBRepManager.get().createCylinderOrCone(P1, radius, P2, radius)
+
+
+def add_body(
+        body: adsk.fusion.BRepBody,
+        name: str = "",
+        occurrence: adsk.fusion.Occurrence = None,
+        base_feature: adsk.fusion.BaseFeature = None
+        ) -> adsk.fusion.BRepBody:
+    """Adds a transient body (world coordinates) to the component of the occurrence (the root component if None)
+    in a single timeline operation; returns the new body, in the occurrence context if one is given.
+
+    In parametric designs the body is added through a base feature: the one given (already in edit, see
+    GeometryEmitter) or a new one, which is then named after the body. Direct modeling designs add it directly."""
+    design = adsk.fusion.Design.cast(app.activeProduct)
+    component = design.rootComponent if occurrence == None else occurrence.component
+
+    if occurrence != None: # from world to component coordinates
+        transform = occurrence.transform2
+        transform.invert()
+        body = adsk.fusion.TemporaryBRepManager.get().copy(body)
+        adsk.fusion.TemporaryBRepManager.get().transform(body, transform)
+
+    if design.designType != adsk.fusion.DesignTypes.ParametricDesignType:
+        added = component.bRepBodies.add(body)
+    elif base_feature != None:
+        added = component.bRepBodies.add(body, base_feature)
+    else:
+        base_feature = component.features.baseFeatures.add()
+        base_feature.startEdit()
+        component.bRepBodies.add(body, base_feature)
+        base_feature.finishEdit()
+        added = base_feature.bodies.item(base_feature.bodies.count - 1) # the body references change when the edit ends
+        if name != "":
+            base_feature.name = name
+
+    if name != "":
+        added.name = name
+    return added if occurrence == None else added.createForAssemblyContext(occurrence)
@@ -0,0 +1,98 @@
+import adsk.core, adsk.fusion
+from .general_utils import log
+from .event_utils import add_handler
+
+app = adsk.core.Application.get()
+
+
+class DesignIndex:
+    """Name index of the design entities, built in a single traversal of all the occurrences.
+
+    occurrences -- occurrence name -> first occurrence with that name
+    bodies -- body name -> bodies (occurrence proxies) with that name, in traversal order
+    construction_points -- point name -> (occurrence, point) of the component points with that name
+    construction_axes -- axis name -> (occurrence, axis) of the component axes with that name
+    Component entities are listed once, with the first occurrence of their component.
+    """
+
+    def __init__(self, design: adsk.fusion.Design):
+        self.occurrences: dict[str, adsk.fusion.Occurrence] = {}
+        self.bodies: dict[str, list[adsk.fusion.BRepBody]] = {}
+        self.construction_points: dict[str, list[tuple[adsk.fusion.Occurrence, adsk.fusion.ConstructionPoint]]] = {}
+        self.construction_axes: dict[str, list[tuple[adsk.fusion.Occurrence, adsk.fusion.ConstructionAxis]]] = {}
+
+        visited_components = set()
+        for occ in design.rootComponent.allOccurrences:
+            self.occurrences.setdefault(occ.name, occ)
+
+            for brb in occ.bRepBodies:
+                self.bodies.setdefault(brb.name, []).append(brb)
+
+            comp = occ.component
+            if comp.id in visited_components:
+                continue
+            visited_components.add(comp.id)
+
+            for cp in comp.constructionPoints:
+                self.construction_points.setdefault(cp.name, []).append((occ, cp))
+            for ca in comp.constructionAxes:
+                self.construction_axes.setdefault(ca.name, []).append((occ, ca))
+
+    def body(self, name: str) -> adsk.fusion.BRepBody | None:
+        "first body with the given name"
+        found = self.bodies.get(name)
+        return found[0] if found else None
+
+    def construction_point(self, name: str) -> tuple[adsk.fusion.Occurrence, adsk.fusion.ConstructionPoint] | tuple[None, None]:
+        "first construction point with the given name and its occurrence"
+        found = self.construction_points.get(name)
+        return found[0] if found else (None, None)
+
+
+_index: DesignIndex = None
+_index_revision = None
+_events_registered = False
+
+
+def design_revision(design: adsk.fusion.Design) -> tuple:
+    """Cheap fingerprint of the design state: it changes when the document or the timeline changes.
+    Direct modeling designs have no timeline, their index is refreshed by the document events
+    or by invalidate_design_index.
+    """
+    if design.designType == adsk.fusion.DesignTypes.ParametricDesignType:
+        timeline = design.timeline
+        return design.parentDocument.name, timeline.count, timeline.markerPosition
+    return design.parentDocument.name,
+
+
+def get_design_index() -> DesignIndex:
+    """Returns the name index of the active design, rebuilding it when the document
+    or the timeline changed since it was built.
+    """
+    global _index, _index_revision
+    _register_events()
+
+    design = adsk.fusion.Design.cast(app.activeProduct)
+    revision = design_revision(design)
+    if _index is None or revision != _index_revision:
+        _index = DesignIndex(design)
+        _index_revision = revision
+        log(f'design index: {len(_index.occurrences)} occurrences, {sum(len(b) for b in _index.bodies.values())} bodies, '
+            f'{sum(len(p) for p in _index.construction_points.values())} construction points')
+    return _index
+
+
+def invalidate_design_index():
+    """Drops the design index, the next get_design_index call rebuilds it."""
+    global _index, _index_revision
+    _index = None
+    _index_revision = None
+
+
+def _register_events():
+    global _events_registered
+    if _events_registered:
+        return
+    add_handler(app.documentActivated, lambda args: invalidate_design_index(), name='design index documentActivated')
+    add_handler(app.documentClosed, lambda args: invalidate_design_index(), name='design index documentClosed')
+    _events_registered = True
@@ -0,0 +1,120 @@
+import adsk.core, adsk.fusion
+from typing import Callable
+from .general_utils import log
+from .brep_utils import add_body
+
+app = adsk.core.Application.get()
+
+
+class GeometryEmitter:
+    """Queue of construction points, construction axes and bodies (world coordinates) flushed in one grouped
+    timeline operation, instead of one timeline operation and one recompute per entity.
+
+    emitter = GeometryEmitter('PA geometry')
+    emitter.add_point(occ, P1, 'PA:1 P1')
+    emitter.add_axis(occ, adsk.core.Line3D.create(P1, P2), 'PA:1 axis')
+    emitter.add_body(occ, futil.cylinder_body(P1, P2, r, length), 'PA:1')
+    emitter.add_feature(lambda: build_extrude(...), 'PA:2')
+    emitter.flush()
+
+    The flush runs with the design compute deferred. In parametric designs each component receives its entities
+    through a single base feature, and the base features of a flush are gathered in a timeline group named after
+    the emitter. Direct modeling designs add the entities directly. Feature based geometry (add_feature) is built
+    after the base features, with the compute restored, and goes in the same timeline group.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self._queue: dict[str, tuple[adsk.fusion.Occurrence, list]] = {} # occurrence (or root) -> (occurrence, entities)
+        self._features: list[tuple[Callable, str]] = []
+
+    def __len__(self) -> int:
+        return sum(len(entities) for _, entities in self._queue.values()) + len(self._features)
+
+    def _entities(self, occ: adsk.fusion.Occurrence) -> list:
+        key = '' if occ == None else occ.fullPathName
+        return self._queue.setdefault(key, (occ, []))[1]
+
+    def add_point(self, occ: adsk.fusion.Occurrence, point: adsk.core.Point3D, name: str = ""):
+        self._entities(occ).append(('point', point.copy(), name))
+
+    def add_axis(self, occ: adsk.fusion.Occurrence, line: adsk.core.Line3D, name: str = ""):
+        self._entities(occ).append(('axis', (line.startPoint.copy(), line.endPoint.copy()), name))
+
+    def add_body(self, occ: adsk.fusion.Occurrence, body: adsk.fusion.BRepBody, name: str = ""):
+        "queue a transient body (see cylinder_body)"
+        self._entities(occ).append(('body', body, name))
+
+    def add_feature(self, build: Callable, name: str = ""):
+        "queue a call that builds feature based geometry (e.g. an extrude), which can't go in a base feature"
+        self._features.append((build, name))
+
+    def clear(self):
+        self._queue.clear()
+        self._features.clear()
+
+    def flush(self) -> int:
+        "create the queued entities; returns how many were created"
+        count = len(self)
+        if count == 0:
+            return 0
+        design = adsk.fusion.Design.cast(app.activeProduct)
+        parametric = design.designType == adsk.fusion.DesignTypes.ParametricDesignType
+        timeline_start = design.timeline.count if parametric else 0
+        deferred = design.isComputeDeferred
+        design.isComputeDeferred = True
+        queue, self._queue = self._queue, {}
+        features, self._features = self._features, []
+        try:
+            for occ, entities in queue.values():
+                self._flush_component(design, occ, entities, parametric)
+        finally:
+            design.isComputeDeferred = deferred
+        for build, name in features: # sketches and features need the design computed
+            build()
+        if parametric and design.timeline.count - timeline_start > 1:
+            group = design.timeline.timelineGroups.add(timeline_start, design.timeline.count - 1)
+            group.name = self.name
+        log(f'{self.name}: {count} entities created in {len(queue)} components ({len(features)} features)')
+        return count
+
+    def _flush_component(self, design: adsk.fusion.Design, occ: adsk.fusion.Occurrence, entities: list, parametric: bool):
+        component = design.rootComponent if occ == None else occ.component
+        transform = None
+        if occ != None: # entities are queued in world coordinates
+            transform = occ.transform2
+            transform.invert()
+
+        def local(point: adsk.core.Point3D) -> adsk.core.Point3D:
+            if transform != None:
+                point = point.copy()
+                point.transformBy(transform)
+            return point
+
+        base_feature = None
+        if parametric:
+            base_feature = component.features.baseFeatures.add()
+            base_feature.startEdit()
+        try:
+            for kind, geometry, name in entities:
+                if kind == 'body':
+                    add_body(geometry, name, occ, base_feature)
+                    continue
+                if kind == 'point':
+                    collection = component.constructionPoints
+                    entity_input = collection.createInput()
+                    entity_input.setByPoint(local(geometry))
+                else:
+                    start, end = (local(p) for p in geometry)
+                    collection = component.constructionAxes
+                    entity_input = collection.createInput()
+                    entity_input.setByLine(adsk.core.InfiniteLine3D.create(start, start.vectorTo(end)))
+                if base_feature != None:
+                    entity_input.targetBaseFeature = base_feature
+                entity = collection.add(entity_input)
+                if name != "":
+                    entity.name = name
+        finally:
+            if base_feature != None:
+                base_feature.finishEdit()
+                base_feature.name = f'{self.name} - {component.name}'
@@ -0,0 +1,52 @@
+import adsk.core, adsk.fusion
+import numpy as np
+
+# batched custom graphics: thousands of segments or points drawn as a single graphics entity,
+# coloured per vertex (coordinates in cm, colours as (N, 4) uint8 RGBA)
+
+
+def colormap(values: np.ndarray, vmin: float, vmax: float) -> np.ndarray:
+    "green (vmin) -> yellow -> red (vmax) RGBA colours (N, 4) uint8 of the values, grey where they are NaN"
+    t = np.clip((np.asarray(values, dtype=float) - vmin) / (vmax - vmin), 0, 1)
+    missing = np.isnan(t)
+    t[missing] = 0
+    colors = np.empty((len(t), 4), dtype=np.uint8)
+    colors[:, 0] = np.round(255 * np.minimum(1, 2*t))
+    colors[:, 1] = np.round(255 * np.minimum(1, 2 - 2*t))
+    colors[:, 2] = 0
+    colors[:, 3] = 255
+    colors[missing] = (128, 128, 128, 255)
+    return colors
+
+
+def _coordinates(points: np.ndarray, colors: np.ndarray) -> adsk.fusion.CustomGraphicsCoordinates:
+    coordinates = adsk.fusion.CustomGraphicsCoordinates.create(np.asarray(points, dtype=float).ravel().tolist())
+    coordinates.colors = np.asarray(colors, dtype=np.uint8).ravel().tolist()
+    return coordinates
+
+
+def add_segments(
+        group: adsk.fusion.CustomGraphicsGroup,
+        starts: np.ndarray,     # (N, 3)
+        ends: np.ndarray,       # (N, 3)
+        colors: np.ndarray,     # (N, 4) one colour per segment
+        weight: float = 1.0
+        ) -> adsk.fusion.CustomGraphicsLines:
+    "draws N segments as a single lines entity of the group"
+    points = np.stack([starts, ends], axis=1).reshape(-1, 3)
+    lines = group.addLines(_coordinates(points, np.repeat(colors, 2, axis=0)), [], False)
+    lines.color = adsk.fusion.CustomGraphicsVertexColorEffect.create()
+    lines.weight = weight
+    return lines
+
+
+def add_points(
+        group: adsk.fusion.CustomGraphicsGroup,
+        points: np.ndarray,     # (N, 3)
+        colors: np.ndarray      # (N, 4)
+        ) -> adsk.fusion.CustomGraphicsPointSet:
+    "draws N points as a single point set entity of the group"
+    point_set = group.addPointSet(
+        _coordinates(points, colors), [], adsk.fusion.CustomGraphicsPointTypes.PointCloudCustomGraphicsPointType, '')
+    point_set.color = adsk.fusion.CustomGraphicsVertexColorEffect.create()
+    return point_set
@@ -0,0 +1,119 @@
+import os
+import sys
+import json
+import time
+import threading
+from functools import wraps
+
+# Attempt to read the TRACE flag from parent config.
+try:
+    from ... import config
+    TRACE = config.TRACE
+except:
+    TRACE = False
+
+_events = []
+_depth = 0
+_api_calls = 0
+_pid = os.getpid()
+
+
+class span:
+    """Timing span of a stage, usable as a context manager or as a decorator.
+
+    with span('trilaterate P1'):
+        ...
+
+    @span('intersect skin')
+    def intersect_skin(...):
+        ...
+
+    When tracing is enabled each span records its wall time, its cpu time and the number of Fusion API
+    method calls made inside it as a chrome trace event (see write_trace); when disabled it does nothing.
+    Property reads and writes (e.g. point.x, occurrence.transform2) are not in api_calls, see _count_api_calls.
+    """
+
+    __slots__ = ('name', 'args', '_wall', '_cpu', '_api_calls')
+
+    def __init__(self, name: str, **args):
+        self.name = name
+        self.args = args
+        self._wall = None
+
+    def __enter__(self):
+        if not TRACE:
+            return self
+        global _depth
+        if _depth == 0:
+            sys.setprofile(_count_api_calls)
+        _depth += 1
+        self._api_calls = _api_calls
+        self._cpu = time.thread_time_ns()
+        self._wall = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc):
+        if self._wall is None:
+            return False
+        wall = time.perf_counter_ns()
+        cpu = time.thread_time_ns()
+        global _depth
+        _depth -= 1
+        if _depth == 0:
+            sys.setprofile(None)
+
+        _events.append({
+            "name": self.name,
+            "ph": "X",
+            "ts": self._wall / 1e3,
+            "dur": (wall - self._wall) / 1e3,
+            "pid": _pid,
+            "tid": threading.get_ident(),
+            "args": {**self.args, "cpu_ms": (cpu - self._cpu) / 1e6, "api_calls": _api_calls - self._api_calls},
+        })
+        self._wall = None
+        return False
+
+    def __call__(self, function):
+        name, args = self.name, self.args
+
+        @wraps(function)
+        def traced(*a, **kw):
+            if not TRACE:
+                return function(*a, **kw)
+            with span(name, **args):
+                return function(*a, **kw)
+        return traced
+
+
+def _count_api_calls(frame, event, arg):
+    """profile hook: counts the calls entering the adsk modules from outside of them. Only the python methods of the
+    adsk wrappers raise a 'call' event: their properties are accessors compiled in the api bindings, so property
+    reads and writes are not counted (a span full of them can show few api_calls and still spend its time in the api)"""
+    global _api_calls
+    if event == 'call' and frame.f_globals.get('__name__', '').startswith('adsk') \
+            and not (frame.f_back and frame.f_back.f_globals.get('__name__', '').startswith('adsk')):
+        _api_calls += 1
+
+
+def set_tracing(enabled: bool):
+    "enable or disable the spans (the default comes from config.TRACE)"
+    global TRACE
+    TRACE = enabled
+
+
+def tracing_enabled() -> bool:
+    return TRACE
+
+
+def write_trace(path: str) -> int:
+    """Writes the spans recorded so far to path as chrome trace-event json (open it in chrome://tracing
+    or https://ui.perfetto.dev) and clears them; returns the number of spans written."""
+    global _events
+    events, _events = _events, []
+    if not events:
+        return 0
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
+    return len(events)
@@ -0,0 +1,104 @@
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable
+import adsk.core
+from .general_utils import log
+from .event_utils import add_handler
+
+app = adsk.core.Application.get()
+
+
+class Cancelled(Exception):
+    "raised by WorkerExecutor.check_cancelled inside a job of a cancelled executor"
+
+
+class WorkerExecutor:
+    """Runs fusion-independent work (numpy, serialization, disk writes) on a thread pool and hands the results
+    back to the UI thread through a custom event, so the jobs never touch the fusion api and the callbacks
+    always run on the UI thread.
+
+    executor = WorkerExecutor('kwirevirtsys_fast batch')
+    executor.submit(trilaterate, markers, distances, on_done=show_points, on_error=report)
+    ...
+    executor.shutdown()
+
+    Jobs of a single worker executor (max_workers=1) run, and call back, in submission order.
+    """
+
+    def __init__(self, name: str, max_workers: int = None):
+        self.name = name
+        self.event_id = f'{name} worker {id(self)}'
+        self._pool = ThreadPoolExecutor(max_workers, thread_name_prefix=name)
+        self._done = queue.SimpleQueue()
+        self._cancel = threading.Event()
+        self._pending = 0
+        self._handlers = []
+        self._event = app.registerCustomEvent(self.event_id)
+        add_handler(self._event, self._on_custom_event, name=self.event_id, local_handlers=self._handlers)
+
+    @property
+    def pending(self) -> int:
+        "jobs submitted whose callback didn't run yet"
+        return self._pending
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancel.is_set()
+
+    def check_cancelled(self):
+        "call it between the steps of a long job to stop it early when the executor is cancelled"
+        if self._cancel.is_set():
+            raise Cancelled()
+
+    def submit(self, function: Callable, *args, on_done: Callable = None, on_error: Callable = None):
+        """Runs function(*args) on a worker thread; on_done(result) or on_error(exception) are then called on
+        the UI thread. Must be called from the UI thread, jobs submitted after cancel are dropped."""
+        if self._cancel.is_set():
+            return
+        self._pending += 1
+        self._pool.submit(self._run, function, args, on_done, on_error)
+
+    def _run(self, function: Callable, args: tuple, on_done: Callable, on_error: Callable):
+        # worker thread: the only fusion call allowed here is fireCustomEvent
+        try:
+            self.check_cancelled()
+            result, error = function(*args), None
+        except Exception as e:
+            result, error = None, e
+        self._done.put((result, error, on_done, on_error))
+        app.fireCustomEvent(self.event_id)
+
+    def _on_custom_event(self, args: adsk.core.CustomEventArgs):
+        # UI thread: one event can carry the results of several jobs
+        while True:
+            try:
+                result, error, on_done, on_error = self._done.get_nowait()
+            except queue.Empty:
+                return
+            self._pending -= 1
+            if isinstance(error, Cancelled):
+                continue
+            if error is None:
+                if on_done:
+                    on_done(result)
+            elif on_error:
+                on_error(error)
+            else:
+                log(f'{self.name}: worker job failed: {error}', adsk.core.LogLevels.ErrorLogLevel)
+
+    def cancel(self):
+        "drop the queued jobs; the running ones stop at their next check_cancelled and their callbacks are not called"
+        self._cancel.set()
+
+    def shutdown(self, wait: bool = False, cancel: bool = True):
+        """release the threads and the custom event; cancel: drop the jobs left (see cancel), else they still run;
+        wait: until the running jobs end (and, without cancel, the queued ones, their callbacks are then called here)"""
+        if cancel:
+            self.cancel()
+        self._pool.shutdown(wait=wait, cancel_futures=cancel)
+        if wait and not cancel:
+            self._on_custom_event(None)
+        self._event.remove(self._handlers[0])
+        app.unregisterCustomEvent(self.event_id)
+        self._handlers = []
@@ -0,0 +1,8 @@
+# numeric kernels of the add-in: numpy only, they never touch the fusion api, so they run on worker threads
+# and outside fusion (tools/reanalysis.py, benchmarks)
+from .trilateration import *
+from .distance import *
+from .mesh import *
+from .metrics import *
+from .uncertainty import *
+from .gdop import *
@@ -0,0 +1,106 @@
+import numpy as np
+
+# vectorized exact distances between points, segments and triangles
+# every argument broadcasts over a leading (K,) axis of 3D coordinates
+# triangles are given as a vertex v0 and the two edges e1 = v1 - v0, e2 = v2 - v0
+
+EPS = 1e-12
+
+
+def _dot(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    return (a * b).sum(axis=-1)
+
+
+def point_segment_distance(p: np.ndarray, a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    "distance of the points p from the segments a-b"
+    ab = b - a
+    t = np.clip(_dot(p - a, ab) / np.maximum(_dot(ab, ab), EPS), 0, 1)
+    return np.linalg.norm(p - (a + t[..., None] * ab), axis=-1)
+
+
+def segment_segment_distance(p0: np.ndarray, p1: np.ndarray, q0: np.ndarray, q1: np.ndarray) -> np.ndarray:
+    "distance between the segments p0-p1 and q0-q1 (closest points of the segments with clamped parameters)"
+    d1 = p1 - p0
+    d2 = q1 - q0
+    r = p0 - q0
+    a = _dot(d1, d1)
+    e = _dot(d2, d2)
+    f = _dot(d2, r)
+    c = _dot(d1, r)
+    b = _dot(d1, d2)
+    denom = a*e - b*b
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        # closest point of the infinite lines, clamped to the first segment (parallel segments start from s = 0)
+        s = np.where(denom > EPS, np.clip((b*f - c*e) / denom, 0, 1), 0.0)
+        # closest point on the second segment for that s, then re-clamp s if t had to be clamped
+        t = (b*s + f) / np.maximum(e, EPS)
+        s = np.where(t < 0, np.clip(-c / np.maximum(a, EPS), 0, 1), np.where(t > 1, np.clip((b - c) / np.maximum(a, EPS), 0, 1), s))
+        t = np.clip(t, 0, 1)
+        # degenerate second segment (a point)
+        s = np.where(e <= EPS, np.clip(-c / np.maximum(a, EPS), 0, 1), s)
+        t = np.where(e <= EPS, 0.0, t)
+
+    return np.linalg.norm((p0 + s[..., None]*d1) - (q0 + t[..., None]*d2), axis=-1)
+
+
+def point_triangle_distance(p: np.ndarray, v0: np.ndarray, e1: np.ndarray, e2: np.ndarray) -> np.ndarray:
+    "distance of the points p from the triangles"
+    n = np.cross(e1, e2)
+    nn = _dot(n, n)
+    degenerate = nn <= EPS
+    nn = np.maximum(nn, EPS)
+
+    # projection on the triangle plane, inside the triangle the distance is the plane distance
+    w = p - v0
+    u = _dot(np.cross(w, e2), n) / nn
+    v = _dot(np.cross(e1, w), n) / nn
+    inside = (u >= 0) & (v >= 0) & (u + v <= 1) & ~degenerate
+    plane = np.abs(_dot(w, n)) / np.sqrt(nn)
+
+    # outside the triangle (or for zero area triangles) the closest point lies on one of the edges
+    v1 = v0 + e1
+    v2 = v0 + e2
+    edges = np.minimum(np.minimum(
+        point_segment_distance(p, v0, v1),
+        point_segment_distance(p, v1, v2)),
+        point_segment_distance(p, v2, v0))
+
+    return np.where(inside, plane, edges)
+
+
+def segment_triangle_distance(p0: np.ndarray, p1: np.ndarray, v0: np.ndarray, e1: np.ndarray, e2: np.ndarray) -> np.ndarray:
+    "distance of the segments p0-p1 from the triangles (0 when the segment crosses the triangle)"
+    v1 = v0 + e1
+    v2 = v0 + e2
+
+    # if the segment doesn't cross the triangle the minimum is reached on a segment endpoint or on a triangle edge
+    dist = np.minimum.reduce([
+        point_triangle_distance(p0, v0, e1, e2),
+        point_triangle_distance(p1, v0, e1, e2),
+        segment_segment_distance(p0, p1, v0, v1),
+        segment_segment_distance(p0, p1, v1, v2),
+        segment_segment_distance(p0, p1, v2, v0)])
+
+    # segment crossing the triangle (möller-trumbore with the parameter limited to the segment)
+    d = p1 - p0
+    p = np.cross(d, e2)
+    det = _dot(e1, p)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        inv = 1.0 / det
+        s = p0 - v0
+        u = _dot(s, p) * inv
+        q = np.cross(s, e1)
+        v = _dot(d, q) * inv
+        t = _dot(e2, q) * inv
+    crossing = (np.abs(det) > EPS) & (u >= 0) & (v >= 0) & (u + v <= 1) & (t >= 0) & (t <= 1)
+
+    return np.where(crossing, 0.0, dist)
+
+
+def capsule_mesh_distance(mesh, p0: np.ndarray, p1: np.ndarray, radius: float) -> float:
+    """minimum distance between the capsule (segment p0-p1 swept by a sphere of the given radius)
+    and the closed mesh body; 0 if they intersect or if the capsule is inside the body"""
+    if mesh.contains(p0):
+        return 0.0
+    return max(mesh.segment_distance(p0, p1) - radius, 0.0)
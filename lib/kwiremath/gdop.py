@@ -0,0 +1,123 @@
+import os
+import hashlib
+import numpy as np
+
+# geometric dilution of precision of a marker layout
+# for a point p located from the markers m_i by the distances |p - m_i| (see uncertainty.py):
+#   J = u_i (unit vectors from the markers to p), cov(p) = sigma^2 (J^T J)^-1
+#   GDOP(p) = sqrt(trace((J^T J)^-1))  -> RMS position error of p per unit of distance error
+# evaluated over a regular voxel grid (voxel centers) in chunks, so the memory doesn't depend on the grid size
+
+GDOP_CHUNK = 1 << 16 # grid points evaluated at once (~30 MB of temporaries per layout)
+
+
+def grid_axes(lo: np.ndarray, hi: np.ndarray, resolution: int) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    "voxel center coordinates along x, y and z of a resolution^3 grid covering the box lo-hi"
+    lo = np.asarray(lo, dtype=float)
+    hi = np.asarray(hi, dtype=float)
+    step = (hi - lo) / resolution
+    return tuple(lo[k] + step[k]*(np.arange(resolution) + 0.5) for k in range(3))
+
+
+def _grid_points(axes: tuple[np.ndarray, np.ndarray, np.ndarray], start: int, stop: int) -> np.ndarray:
+    "grid points start:stop (C order, x slowest) as (stop - start, 3)"
+    i, j, k = np.unravel_index(np.arange(start, stop), (len(axes[0]), len(axes[1]), len(axes[2])))
+    return np.stack((axes[0][i], axes[1][j], axes[2][k]), axis=-1)
+
+
+def gdop(points: np.ndarray, markers: np.ndarray) -> np.ndarray:
+    """GDOP of the points (M, 3) located from the markers (4, 3) or (L, 4, 3) (L layouts): returns (M,) or (L, M);
+    inf where the layout can't locate the point (coplanar unit vectors, point on a marker)"""
+    markers = np.asarray(markers, dtype=float)[..., None]        # ([L,] 4, 3, 1)
+    px, py, pz = points[:, 0], points[:, 1], points[:, 2]
+
+    # J^T J = sum_i u_i u_i^T is symmetric, its 6 distinct terms are accumulated marker by marker
+    # on contiguous ([L,] M) arrays (much faster than reducing the small marker axis)
+    a = b = c = d = e = f = 0
+    for i in range(4):
+        x = px - markers[..., i, 0, :]
+        y = py - markers[..., i, 1, :]
+        z = pz - markers[..., i, 2, :]
+        with np.errstate(invalid='ignore', divide='ignore'):
+            w = 1 / (x*x + y*y + z*z)                             # unit vector u_i = (x, y, z) * sqrt(w)
+        xw, yw = x*w, y*w
+        a = a + x*xw; b = b + y*yw; c = c + z*z*w
+        d = d + y*xw; e = e + z*yw; f = f + z*xw
+
+    # trace of the inverse: sum of the diagonal cofactors over the determinant
+    cofactors = (b*c - e*e) + (a*c - f*f) + (a*b - d*d)
+    det = a*(b*c - e*e) - d*(d*c - e*f) + f*(d*e - b*f)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        result = np.sqrt(cofactors / det)
+    result[~(det > 1e-12)] = np.inf
+    return result
+
+
+def gdop_grid(
+        markers: np.ndarray,    # (4, 3)
+        lo: np.ndarray,         # (3,) box corners
+        hi: np.ndarray,
+        resolution: int = 100,
+        chunk: int = GDOP_CHUNK
+        ) -> np.ndarray:
+    "GDOP of the markers on the voxel centers of the box lo-hi: (resolution, resolution, resolution) float32, [i, j, k] -> x, y, z"
+    axes = grid_axes(lo, hi, resolution)
+    size = resolution**3
+    grid = np.empty(size, dtype=np.float32)
+    for start in range(0, size, chunk):
+        stop = min(start + chunk, size)
+        grid[start:stop] = gdop(_grid_points(axes, start, stop), markers)
+    return grid.reshape(resolution, resolution, resolution)
+
+
+def gdop_grid_key(markers: np.ndarray, lo: np.ndarray, hi: np.ndarray, resolution: int) -> str:
+    "cache key of a gdop grid (coordinates rounded to 1e-6, so the same layout read twice gives the same key)"
+    values = np.round(np.concatenate((np.ravel(markers), np.ravel(lo), np.ravel(hi))).astype(float), 6) + 0.0
+    return hashlib.sha1(values.tobytes() + str(resolution).encode()).hexdigest()[:16]
+
+
+def cached_gdop_grid(
+        cache_dir: str,
+        markers: np.ndarray,
+        lo: np.ndarray,
+        hi: np.ndarray,
+        resolution: int = 100
+        ) -> tuple[np.ndarray, bool]:
+    "gdop_grid read from / saved to cache_dir/gdop_<key>.npy; returns the grid and whether it came from the cache"
+    path = os.path.join(cache_dir, f"gdop_{gdop_grid_key(markers, lo, hi, resolution)}.npy")
+    if os.path.exists(path):
+        return np.load(path), True
+    grid = gdop_grid(markers, lo, hi, resolution)
+    os.makedirs(cache_dir, exist_ok=True)
+    np.save(path, grid)
+    return grid, False
+
+
+def gdop_stats(values: np.ndarray, percentile: float = 95) -> tuple[float, float, float, int]:
+    """percentile, median and maximum of the finite GDOP values (a grid or part of it) and the number of
+    degenerate points (non-finite GDOP: the markers don't constrain the position there), left out of the statistics"""
+    values = np.ravel(values)
+    finite = values[np.isfinite(values)]
+    if len(finite) == 0:
+        return np.nan, np.nan, np.nan, len(values)
+    score, median = np.percentile(finite, [percentile, 50])
+    return float(score), float(median), float(finite.max()), len(values) - len(finite)
+
+
+def rank_layouts(
+        layouts: np.ndarray,    # (L, 4, 3) candidate marker layouts
+        lo: np.ndarray,
+        hi: np.ndarray,
+        resolution: int = 100,
+        percentile: float = 95,
+        chunk: int = GDOP_CHUNK
+        ) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """scores the candidate layouts over the voxel grid of the box lo-hi; returns the layout indices best first,
+    the GDOP percentile (L,) of each layout (the ranking score, lower is better), its median (L,) and its number of
+    degenerate points (L,), with the same statistics as gdop_stats (layouts with no finite point rank last).
+    One layout at a time, only its statistics are kept: the memory is one grid (resolution^3 float32) whatever L"""
+    stats = [gdop_stats(gdop_grid(markers, lo, hi, resolution, chunk), percentile) for markers in np.asarray(layouts, dtype=float)]
+    scores = np.array([score for score, _, _, _ in stats])
+    medians = np.array([median for _, median, _, _ in stats])
+    degenerate = np.array([count for _, _, _, count in stats])
+    return np.argsort(scores, kind='stable'), scores, medians, degenerate
@@ -0,0 +1,198 @@
+import numpy as np
+from .distance import segment_triangle_distance, point_segment_distance
+
+# triangle mesh queries (ray casts, point containment, distances) accelerated by a bounding volume hierarchy
+# the hierarchy is stored in flat arrays and traversed one level at a time, so every level is a handful of vectorized ops
+
+
+class TriangleMesh:
+    "triangle mesh with a bounding volume hierarchy over its triangles"
+
+    def __init__(self, vertices: np.ndarray, triangles: np.ndarray, leaf_size: int = 8):
+        """vertices: (V, 3) coordinates
+        triangles: (T, 3) vertex indices of each triangle
+        leaf_size: max triangles stored in each leaf of the hierarchy"""
+        self.vertices = np.ascontiguousarray(vertices, dtype=float)
+        self.triangles = np.ascontiguousarray(triangles, dtype=np.int32)
+        self.leaf_size = leaf_size
+        self._build()
+
+    @property
+    def nbytes(self) -> int:
+        "memory used by the mesh and its hierarchy"
+        return sum(a.nbytes for a in (
+            self.vertices, self.triangles, self.v0, self.e1, self.e2,
+            self.node_min, self.node_max, self.node_left, self.node_right, self.node_start, self.node_count))
+
+    def _build(self):
+        "build the hierarchy splitting the triangles at the centroid median of the longest axis"
+        tri = self.vertices[self.triangles] # (T, 3, 3)
+        tri_min = tri.min(axis=1)
+        tri_max = tri.max(axis=1)
+        centroids = tri.mean(axis=1)
+
+        order = np.arange(len(tri))
+        node_min, node_max, node_left, node_right, node_start, node_count = [], [], [], [], [], []
+
+        # each stack item is (node index, start, end) over the order array
+        node_min.append(None); node_max.append(None); node_left.append(-1); node_right.append(-1); node_start.append(0); node_count.append(len(tri))
+        stack = [(0, 0, len(tri))]
+        while stack:
+            node, start, end = stack.pop()
+            idx = order[start:end]
+            node_min[node] = tri_min[idx].min(axis=0) if len(idx) else np.full(3, np.inf)
+            node_max[node] = tri_max[idx].max(axis=0) if len(idx) else np.full(3, -np.inf)
+            if end - start <= self.leaf_size:
+                continue
+
+            c = centroids[idx]
+            axis = np.argmax(c.max(axis=0) - c.min(axis=0))
+            mid = (end - start) // 2
+            order[start:end] = idx[np.argpartition(c[:, axis], mid)]
+
+            for child_start, child_end in ((start, start + mid), (start + mid, end)):
+                child = len(node_min)
+                node_min.append(None); node_max.append(None); node_left.append(-1); node_right.append(-1)
+                node_start.append(child_start); node_count.append(child_end - child_start)
+                if child_start == start:
+                    node_left[node] = child
+                else:
+                    node_right[node] = child
+                stack.append((child, child_start, child_end))
+
+        self.node_min = np.array(node_min)
+        self.node_max = np.array(node_max)
+        self.node_left = np.array(node_left)
+        self.node_right = np.array(node_right)
+        self.node_start = np.array(node_start)
+        self.node_count = np.array(node_count)
+        self.node_leaf = self.node_left < 0
+
+        # triangles stored in hierarchy order (leaves reference contiguous ranges)
+        self.order = order
+        tri = tri[order]
+        self.v0 = np.ascontiguousarray(tri[:, 0])
+        self.e1 = np.ascontiguousarray(tri[:, 1] - tri[:, 0])
+        self.e2 = np.ascontiguousarray(tri[:, 2] - tri[:, 0])
+
+    def _leaf_triangles(self, leaves: np.ndarray) -> np.ndarray:
+        "indices (in hierarchy order) of the triangles of the given leaves"
+        counts = self.node_count[leaves]
+        if counts.sum() == 0:
+            return np.empty(0, dtype=np.int64)
+        starts = np.repeat(self.node_start[leaves] - np.cumsum(counts) + counts, counts)
+        return starts + np.arange(counts.sum())
+
+    def _ray_triangles(self, origin: np.ndarray, direction: np.ndarray, tris: np.ndarray) -> np.ndarray:
+        "möller-trumbore ray-triangle intersection; returns the ray parameter of each triangle hit (NaN if missed)"
+        e1 = self.e1[tris]
+        e2 = self.e2[tris]
+        p = np.cross(direction, e2)
+        det = np.einsum('ij,ij->i', e1, p)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            inv = 1.0 / det
+            s = origin - self.v0[tris]
+            u = np.einsum('ij,ij->i', s, p) * inv
+            q = np.cross(s, e1)
+            v = (q @ direction) * inv
+            t = np.einsum('ij,ij->i', e2, q) * inv
+        hit = (np.abs(det) > 1e-14) & (u >= 0) & (v >= 0) & (u + v <= 1)
+        return np.where(hit, t, np.nan)
+
+    def _ray_nodes(self, origin: np.ndarray, inv_direction: np.ndarray, nodes: np.ndarray, max_distance: float) -> tuple[np.ndarray, np.ndarray]:
+        "slab test of the ray against the node boxes; returns which nodes are hit and the entry parameter"
+        with np.errstate(invalid='ignore'):
+            t1 = (self.node_min[nodes] - origin) * inv_direction
+            t2 = (self.node_max[nodes] - origin) * inv_direction
+        t1 = np.nan_to_num(t1, nan=-np.inf)
+        t2 = np.nan_to_num(t2, nan=np.inf)
+        tnear = np.minimum(t1, t2).max(axis=1)
+        tfar = np.maximum(t1, t2).min(axis=1)
+        return (tnear <= tfar) & (tfar >= 0) & (tnear <= max_distance), tnear
+
+    def raycast(self, origin: np.ndarray, direction: np.ndarray, max_distance: float = np.inf, min_distance: float = 1e-9) -> float | None:
+        """returns the ray parameter of the first triangle hit by the ray origin + t*direction with
+        min_distance < t <= max_distance, None if nothing is hit"""
+        origin = np.asarray(origin, dtype=float)
+        direction = np.asarray(direction, dtype=float)
+        with np.errstate(divide='ignore'):
+            inv_direction = 1.0 / direction
+
+        best = np.inf
+        frontier = np.array([0])
+        while frontier.size:
+            hit, tnear = self._ray_nodes(origin, inv_direction, frontier, min(best, max_distance))
+            frontier = frontier[hit]
+
+            # test the triangles of the leaves reached at this level, shrinking the search for the next levels
+            leaves = frontier[self.node_leaf[frontier]]
+            if leaves.size:
+                t = self._ray_triangles(origin, direction, self._leaf_triangles(leaves))
+                t = t[(t > min_distance) & (t <= max_distance)]
+                if t.size:
+                    best = min(best, t.min())
+
+            inner = frontier[~self.node_leaf[frontier]]
+            frontier = np.concatenate([self.node_left[inner], self.node_right[inner]])
+
+        return None if np.isinf(best) else float(best)
+
+    def ray_hits(self, origin: np.ndarray, direction: np.ndarray) -> np.ndarray:
+        "returns the ray parameters (t > 0) of all the triangles hit by the ray origin + t*direction"
+        origin = np.asarray(origin, dtype=float)
+        direction = np.asarray(direction, dtype=float)
+        with np.errstate(divide='ignore'):
+            inv_direction = 1.0 / direction
+
+        hits = []
+        frontier = np.array([0])
+        while frontier.size:
+            hit, _ = self._ray_nodes(origin, inv_direction, frontier, np.inf)
+            frontier = frontier[hit]
+            leaves = frontier[self.node_leaf[frontier]]
+            if leaves.size:
+                t = self._ray_triangles(origin, direction, self._leaf_triangles(leaves))
+                hits.append(t[t > 0])
+            inner = frontier[~self.node_leaf[frontier]]
+            frontier = np.concatenate([self.node_left[inner], self.node_right[inner]])
+
+        return np.concatenate(hits) if hits else np.empty(0)
+
+    def contains(self, point: np.ndarray) -> bool:
+        "point inside the closed mesh (parity of the crossings of a ray leaving the point)"
+        # oblique direction, so the ray is unlikely to graze edges of axis aligned tessellations
+        return len(self.ray_hits(point, np.array([0.5773, 0.5774, 0.5775]))) % 2 == 1
+
+    def segment_distance(self, p0: np.ndarray, p1: np.ndarray) -> float:
+        "exact minimum distance of the segment p0-p1 from the mesh triangles"
+        p0 = np.asarray(p0, dtype=float)
+        p1 = np.asarray(p1, dtype=float)
+        if self.node_count[0] == 0:
+            return np.inf
+
+        seg_min = np.minimum(p0, p1)
+        seg_max = np.maximum(p0, p1)
+
+        best = np.inf
+        frontier = np.array([0])
+        while frontier.size:
+            # distance bounds of each node from its box: the segment box gap and the box center distance
+            # give lower bounds, the box center distance plus the half diagonal is an upper bound
+            box_min = self.node_min[frontier]
+            box_max = self.node_max[frontier]
+            center = (box_min + box_max) / 2
+            half_diagonal = np.linalg.norm(box_max - box_min, axis=1) / 2
+            center_distance = point_segment_distance(center, p0, p1)
+            gap = np.linalg.norm(np.maximum(0, np.maximum(box_min - seg_max, seg_min - box_max)), axis=1)
+            lower = np.maximum(gap, center_distance - half_diagonal)
+            best = min(best, (center_distance + half_diagonal).min())
+
+            frontier = frontier[lower <= best]
+            leaves = frontier[self.node_leaf[frontier]]
+            if leaves.size:
+                tris = self._leaf_triangles(leaves)
+                best = min(best, segment_triangle_distance(p0, p1, self.v0[tris], self.e1[tris], self.e2[tris]).min())
+            inner = frontier[~self.node_leaf[frontier]]
+            frontier = np.concatenate([self.node_left[inner], self.node_right[inner]])
+
+        return float(best)
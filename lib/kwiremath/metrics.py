@@ -0,0 +1,70 @@
+import numpy as np
+from .mesh import TriangleMesh
+from .distance import capsule_mesh_distance
+
+# positioning attempt metrics computed from coordinates only: skin intersection, anatomy distances, angle and deltas
+# same quantities and roundings of kwirevirtsys_fast compute_PA: coordinates in cm, reported values in mm
+
+K_RADANG = 57.2958 # radians to degrees, the constant used by kwirevirtsys_fast (keeps the rounded angles identical)
+SKIN_MAX_DISTANCE = 200 # cm, max ray length of the skin intersection
+
+
+def skin_intersection(skin: TriangleMesh, P: np.ndarray, direction: np.ndarray) -> np.ndarray | None:
+    "first point of the ray P + t*direction (normalized) on the skin mesh, None if it misses"
+    direction = direction / np.linalg.norm(direction)
+    t = skin.raycast(P, direction, max_distance=SKIN_MAX_DISTANCE)
+    return None if t is None else P + t*direction
+
+
+def line_angle(u: np.ndarray, v: np.ndarray) -> float:
+    "angle between two lines with directions u and v in degrees (0 to 90)"
+    cos = np.dot(u, v) / (np.linalg.norm(u) * np.linalg.norm(v))
+    angle = abs(round(float(np.arccos(np.clip(cos, -1, 1))) * K_RADANG, 3))
+    return 180 - angle if angle > 90 else angle
+
+
+def PA_metrics(
+        markers: dict[str, np.ndarray],  # marker letter -> (3,) coordinates
+        P1: np.ndarray,                  # trilaterated kwire P1 and P2
+        P2: np.ndarray,
+        target_P1: np.ndarray,           # target insertion point, target P2 and P2 estimated (skin entry)
+        target_P2: np.ndarray,
+        target_P2e: np.ndarray,
+        skin: TriangleMesh,
+        anatomy: dict[str, TriangleMesh],
+        kwire_radius: float,
+        kwire_length: float
+        ) -> dict:
+    """returns the PAdata fields derived from the PA P1 and P2 (all the fields computed by kwirevirtsys_fast
+    except the trilateration errors); raises if the PA axis doesn't reach the skin"""
+    vector = (P2 - P1) / np.linalg.norm(P2 - P1)
+    P2e = skin_intersection(skin, P1, vector)
+    if P2e is None:
+        raise ValueError("PA axis doesn't intersect the skin")
+    P3 = P1 + vector*kwire_length
+
+    fields = {
+        "P1_coord": (P1*10).tolist(),
+        "P2_coord": (P2*10).tolist(),
+        "P2e_coord": (P2e*10).tolist(),
+        "P3_coord": (P3*10).tolist(),
+    }
+
+    fields["anatomy"] = {name: round(capsule_mesh_distance(mesh, P1, P3, kwire_radius)*10, 3) for name, mesh in anatomy.items()}
+    fields["hit_count"] = sum(1 for value in fields["anatomy"].values() if value == 0.0)
+    fields["angle_PA_target"] = line_angle(P2 - P1, target_P2e - target_P1)
+
+    for name, P in (("P1", P1), ("P2", P2), ("P2e", P2e)):
+        for letter, marker in markers.items():
+            fields[f"{name}{letter}_F"] = round(float(np.linalg.norm(P - marker))*10, 3)
+
+    for name, P, target in (("P1", P1, target_P1), ("P2", P2, target_P2), ("P2e", P2e, target_P2e)):
+        fields[f"distance_{name}_PA_target"] = round(float(np.linalg.norm(target - P))*10, 3)
+        for axis, k in (("X", 0), ("Y", 1), ("Z", 2)):
+            fields[f"distance_{name}_PA_target_{axis}"] = round(float(target[k] - P[k])*10, 3)
+
+    target_insertion_depth = kwire_length - float(np.linalg.norm(target_P2e - target_P1))*10
+    PA_insertion_depth = kwire_length - float(np.linalg.norm(P1 - P2e))*10
+    fields["delta_id_PA_target"] = round(PA_insertion_depth - target_insertion_depth, 3)
+
+    return fields
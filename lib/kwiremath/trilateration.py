@@ -0,0 +1,290 @@
+import numpy as np
+from itertools import combinations
+from functools import lru_cache
+
+# vectorized trilateration kernels: points located from their distances to the 4 markers
+# shapes used below:
+#   N -> number of independent problems (e.g. P1 and P2 of many positioning attempts)
+#   coordinates and distances are in fusion internal units (cm)
+
+# marker triples solved for every 4 spheres problem (same order used by trilaterate3D_4spheres)
+TRIPLES = np.array([[0, 1, 2], [0, 1, 3], [0, 2, 3], [1, 2, 3]])
+
+CLUSTER_SIZES = (3, 4, 5) # supported number of candidate points kept in the cluster
+
+
+def trilaterate3D_batch(
+        m1: np.ndarray, # (N, 3) marker points
+        r1: np.ndarray, # (N,)   marker point distances to trilateration point
+        m2: np.ndarray,
+        r2: np.ndarray,
+        m3: np.ndarray,
+        r3: np.ndarray
+        ) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """returns the 2 intersection points (N, 3) of each system of 3 spheres and the radius inflation (N,)
+    that was added to all 3 radii to make the system feasible; rows that can't be solved are NaN"""
+
+    m1 = np.asarray(m1, dtype=float)
+    m2 = np.asarray(m2, dtype=float)
+    m3 = np.asarray(m3, dtype=float)
+    r1 = np.asarray(r1, dtype=float)
+    r2 = np.asarray(r2, dtype=float)
+    r3 = np.asarray(r3, dtype=float)
+
+    d, i, j, e_x, e_y, e_z = _triple_bases(m1, m2, m3)
+    x, y, z, inflation = _solve_triples(r1, r2, r3, d, i, j)
+
+    base = m1 + x[:, None]*e_x + y[:, None]*e_y
+    ans1 = base + z[:, None]*e_z
+    ans2 = base - z[:, None]*e_z
+    return ans1, ans2, inflation
+
+
+def _triple_bases(m1: np.ndarray, m2: np.ndarray, m3: np.ndarray) -> tuple:
+    """local basis of each marker triple (..., 3): origin m1, e_x towards m2, e_y in the markers plane, e_z normal to it;
+    returns d = |m2 - m1|, the coordinates i, j of m3 in the basis and e_x, e_y, e_z"""
+    d = np.linalg.norm(m2 - m1, axis=-1)
+    e_x = (m2 - m1) / d[..., None]
+    i = np.einsum('...k,...k->...', e_x, m3 - m1)
+    e_y = m3 - m1 - i[..., None] * e_x
+    e_y /= np.linalg.norm(e_y, axis=-1)[..., None]
+    e_z = np.cross(e_x, e_y)
+    j = np.einsum('...k,...k->...', e_y, m3 - m1)
+    return d, i, j, e_x, e_y, e_z
+
+
+def _solve_triples(r1, r2, r3, d, i, j) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """coordinates x, y, z (z >= 0) of the intersection of 3 spheres in the local basis of their markers and the
+    radius inflation that was added to all 3 radii to make the system feasible (NaN where it can't be solved)"""
+
+    # with all the radii inflated by t the solution coordinates are linear in t:
+    #   x(t) = x0 + x1*t,  y(t) = y0 + y1*t
+    # and the squared height over the markers plane is a quadratic in t:
+    #   z(t)^2 = (r1 + t)^2 - x(t)^2 - y(t)^2 = c2*t^2 + c1*t + c0
+    x0 = (r1**2 - r2**2 + d**2) / (2*d)
+    x1 = (r1 - r2) / d
+    y0 = ((r1**2 - r3**2 + i**2 + j**2) / (2*j)) - ((i/j) * x0)
+    y1 = ((r1 - r3) / j) - ((i/j) * x1)
+    c2 = 1 - x1**2 - y1**2
+    c1 = 2 * (r1 - x0*x1 - y0*y1)
+    c0 = r1**2 - x0**2 - y0**2
+
+    # the spheres don't intersect (either a couple of them or the 3 of them in the same area,
+    # look at: 3 spheres intersection edge case.png): the smallest inflation is the first positive root of z(t)^2
+    # (when no positive root exists uniform inflation can't make the system feasible, e.g. nested spheres)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        sq = np.sqrt(c1**2 - 4*c2*c0)
+        roots = np.stack([(-c1 - sq) / (2*c2), (-c1 + sq) / (2*c2), -c0 / c1], axis=-1)
+    linear = np.abs(c2) < 1e-12
+    roots[..., :2][linear] = np.nan # linear case
+    roots[..., 2][~linear] = np.nan
+    roots[~(roots > 0)] = np.inf
+    inflation = np.where(c0 >= 0, 0.0, roots.min(axis=-1))
+    inflation[np.isinf(inflation)] = np.nan
+
+    x = x0 + x1*inflation
+    y = y0 + y1*inflation
+    z = np.sqrt(np.maximum(c2*inflation**2 + c1*inflation + c0, 0)) # clip round-off at the tangency point
+    return x, y, z, inflation
+
+
+def trilaterate3D_4spheres_batch(
+        markers: np.ndarray,   # (N, 4, 3) or (4, 3) markers A, B, C, D
+        distances: np.ndarray, # (N, 4) distances to markers A, B, C, D
+        cluster_size: int = 4
+        ) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """returns, for each row, the 8 candidate intersection points (N, 8, 3), the cluster center (N, 3),
+    the mean distance of the cluster points from its center (N,), the radius inflation applied to
+    each of the 4 marker triples (N, 4) and the candidate points left out of the cluster (N, 8)"""
+
+    distances = np.atleast_2d(np.asarray(distances, dtype=float))
+    markers = np.broadcast_to(np.asarray(markers, dtype=float), (len(distances), 4, 3))
+
+    # we have 4 markers and 4 distances, trilaterate each combination of them to get 4x2=8 sphere intersection points.
+    # (3 intersecting spheres have 2 points in common, except for edgecases)
+    n = len(distances)
+    m = markers[:, TRIPLES].transpose(1, 0, 2, 3).reshape(4*n, 3, 3) # (4N, 3, 3) triple-major
+    r = distances[:, TRIPLES].transpose(1, 0, 2).reshape(4*n, 3)      # (4N, 3)
+    ans1, ans2, inflation = trilaterate3D_batch(m[:, 0], r[:, 0], m[:, 1], r[:, 1], m[:, 2], r[:, 2])
+    candidates = np.stack([ans1, ans2], axis=1).reshape(4, n, 2, 3).transpose(1, 0, 2, 3).reshape(n, 8, 3)
+    inflations = inflation.reshape(4, n).T
+
+    centers, means, outliers = select_cluster(candidates, cluster_size)
+
+    return candidates, centers, means, inflations, outliers
+
+
+def select_cluster(
+        points: np.ndarray, # (N, M, 3) candidate points
+        k: int = 4          # number of points in the cluster
+        ) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """find, for each row, the group (cluster) of k points which are the closest to eachother (smallest sum of
+    pairwise distances); returns the cluster centers (N, 3), the mean distance of the cluster points from
+    their center (N,) and the points left out of the cluster as outlier flags (N, M)
+    rows containing NaN points are NaN"""
+
+    points = np.asarray(points, dtype=float)
+    n, count, _ = points.shape
+    subsets, pairs = _subsets(count, k)
+
+    # the pairwise distance matrix is computed once, all the k-subsets are scored by indexing it
+    dist = np.linalg.norm(points[:, :, None] - points[:, None], axis=-1) # (N, M, M)
+    scores = dist[:, pairs[:, 0], pairs[:, 1]] @ _pair_membership(count, k) # (N, subsets)
+    best = np.argmin(np.nan_to_num(scores, nan=np.inf), axis=-1)
+
+    cluster_idx = subsets[best]                                   # (N, k)
+    cluster = np.take_along_axis(points, cluster_idx[..., None], axis=1)
+    centers = cluster.mean(axis=1)
+    means = np.linalg.norm(cluster - centers[:, None], axis=-1).mean(axis=-1)
+
+    outliers = np.ones((n, count), dtype=bool)
+    np.put_along_axis(outliers, cluster_idx, False, axis=1)
+
+    # a system that could not be solved invalidates the whole row
+    failed = np.isnan(points).any(axis=(1, 2))
+    centers[failed] = np.nan
+    means[failed] = np.nan
+
+    return centers, means, outliers
+
+
+@lru_cache
+def _subsets(count: int, k: int) -> tuple[np.ndarray, np.ndarray]:
+    "all the k-subsets of count points (S, k) and all the pairs of points (P, 2)"
+    if k not in CLUSTER_SIZES or k > count:
+        raise ValueError(f"cluster size must be one of {CLUSTER_SIZES} (and at most {count}), got {k}")
+    return np.array(list(combinations(range(count), k))), np.array(list(combinations(range(count), 2)))
+
+
+@lru_cache
+def _pair_membership(count: int, k: int) -> np.ndarray:
+    "(P, S) matrix telling which pairs of points belong to which k-subset"
+    subsets, pairs = _subsets(count, k)
+    member = np.zeros((len(subsets), count), dtype=bool)
+    np.put_along_axis(member, subsets, True, axis=1)
+    return (member[:, pairs[:, 0]] & member[:, pairs[:, 1]]).T.astype(float)
+
+
+def trilaterate_PA_batch(
+        markers: np.ndarray,   # (N, 4, 3) or (4, 3) markers A, B, C, D
+        distances: np.ndarray, # (N, 8) distances P1A, P1B, P1C, P1D, P2A, P2B, P2C, P2D
+        cluster_size: int = 4
+        ) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """trilaterate P1 and P2 of N positioning attempts at once; returns the candidate points (N, 2, 8, 3),
+    the cluster centers (N, 2, 3), the mean errors (N, 2), the radius inflations (N, 2, 4) and the outlier
+    candidate flags (N, 2, 8), axis 1 being P1, P2"""
+
+    distances = np.atleast_2d(np.asarray(distances, dtype=float))
+    n = len(distances)
+    markers = np.broadcast_to(np.asarray(markers, dtype=float), (n, 4, 3))
+
+    candidates, centers, means, inflations, outliers = trilaterate3D_4spheres_batch(
+        np.repeat(markers, 2, axis=0),
+        distances.reshape(2*n, 4),
+        cluster_size)
+
+    return (candidates.reshape(n, 2, 8, 3), centers.reshape(n, 2, 3), means.reshape(n, 2),
+            inflations.reshape(n, 2, 4), outliers.reshape(n, 2, 8))
+
+
+def trilaterate_4spheres(
+        markers: np.ndarray,   # (N, 4, 3) or (4, 3) markers A, B, C, D
+        distances: np.ndarray, # (N, 4) distances to markers A, B, C, D
+        method: str = 'cluster',
+        cluster_size: int = 4
+        ) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """locate N points with either method ('cluster' -> trilaterate3D_4spheres_batch, 'lsq' -> multilaterate_lsq_batch);
+    returns the points (N, 3), their error (N,) -- the cluster mean distance or the root mean square of the distance
+    residuals -- and the outlier candidate flags (N, 8) ((N, 0) for 'lsq')"""
+    if method == 'lsq':
+        points, residuals, _ = multilaterate_lsq_batch(markers, distances)
+        return points, np.sqrt((residuals**2).mean(axis=-1)), np.zeros((len(points), 0), dtype=bool)
+    _, centers, means, _, outliers = trilaterate3D_4spheres_batch(markers, distances, cluster_size)
+    return centers, means, outliers
+
+
+def multilaterate_lsq_batch(
+        markers: np.ndarray,   # (N, 4, 3) or (4, 3) markers A, B, C, D
+        distances: np.ndarray, # (N, 4) distances to markers A, B, C, D
+        iterations: int = 5
+        ) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """fit the point at the given distances from all the markers at once (linearized least squares refined with
+    gauss-newton steps); returns the points (N, 3), the distance residuals (N, 4) and the covariance of each point (N, 3, 3)
+    note: coplanar markers leave the side of the markers plane undetermined"""
+
+    distances = np.atleast_2d(np.asarray(distances, dtype=float))
+    markers = np.broadcast_to(np.asarray(markers, dtype=float), distances.shape + (3,))
+
+    # subtracting the first sphere equation from the others gives a linear system in the point coordinates:
+    #   2*(m_i - m_0) . p = r_0^2 - r_i^2 + |m_i|^2 - |m_0|^2
+    A = 2 * (markers[:, 1:] - markers[:, :1])
+    b = distances[:, :1]**2 - distances[:, 1:]**2 + (markers[:, 1:]**2).sum(axis=-1) - (markers[:, :1]**2).sum(axis=-1)
+    points = np.einsum('nij,nj->ni', np.linalg.pinv(A), b)
+    points, residuals, J = _refine_lsq(points, markers, distances, iterations)
+    dof = max(distances.shape[1] - 3, 1)
+    sigma2 = (residuals**2).sum(axis=-1) / dof
+    covariance = sigma2[:, None, None] * np.linalg.pinv(np.einsum('nki,nkj->nij', J, J))
+
+    return points, residuals, covariance
+
+
+def _refine_lsq(points: np.ndarray, markers: np.ndarray, distances: np.ndarray, iterations: int) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    "gauss-newton steps on the true residuals |p - m_i| - r_i; returns the points, their residuals and jacobian"
+    for _ in range(iterations):
+        residuals, J = _sphere_residuals(points, markers, distances)
+        points = points - np.einsum('nij,nj->ni', np.linalg.pinv(J), residuals)
+    residuals, J = _sphere_residuals(points, markers, distances)
+    return points, residuals, J
+
+
+def _sphere_residuals(points: np.ndarray, markers: np.ndarray, distances: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    "returns the residuals (N, M) of the points to the M spheres and their jacobian (N, M, 3)"
+    diff = points[:, None] - markers
+    norm = np.linalg.norm(diff, axis=-1)
+    return norm - distances, diff / norm[..., None]
+
+
+class MarkerFrames:
+    """Marker configuration prepared for trilateration: the local bases of the 4 marker triples (ABC, ABD, ACD, BCD)
+    (and, on first use, the linear least squares operator) are computed once, locating a point from its 4 distances then only
+    takes a few multiply-adds per triple. Same results as trilaterate_4spheres with these markers.
+
+    frames = MarkerFrames(markers)                    # (4, 3) markers A, B, C, D
+    points, errors, outliers = frames.locate(distances, 'cluster', 4)
+    """
+
+    __slots__ = ('markers', 'origins', 'e_x', 'e_y', 'e_z', 'd', 'i', 'j', '_lsq')
+
+    def __init__(self, markers: np.ndarray):
+        self.markers = np.array(markers, dtype=float).reshape(4, 3)
+        m = self.markers[TRIPLES]                                 # (4, 3, 3) triple, marker, xyz
+        self.origins = m[:, 0]
+        self.d, self.i, self.j, self.e_x, self.e_y, self.e_z = _triple_bases(m[:, 0], m[:, 1], m[:, 2])
+        self._lsq = None
+
+    def candidates(self, distances: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        """returns the 8 candidate intersection points (N, 8, 3) of each distance row (N, 4) and the radius inflation
+        applied to each marker triple (N, 4); same order as trilaterate3D_4spheres_batch"""
+        r = np.atleast_2d(np.asarray(distances, dtype=float))[:, TRIPLES] # (N, 4, 3)
+        x, y, z, inflation = _solve_triples(r[..., 0], r[..., 1], r[..., 2], self.d, self.i, self.j)
+
+        base = self.origins + x[..., None]*self.e_x + y[..., None]*self.e_y
+        height = z[..., None]*self.e_z
+        return np.stack([base + height, base - height], axis=2).reshape(len(r), 8, 3), inflation
+
+    def locate(self, distances: np.ndarray, method: str = 'cluster', cluster_size: int = 4, iterations: int = 5) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        "same as trilaterate_4spheres(markers, distances, method, cluster_size) (iterations: see multilaterate_lsq_batch)"
+        distances = np.atleast_2d(np.asarray(distances, dtype=float))
+        if method == 'lsq':
+            if self._lsq is None:
+                # linearized least squares (see multilaterate_lsq_batch): p = A^+ (r_0^2 - r_k^2 + |m_k|^2 - |m_0|^2)
+                A = 2 * (self.markers[1:] - self.markers[:1])
+                norms = (self.markers**2).sum(axis=-1)
+                self._lsq = np.linalg.pinv(A), norms[1:] - norms[0]
+            A_pinv, norms = self._lsq
+            points = (distances[:, :1]**2 - distances[:, 1:]**2 + norms) @ A_pinv.T
+            markers = np.broadcast_to(self.markers, distances.shape + (3,))
+            points, residuals, _ = _refine_lsq(points, markers, distances, iterations)
+            return points, np.sqrt((residuals**2).mean(axis=-1)), np.zeros((len(points), 0), dtype=bool)
+        candidates, _ = self.candidates(distances)
+        return select_cluster(candidates, cluster_size)
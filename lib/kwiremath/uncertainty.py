@@ -0,0 +1,156 @@
+import numpy as np
+from .trilateration import TRIPLES, trilaterate3D_4spheres_batch, _triple_bases
+
+# linear propagation of the measurement errors to the trilaterated points, with analytic jacobians of the solver
+# that located them; linearization of the sphere equations |p - m_i| = r_i around the solution p:
+#   d|p - m_i| = u_i . (dp - dm_i) = dr_i   (u_i unit vectors from the markers to p)
+# least squares ('lsq', 4 spheres): B = (U^T U)^-1 U^T,  dp = B (dr + [u_i . dm_i])
+# cluster ('cluster'): the cluster chosen at the solution is held fixed, its center moves with the mean of its
+# candidate points, each one the exact solution of its 3 spheres (with the radius inflation t when they don't meet:
+# |p - m_i| = r_i + t for the 3 markers and p stays in their plane); near a tangency of the spheres a candidate is
+# not linear in the inputs (it jumps between the 2 intersections and the plane), the lsq jacobians are used there
+# with independent caliper errors (sigma_distance) and marker position errors (sigma_marker, per coordinate):
+#   cov(p) = sigma_distance^2 dp/dr dp/dr^T + sigma_marker^2 sum_i dp/dm_i dp/dm_i^T
+# P1 and P2 share the markers, their errors are correlated through the marker term
+
+
+LINEAR_MARGIN = 3 # input sigmas kept between a cluster candidate and its tangency for the cluster linearization
+
+
+def position_jacobians(points: np.ndarray, markers: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """sensitivity of the points (N, 3) located from the markers (N, 4, 3) by least squares: returns dp/dr (N, 3, 4)
+    with respect to the 4 distances and dp/dm (N, 3, 4, 3) with respect to the 4 marker positions"""
+    u = points[:, None] - markers
+    u /= np.linalg.norm(u, axis=-1)[..., None]                   # (N, 4, 3)
+    B = np.linalg.pinv(u)                                         # (N, 3, 4) = (U^T U)^-1 U^T
+    return B, B[..., None] * u[:, None]
+
+
+def cluster_jacobians(
+        markers: np.ndarray,    # (N, 4, 3) or (4, 3)
+        distances: np.ndarray,  # (N, 4)
+        cluster_size: int = 4
+        ) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """same as position_jacobians for the cluster centers located by trilaterate3D_4spheres_batch: the mean of the
+    jacobians of the candidate points of the cluster (held fixed), each from its 3 sphere equations (4 with the
+    radius inflation); rows where they are not defined (unsolved or degenerate triples) are NaN.
+    Also returns the margin (N,) of the linearization: the smallest input error (distance or marker coordinate,
+    RMS over the inputs) that takes a cluster candidate to the tangency of its spheres, where its solution switches
+    between the 2 intersections and the plane of the markers; within it the candidate is far from linear"""
+    distances = np.atleast_2d(np.asarray(distances, dtype=float))
+    n = len(distances)
+    markers = np.broadcast_to(np.asarray(markers, dtype=float), (n, 4, 3))
+    candidates, _, _, inflations, outliers = trilaterate3D_4spheres_batch(markers, distances, cluster_size)
+
+    m = markers[:, TRIPLES]                                       # (N, 4, 3, 3) triple, marker, xyz
+    p = candidates.reshape(n, 4, 2, 3)                            # (N, 4, 2, 3) triple, +/- solution, xyz
+    d, i, j, e_x, e_y, e_z = _triple_bases(m[:, :, 0], m[:, :, 1], m[:, :, 2])
+    u = p[:, :, :, None] - m[:, :, None]                          # (N, 4, 2, 3, 3) triple, solution, marker, xyz
+    with np.errstate(invalid='ignore', divide='ignore'):
+        u /= np.linalg.norm(u, axis=-1)[..., None]
+
+        # inflated triples: the point is in the markers plane, it follows the plane through its barycentric weights
+        rel = p - m[:, :, None, 0]
+        b = np.einsum('ntsk,ntk->nts', rel, e_y) / j[..., None]
+        a = (np.einsum('ntsk,ntk->nts', rel, e_x) - b * i[..., None]) / d[..., None]
+    w = np.stack([1 - a - b, a, b], axis=-1)                      # (N, 4, 2, 3)
+    inflated = (inflations > 0)[:, :, None]                       # (N, 4, 1)
+
+    # unknowns (dp, dt), inputs (4 distances, 12 marker coordinates):
+    #   u_k . dp - dt = dr_k + u_k . dm_k               k = 1, 2, 3
+    #   dt = 0  or, inflated,  n . dp = n . sum_k w_k dm_k
+    M = np.zeros((n, 4, 2, 4, 4))
+    R = np.zeros((n, 4, 2, 4, 16))
+    M[..., :3, :3] = u
+    M[..., :3, 3] = -1
+    M[..., 3, :3] = np.where(inflated[..., None], e_z[:, :, None], 0)
+    M[..., 3, 3] = np.where(inflated, 0, 1)
+    for t, triple in enumerate(TRIPLES):
+        for k, marker in enumerate(triple):
+            R[:, t, :, k, marker] = 1
+            R[:, t, :, k, 4 + 3*marker:7 + 3*marker] = u[:, t, :, k]
+            R[:, t, :, 3, 4 + 3*marker:7 + 3*marker] = np.where(
+                inflated[:, t, :, None], w[:, t, :, k, None] * e_z[:, t, None], 0)
+
+    valid = np.isfinite(M).all(axis=(-2, -1)) & (np.abs(np.linalg.det(np.nan_to_num(M))) > 1e-9)
+    J = np.full((n, 4, 2, 4, 16), np.nan)
+    J[valid] = np.linalg.solve(M[valid], R[valid])
+
+    # distance to the tangency: the height over the markers plane (the inflation for inflated triples) over its gradient
+    height = np.abs(np.einsum('ntsk,ntk->nts', rel, e_z))
+    gradient = np.einsum('ntsik,nti->ntsk', J[..., :3, :], e_z)
+    distance = np.where(inflated, inflations[..., None], height)
+    gradient = np.where(inflated[..., None], J[..., 3, :], gradient)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        margin = distance / np.linalg.norm(gradient, axis=-1)
+    J = J[..., :3, :].reshape(n, 8, 3, 16)
+
+    # the center of the cluster candidates: outlier candidates (even unsolvable ones) don't count
+    cluster = ~outliers
+    J = np.where(cluster[..., None, None], J, 0).sum(axis=1) / cluster_size
+    J[~np.isfinite(J).all(axis=(-2, -1))] = np.nan
+    margin = np.where(cluster, np.nan_to_num(margin.reshape(n, 8), nan=0), np.inf).min(axis=-1)
+    return J[..., :4], J[..., 4:].reshape(n, 3, 4, 3), margin
+
+
+def PA_covariance(
+        markers: np.ndarray,    # (N, 4, 3) or (4, 3) markers A, B, C, D
+        P1: np.ndarray,         # (N, 3)
+        P2: np.ndarray,         # (N, 3)
+        sigma_distance: float,  # caliper standard deviation
+        sigma_marker: float = 0.0,
+        distances: np.ndarray = None, # (N, 8) P1A, P1B, P1C, P1D, P2A, P2B, P2C, P2D
+        method: str = 'lsq',
+        cluster_size: int = 4
+        ) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """returns the covariance of P1 (N, 3, 3), of P2 (N, 3, 3) and their cross covariance (N, 3, 3);
+    the errors are propagated through the solver that located the points: position_jacobians for 'lsq' (or without
+    distances), cluster_jacobians of the distances for 'cluster'; position_jacobians where they are not defined or
+    where the errors (LINEAR_MARGIN sigmas) can reach a tangency of the cluster spheres (see cluster_jacobians)"""
+    P1 = np.atleast_2d(P1)
+    P2 = np.atleast_2d(P2)
+    markers = np.broadcast_to(markers, (len(P1), 4, 3))
+
+    (Br1, Bm1), (Br2, Bm2) = position_jacobians(P1, markers), position_jacobians(P2, markers)
+    if method != 'lsq' and distances is not None:
+        distances = np.asarray(distances, dtype=float).reshape(len(P1), 2, 4)
+        Br, Bm, margin = cluster_jacobians(np.repeat(markers, 2, axis=0), distances.reshape(-1, 4), cluster_size)
+        linear = margin > LINEAR_MARGIN * max(sigma_distance, sigma_marker)
+        for k, (Br_k, Bm_k) in enumerate(((Br1, Bm1), (Br2, Bm2))):
+            defined = np.isfinite(Br[k::2]).all(axis=(1, 2)) & linear[k::2]
+            Br_k[defined] = Br[k::2][defined]
+            Bm_k[defined] = Bm[k::2][defined]
+
+    # each point has its own 4 caliper readings, the markers are the same for both
+    cov1 = sigma_distance**2 * Br1 @ Br1.transpose(0, 2, 1) + sigma_marker**2 * np.einsum('naic,nbic->nab', Bm1, Bm1)
+    cov2 = sigma_distance**2 * Br2 @ Br2.transpose(0, 2, 1) + sigma_marker**2 * np.einsum('naic,nbic->nab', Bm2, Bm2)
+    cov12 = sigma_marker**2 * np.einsum('naic,nbic->nab', Bm1, Bm2)
+    return cov1, cov2, cov12
+
+
+def axis_angle_sigma(P1: np.ndarray, P2: np.ndarray, cov1: np.ndarray, cov2: np.ndarray, cov12: np.ndarray) -> np.ndarray:
+    "RMS angular error (degrees, (N,)) of the P1-P2 axis: transverse error of P2 - P1 over the axis length"
+    d = np.atleast_2d(P2) - np.atleast_2d(P1)
+    length = np.linalg.norm(d, axis=-1)
+    d_hat = d / length[:, None]
+    cov_d = cov1 + cov2 - cov12 - cov12.transpose(0, 2, 1)
+    transverse = np.eye(3) - d_hat[:, :, None] * d_hat[:, None, :]
+    variance = np.einsum('nij,njk,nki->n', transverse, cov_d, transverse)
+    return np.degrees(np.sqrt(np.maximum(variance, 0)) / length)
+
+
+def PA_confidence(
+        markers: np.ndarray,    # (N, 4, 3) or (4, 3)
+        P1: np.ndarray,         # (N, 3)
+        P2: np.ndarray,         # (N, 3)
+        sigma_distance: float,
+        sigma_marker: float = 0.0,
+        distances: np.ndarray = None, # (N, 8)
+        method: str = 'lsq',
+        cluster_size: int = 4
+        ) -> tuple[np.ndarray, np.ndarray]:
+    """returns the RMS position error of P1 (N,) (same unit as the coordinates) and the RMS angular error
+    of the kwire axis (N,) (degrees), propagated through the given solver (see PA_covariance)"""
+    cov1, cov2, cov12 = PA_covariance(markers, P1, P2, sigma_distance, sigma_marker, distances, method, cluster_size)
+    position = np.sqrt(np.trace(cov1, axis1=1, axis2=2))
+    return position, axis_angle_sigma(P1, P2, cov1, cov2, cov12)
@@ -0,0 +1,194 @@
+"""Reanalysis of stored positioning attempts outside of fusion, on a process pool.
+
+Recomputes every trilateration-derived PAdata field (P1/P2, *_F distances, anatomy distances, angle, target deltas)
+from the 8 caliper distances of each record and a design snapshot exported by kwirevirtsys_fast
+(execution mode 'export design snapshot'), with the k-wire model and trilateration method given here.
+
+    python tools/reanalysis.py PAs.jsonl PAs.snapshot.npz
+    python tools/reanalysis.py results/results.sqlite3 PAs.snapshot.npz -o rerun.jsonl --method lsq --kwire-radius 1.0
+
+Records are read from a JSONL file or from the results store; the output JSONL keeps the input order, records that
+can't be recomputed are written as {"datatype": "error", ...}. Only the recomputed fields of a record change, the
+others are written as they were read. The output only depends on the inputs and the options.
+"""
+
+import os, sys, json, time, sqlite3, argparse, importlib.util
+import multiprocessing
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'lib'))
+import kwiremath as kmath
+
+
+def _load(name: str, path: str):
+    "load an add-in module by path (importing it through the commands package would need adsk)"
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+config = _load('kwirevirtsys_config', os.path.join(ROOT, 'config.py'))
+data = _load('kwirevirtsys_data', os.path.join(ROOT, 'commands', 'kwirevirtsys_fast', 'data.py'))
+
+
+# ------------------------------- SNAPSHOT ------------------------------- #
+
+class Snapshot:
+    "design data exported by kwirevirtsys_fast export_snapshot"
+
+    def __init__(self, path: str):
+        arrays = np.load(path)
+        self.markers = {}
+        self.targets = {}
+        meshes = {}
+        for key in arrays.files:
+            kind, name, *field = key.split('|')
+            if kind == 'marker':
+                self.markers[name] = arrays[key]
+            elif kind == 'target':
+                self.targets.setdefault(name, {})[field[0]] = arrays[key]
+            elif kind == 'mesh':
+                meshes.setdefault(name, {})[field[0]] = arrays[key]
+        self.meshes = {name: kmath.TriangleMesh(m['vertices'], m['triangles']) for name, m in meshes.items()}
+
+        # target P2 estimated: the target axis entry point on the skin, as kwirevirtsys_fast computes it
+        for target in self.targets.values():
+            target['P2e'] = kmath.skin_intersection(self.meshes['skin'], target['P1'], target['vector'])
+
+
+# ------------------------------- WORKERS -------------------------------- #
+
+_snapshot: Snapshot = None
+_options: argparse.Namespace = None
+
+
+def _init_worker(snapshot_path: str, options: argparse.Namespace):
+    global _snapshot, _options
+    _snapshot = Snapshot(snapshot_path)
+    _options = options
+
+
+def _error(line: int, id, e: Exception) -> str:
+    return json.dumps({"datatype": "error", "line": line, "id": id, "error": f"{type(e).__name__}: {e}"})
+
+
+def reanalyse_chunk(chunk: list[tuple[int, str]]) -> list[str]:
+    "recompute a chunk of (line number, json record) pairs; returns the output lines in the same order"
+    records = []
+    out = {}
+    for line, text in chunk:
+        try:
+            record = json.loads(text)
+            PA_data = data.PAdata.from_dict(record)
+            markers = np.array([_snapshot.markers[PA_data.markers[k]] for k in ("A", "B", "C", "D")])
+            records.append((line, record, PA_data, markers))
+        except Exception as e:
+            out[line] = _error(line, None, e)
+
+    # the trilateration of the whole chunk is a single vectorized call
+    if records:
+        markers = np.repeat(np.array([m for *_, m in records]), 2, axis=0)
+        distances = np.array([[
+            PA.P1A, PA.P1B, PA.P1C, PA.P1D, PA.P2A, PA.P2B, PA.P2C, PA.P2D] for _, _, PA, _ in records]).reshape(-1, 4) / 10
+        points, errors, _ = kmath.trilaterate_4spheres(markers, distances, _options.method, _options.cluster_size)
+        solved = np.nan_to_num(points) # rows that failed are reported below, their confidence is not used
+        with np.errstate(invalid='ignore', divide='ignore'):
+            confidence_position, confidence_angle = kmath.PA_confidence(
+                markers[::2], solved[::2], solved[1::2], _options.caliper_sigma, _options.marker_sigma,
+                distances.reshape(-1, 8), _options.method, _options.cluster_size)
+
+    for n, (line, record, PA_data, markers) in enumerate(records):
+        try:
+            P1, P2 = points[2*n], points[2*n + 1]
+            if np.isnan(P1).any() or np.isnan(P2).any():
+                raise ValueError("spheres can't be trilaterated")
+            target = _snapshot.targets[PA_data.target]
+            if target['P2e'] is None:
+                raise ValueError(f"target {PA_data.target} axis doesn't intersect the skin")
+
+            fields = kmath.PA_metrics(
+                dict(zip(("A", "B", "C", "D"), markers)), P1, P2,
+                target['P1'], target['P2'], target['P2e'],
+                _snapshot.meshes['skin'], {name: _snapshot.meshes[name] for name in PA_data.anatomy},
+                _options.kwire_radius, _options.kwire_length)
+            fields["P1_mean"] = round(float(errors[2*n])*10, 3)
+            fields["P2_mean"] = round(float(errors[2*n + 1])*10, 3)
+            fields["confidence_position"] = round(float(confidence_position[n])*10, 3)
+            fields["confidence_angle"] = round(float(confidence_angle[n]), 3)
+
+            # the other fields are written as they were read (the missing ones stay missing)
+            record.update(fields)
+            out[line] = json.dumps(record, sort_keys=False)
+        except Exception as e:
+            out[line] = _error(line, PA_data.id, e)
+
+    return [out[line] for line, _ in chunk]
+
+
+# -------------------------------- INPUT --------------------------------- #
+
+def read_records(path: str):
+    "yields (line number, json record) from a JSONL file or from the results store (row number)"
+    if path.endswith(('.sqlite3', '.sqlite', '.db')):
+        conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+        for row, (record,) in enumerate(conn.execute("SELECT record FROM PA_results ORDER BY id"), start=1):
+            yield row, record
+        conn.close()
+        return
+    with open(path, 'r', encoding='utf-8') as f:
+        for line, text in enumerate(f, start=1):
+            if text.strip() != "":
+                yield line, text
+
+
+def chunked(iterable, size: int):
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('records', help='PA records: JSONL file or results store (.sqlite3)')
+    parser.add_argument('snapshot', help='design snapshot (.npz) exported by kwirevirtsys_fast')
+    parser.add_argument('-o', '--output', help='output JSONL (default: <records>.reanalysis.jsonl)')
+    parser.add_argument('--method', choices=('cluster', 'lsq'), default=config.TRILATERATION_METHOD)
+    parser.add_argument('--cluster-size', type=int, choices=kmath.CLUSTER_SIZES, default=config.CLUSTER_SIZE)
+    parser.add_argument('--kwire-radius', type=float, default=config.KWIRE_RADIUS*10, help='mm')
+    parser.add_argument('--kwire-length', type=float, default=config.KWIRE_LENGTH*10, help='mm')
+    parser.add_argument('--caliper-sigma', type=float, default=config.CALIPER_SIGMA_MM, help='mm')
+    parser.add_argument('--marker-sigma', type=float, default=config.MARKER_SIGMA_MM, help='mm')
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    parser.add_argument('--chunk', type=int, default=256, help='records per work unit')
+    args = parser.parse_args()
+
+    options = argparse.Namespace(
+        method=args.method, cluster_size=args.cluster_size,
+        kwire_radius=args.kwire_radius/10, kwire_length=args.kwire_length/10,
+        caliper_sigma=args.caliper_sigma/10, marker_sigma=args.marker_sigma/10)
+    output = args.output or f"{os.path.splitext(args.records)[0]}.reanalysis.jsonl"
+
+    time_start = time.perf_counter()
+    count = errors = 0
+    with multiprocessing.Pool(args.workers, _init_worker, (args.snapshot, options)) as pool, \
+            open(output, 'w', encoding='utf-8') as out:
+        # imap keeps the chunk order, so the output is deterministic whatever the number of workers
+        for lines in pool.imap(reanalyse_chunk, chunked(read_records(args.records), args.chunk)):
+            for line in lines:
+                out.write(line + '\n')
+                count += 1
+                errors += line.startswith('{"datatype": "error"')
+
+    elapsed = time.perf_counter() - time_start
+    print(f'{count} records ({errors} errors) reanalysed in {elapsed:.1f} s - {count/elapsed:.0f} records/s\n'
+          f'method: {args.method} - kwire: radius {args.kwire_radius} mm, length {args.kwire_length} mm\nresults: {output}')
+
+
+if __name__ == '__main__':
+    main()